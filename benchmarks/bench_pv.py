@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+"""
+   Throughput and latency of the Pv get, put, monitor and wait paths
+
+   Runs against the simulated backend in psp.sim, so no IOC is needed and the
+   numbers measure the Python overhead of psp itself. Every path is measured
+   with scalar and waveform values and with one and several threads, each
+   thread using its own PV. Monitor dispatch is also measured with one and
+   many callbacks per PV, with and without monitor_append.
+
+   Monitor dispatch is timed from the simulated record processing to the
+   return of the last callback, on the calling thread. wait_for_value is
+   timed from the value change request to the return of the wait.
+
+   Results are printed as a table and can be saved as JSON with --json. A
+   previous JSON file given with --compare adds the throughput ratio of each
+   case to the table.
+
+   Usage: python benchmarks/bench_pv.py [-n ITERATIONS] [-t THREADS]
+                                        [-w WAVEFORM] [-c CALLBACKS]
+                                        [-k CASES] [--json FILE]
+                                        [--compare FILE]
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import threading
+
+os.environ['PSP_BACKEND'] = 'sim'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from psp import sim
+from psp import utils
+from psp.Pv import Pv
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+OPS = ['get', 'put', 'monitor', 'wait_for_value']
+
+
+def percentile(ordered, fraction):
+    """
+    Return the given fraction of a sorted list, by nearest rank
+    """
+    if not ordered:
+        return float('nan')
+    index = int(round(fraction * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def make_value(shape, i, waveform):
+    if shape == 'scalar':
+        return float(i)
+    if np is not None:
+        return np.full(waveform, float(i))
+    return [float(i)] * waveform
+
+
+class Case(object):
+    """
+    One combination of operation, value shape, callbacks, threads and
+    monitor_append
+    """
+    def __init__(self, op, shape, threads=1, callbacks=0, append=False):
+        self.op = op
+        self.shape = shape
+        self.threads = threads
+        self.callbacks = callbacks
+        self.append = append
+
+    @property
+    def name(self):
+        name = '%s/%s/%dt' % (self.op, self.shape, self.threads)
+        if self.op == 'monitor':
+            name += '/%dcb' % self.callbacks
+            if self.append:
+                name += '/append'
+        return name
+
+    def setup(self, index, waveform):
+        """
+        Create and connect the PV used by one thread
+        """
+        pvname = 'BENCH:%s:%d' % (self.name.replace('/', ':'), index)
+        sim.add_pv(pvname, make_value(self.shape, 0, waveform))
+        pv = Pv(pvname)
+        pv.connect(1.0)
+        pv.get(timeout=1.0)
+        if self.op == 'monitor':
+            pv.monitor_start(monitor_append=self.append)
+            for _ in range(self.callbacks):
+                pv.add_monitor_callback(lambda e: None)
+        elif self.op == 'wait_for_value':
+            pv.monitor_start()
+        return pv
+
+    def operation(self, pv, waveform):
+        """
+        Return a function running one iteration of the case on the PV
+        """
+        if self.op == 'get':
+            return lambda i: pv.get(timeout=1.0)
+        values = [make_value(self.shape, i, waveform) for i in (1, 2)]
+        if self.op == 'put':
+            return lambda i: pv.put(values[i % 2], timeout=1.0)
+        record = sim.get_record(pv.name)
+        if self.op == 'monitor':
+            return lambda i: record.process(values[i % 2])
+        def wait(i):
+            sim.set_value(pv.name, values[i % 2])
+            if not pv.wait_for_value(values[i % 2], timeout=1.0):
+                raise RuntimeError('%s did not reach its value' % pv.name)
+        return wait
+
+    def teardown(self, pv):
+        pv.monitor_stop()
+        pv.disconnect()
+        sim.remove_pv(pv.name)
+
+    def run(self, iterations, waveform):
+        """
+        Run the case and return its results as a dictionary
+        """
+        pvs = [self.setup(index, waveform) for index in range(self.threads)]
+        per_thread = max(iterations // self.threads, 1)
+        latencies = [[] for _ in pvs]
+        errors = []
+        start = threading.Event()
+
+        def worker(pv, samples):
+            op = self.operation(pv, waveform)
+            clock = time.time
+            start.wait()
+            try:
+                for i in range(per_thread):
+                    t0 = clock()
+                    op(i)
+                    samples.append(clock() - t0)
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=worker, args=args)
+                   for args in zip(pvs, latencies)]
+        for t in threads:
+            t.start()
+        t0 = time.time()
+        start.set()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - t0
+        for pv in pvs:
+            self.teardown(pv)
+        if errors:
+            raise errors[0]
+
+        ordered = sorted(sum(latencies, []))
+        return {'name'      : self.name,
+                'op'        : self.op,
+                'shape'     : self.shape,
+                'threads'   : self.threads,
+                'callbacks' : self.callbacks,
+                'append'    : self.append,
+                'count'     : len(ordered),
+                'elapsed'   : elapsed,
+                'ops_per_s' : len(ordered) / elapsed,
+                'p50_us'    : percentile(ordered, 0.50) * 1e6,
+                'p99_us'    : percentile(ordered, 0.99) * 1e6,
+                'max_us'    : ordered[-1] * 1e6}
+
+
+def make_cases(threads, callbacks):
+    cases = []
+    for op in OPS:
+        for shape in ('scalar', 'waveform'):
+            for nthreads in sorted(set([1, threads])):
+                if op != 'monitor':
+                    cases.append(Case(op, shape, nthreads))
+                    continue
+                for ncb in sorted(set([1, callbacks])):
+                    for append in (False, True):
+                        cases.append(Case(op, shape, nthreads, ncb, append))
+    return cases
+
+
+def metadata(args):
+    return {'time'       : time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'host'       : socket.gethostname(),
+            'python'     : platform.python_version(),
+            'numpy'      : np.__version__ if np is not None else None,
+            'iterations' : args.iterations,
+            'waveform'   : args.waveform}
+
+
+def load_baseline(path):
+    f = open(path)
+    try:
+        report = json.load(f)
+    finally:
+        f.close()
+    return dict((r['name'], r) for r in report['results'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('-n', '--iterations', type=int, default=2000)
+    parser.add_argument('-t', '--threads', type=int, default=4)
+    parser.add_argument('-w', '--waveform', type=int, default=1000,
+                        help='number of waveform elements')
+    parser.add_argument('-c', '--callbacks', type=int, default=100,
+                        help='monitor callbacks per PV in the many case')
+    parser.add_argument('-k', '--cases', default='',
+                        help='only run cases whose name contains this text')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='JSON results of a previous run')
+    args = parser.parse_args()
+
+    if np is not None:
+        utils.set_numpy(True)
+    baseline = load_baseline(args.compare) if args.compare else {}
+
+    results = []
+    header = '%-36s %12s %10s %10s' % ('case', 'ops/s', 'p50 us', 'p99 us')
+    if baseline:
+        header += ' %8s' % 'ratio'
+    print(header)
+    for case in make_cases(args.threads, args.callbacks):
+        if args.cases not in case.name:
+            continue
+        result = case.run(args.iterations, args.waveform)
+        results.append(result)
+        line = '%-36s %12.0f %10.1f %10.1f' % (result['name'],
+                                               result['ops_per_s'],
+                                               result['p50_us'],
+                                               result['p99_us'])
+        if result['name'] in baseline:
+            old = baseline[result['name']]['ops_per_s']
+            line += ' %8.2f' % (result['ops_per_s'] / old)
+        print(line)
+        sys.stdout.flush()
+
+    if args.json:
+        f = open(args.json, 'w')
+        try:
+            json.dump({'meta' : metadata(args), 'results' : results}, f,
+                      indent=2, sort_keys=True)
+        finally:
+            f.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+   Microbenchmark of utils.TimeoutSem
+
+   Compares the original implementation, which starts a threading.Timer for
+   every timed acquire, with the current one using utils.TimedLock. Each case
+   is run uncontended and with several threads sharing one lock, which each
+   thread holds for a short busy wait so that the others have to queue.
+
+   Usage: python benchmarks/bench_timeoutsem.py [-n ITERATIONS] [-t THREADS]
+                                                [--hold SECONDS]
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import argparse
+import threading
+
+os.environ.setdefault('PSP_BACKEND', 'sim')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from psp import utils
+
+
+class LegacyTimeoutSem(object):
+    """
+    The TimeoutSem shipped with psp 2.2.0, kept for comparison
+    """
+    def __init__(self, sem, timeout=-1):
+        self.sem = sem
+        self.timeout = timeout
+
+    def __enter__(self):
+        self.acq = False
+        if self.timeout < 0:
+            self.acq = self.sem.acquire(True)
+        elif self.timeout == 0:
+            self.acq = self.sem.acquire(False)
+        else:
+            self.tmo = threading.Timer(self.timeout, self.raise_tmo)
+            self.tmo.start()
+            self.acq = self.sem.acquire(True)
+            self.tmo.cancel()
+        if not self.acq:
+            self.raise_tmo()
+
+    def __exit__(self, type, value, traceback):
+        try:
+            if self.acq:
+                self.sem.release()
+        except threading.ThreadError:
+            pass
+        try:
+            self.tmo.cancel()
+        except AttributeError:
+            pass
+
+    def raise_tmo(self):
+        raise threading.ThreadError("semaphore acquire timed out")
+
+
+def hold_for(seconds):
+    """
+    Busy wait, as time.sleep is too coarse for a critical section
+    """
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+def run(sem_cls, lock, iterations, nthreads, hold, timeout=1.0):
+    """
+    Return the acquire/release rate with nthreads sharing the lock, and the
+    mean and maximum time in seconds taken by an acquire
+    """
+    per_thread = iterations // nthreads
+    waits = []
+    def worker():
+        total = 0.0
+        longest = 0.0
+        for _ in range(per_thread):
+            start = time.time()
+            with sem_cls(lock, timeout):
+                waited = time.time() - start
+                hold_for(hold)
+            total += waited
+            longest = max(longest, waited)
+        waits.append((total, longest))
+    threads = [threading.Thread(target=worker) for _ in range(nthreads)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    count = per_thread * nthreads
+    return (count / elapsed, sum(w[0] for w in waits) / count,
+            max(w[1] for w in waits))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('-n', '--iterations', type=int, default=20000)
+    parser.add_argument('-t', '--threads', type=int, default=4)
+    parser.add_argument('--hold', type=float, default=20e-6,
+                        help='seconds each thread holds the lock')
+    args = parser.parse_args()
+
+    cases = [('legacy TimeoutSem + Lock', LegacyTimeoutSem, threading.Lock),
+             ('TimeoutSem + Lock', utils.TimeoutSem, threading.Lock),
+             ('TimeoutSem + TimedLock', utils.TimeoutSem, utils.TimedLock)]
+    print('%-28s %14s %14s %12s %12s'
+          % ('case', '1 thread', '%d threads' % args.threads,
+             'mean acquire', 'max acquire'))
+    for (name, sem_cls, lock_cls) in cases:
+        (single, _, _) = run(sem_cls, lock_cls(), args.iterations, 1,
+                             args.hold)
+        lock = lock_cls()
+        (multi, mean, longest) = run(sem_cls, lock, args.iterations,
+                                     args.threads, args.hold)
+        print('%-28s %10.0f/s   %10.0f/s %9.1f us %9.1f us'
+              % (name, single, multi, mean * 1e6, longest * 1e6))
+        if isinstance(lock, utils.TimedLock):
+            stats = lock.stats()
+            if stats['contended']:
+                print('%-28s %d contended acquires, %.1f us mean wait'
+                      % ('', stats['contended'],
+                         stats['wait_time'] / stats['contended'] * 1e6))
+            print('%-28s %s' % ('', stats))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,11 +3,20 @@ import sys
 import time
 import warnings
 import threading
+import weakref
 import traceback
+import collections
 import numpy as np
 
-import pyca
+from .backend import pyca
 from . import utils
+from . import buffers
+from . import dispatch
+from . import filters
+from . import metrics
+from . import profiling
+from .stats import RunningStats
+from .cache import PvCache
 
 """
    Pv module
@@ -24,9 +33,78 @@ def now():
 
 logprint        = print
 DEBUG           = 0
-pv_cache        = {}
-pyca_sems       = {}
+pv_cache        = PvCache(on_evict=lambda pv: _evict_pv(pv))
+# One lock per PV name, kept for as long as a Pv of that name exists
+pyca_sems       = weakref.WeakValueDictionary()
+_pyca_sems_lock = threading.Lock()
+enum_cache      = {}
+_enum_stale     = set()
+default_dispatcher = None
 DEFAULT_TIMEOUT = 1.0
+# Threads fetching ENUM strings concurrently for get_many
+_ENUM_WORKERS   = 16
+
+
+class PutCompletion(object):
+    """
+    Handle to a put made with :meth:`.Pv.put_async`
+
+    Attributes
+    ----------
+    pv : :class:`.Pv`
+        The PV written to
+
+    value : float, int, str or array
+        The value written
+
+    error : str or None
+        A description of the error if the put failed
+    """
+    def __init__(self, pv, value, callback=None):
+        self.pv       = pv
+        self.value    = value
+        self.error    = None
+        self.callback = callback
+        self.__done   = threading.Event()
+
+
+    def done(self):
+        """
+        Whether the put has completed
+        """
+        return self.__done.is_set()
+
+
+    def wait(self, timeout=None):
+        """
+        Wait for the put to complete
+
+        Parameters
+        ----------
+        timeout : float or None, optional
+            Maximum time to wait. If None, wait indefinitely
+
+        Returns
+        -------
+        result : bool
+            Whether or not the put has completed. Check :attr:`error` to
+            learn whether it succeeded
+        """
+        self.__done.wait(timeout)
+        return self.__done.is_set()
+
+
+    def _complete(self, error=None):
+        if self.__done.is_set():
+            return
+        self.error = error
+        self.__done.set()
+        if self.callback is not None:
+            try:
+                self.callback(error)
+            except Exception:
+                logprint("Exception in put callback for {}:".format(self.pv.name))
+                traceback.print_exc()
 
 
 class Pv(pyca.capv):
@@ -93,14 +171,54 @@ class Pv(pyca.capv):
         :attr:`.Pv.values`. This is useful if you want to catch all the value
         updates but you don't want to constantly poll the value of the PV. 
     
-    values : list
+    values : list or array
         If the PV is being monitored with monitor_append set, updates to the PV
-        value will be saved to this list. 
+        value will be saved to this list. If :attr:`.monitor_maxlen` is set
+        this is instead a read-only NumPy view of the :attr:`.monitor_buffer`
     
-    timestamps : list
+    timestamps : list or array
         If the PV object is in a mode where timestamps are included in the
         channel monitor, the timestamp of each monitor append will be saved to
         this list
+
+    monitor_maxlen : int or None
+        The maximum number of monitor updates kept when monitor_append is set.
+        None means the history is unbounded
+
+    monitor_buffer : :class:`.buffers.RingBuffer` or None
+        The preallocated storage used when :attr:`.monitor_maxlen` is set. Its
+        ``dropped`` attribute counts the updates that have been overwritten
+
+    monitor_stats : :class:`.stats.RunningStats` or None
+        Running statistics of the monitor updates, kept when monitoring is
+        started with ``stats=True``. These do not require monitor_append
+
+    monitor_max_rate : float or None
+        When set, at most this many monitor events per second are appended,
+        added to the statistics and passed to the callbacks. Events arriving
+        sooner only update :attr:`.value`. The newest one is processed at the
+        end of the interval if :attr:`.monitor_flush` is set, and when the
+        monitor is stopped. See :class:`.filters.RateLimiter`
+
+    monitor_flush : bool
+        Whether coalesced monitor events are flushed at the end of each
+        :attr:`.monitor_max_rate` interval
+
+    monitor_deadband : :class:`.filters.Deadband` or None
+        When set, monitor events that change the value by less than the
+        deadband only update :attr:`.value`. They are not appended, added to
+        the statistics or passed to the callbacks, and are counted in its
+        ``filtered`` attribute
+
+    value_ring : :class:`.buffers.ValueRing` or None
+        Preallocated arrays that monitored waveforms are copied into, see
+        :meth:`.set_value_buffers`. Updates appended to an unbounded
+        :attr:`.values` list are copied out of them
+
+    monitor_dispatcher : :class:`.dispatch.MonitorDispatcher` or None
+        Run the monitor callbacks of this PV on the worker threads of a
+        dispatcher instead of the Channel Access thread. If None, the one set
+        with :func:`.set_monitor_dispatcher` is used, if any
     """
     def __init__(self, name, initialize=False, count=None,
                  control=False, monitor=False, use_numpy=None,
@@ -112,10 +230,16 @@ class Pv(pyca.capv):
         utils.ensure_context()
         self.__con_sem = threading.Event()
         self.__init_sem = threading.Event()
-        if name in pyca_sems:
-            self.__pyca_sem = pyca_sems[name]
-        else:
-            self.__pyca_sem = pyca_sems[name] = threading.Lock()
+        self.__get_lock = threading.Lock()
+        self.__get_cbs = []
+        self.__put_lock = threading.Lock()
+        self.__put_pending = collections.deque()
+        with _pyca_sems_lock:
+            self.__pyca_sem = pyca_sems.get(name)
+            if self.__pyca_sem is None:
+                self.__pyca_sem = pyca_sems[name] = utils.TimedLock()
+        self.__connect_start = None
+        self.__was_connected = False
         
         #Callback handlers / storage
         self.cbid = 1
@@ -124,6 +248,7 @@ class Pv(pyca.capv):
         self.connect_cb  = self.__connection_handler
         self.monitor_cb  = self.__monitor_handler
         self.getevt_cb   = self.__getevt_handler
+        self.putevt_cb   = self.__putevt_handler
         
         #State variables 
         self.ismonitored    = False
@@ -136,6 +261,16 @@ class Pv(pyca.capv):
         self.use_numpy = use_numpy
         self.do_initialize = initialize
         
+        self.monitor_dispatcher = None
+        self.value_ring = None
+        self.monitor_max_rate = None
+        self.monitor_flush    = True
+        self.monitor_deadband = None
+        self.__limiter = None
+        self.monitor_maxlen = None
+        self.monitor_buffer = None
+        self.monitor_stats  = None
+        self.__stats_skip   = True
         self.timestamps = []
         self.values     = []
 
@@ -165,8 +300,21 @@ class Pv(pyca.capv):
         Called by Channel Access when connection state changes
         """
         self.isconnected = isconnected
+
+        if metrics.enabled:
+            if not isconnected:
+                metrics.count(self.name, 'disconnects')
+            elif self.__connect_start is not None:
+                metrics.record(self.name, 'connect',
+                               time.time() - self.__connect_start)
+        self.__connect_start = None
         
         if isconnected:
+            # On a reconnect, the IOC may have been rebuilt with different
+            # ENUM strings
+            if self.__was_connected and self.name in enum_cache:
+                _enum_stale.add(self.name)
+            self.__was_connected = True
             self.__con_sem.set()
         else:
             self.__con_sem.clear()
@@ -183,7 +331,7 @@ class Pv(pyca.capv):
         
         for (id, cb) in self.con_cbs.items():
             try:
-                cb(isconnected)
+                self.__run_callback('connection', id, cb, isconnected)
             except Exception:
                 logprint("Exception in connection callback for {}:".format(self.name))
                 traceback.print_exc()
@@ -193,10 +341,38 @@ class Pv(pyca.capv):
         """
         Called when data is requested over the Channel
         """
+        if not self.isinitialized:
+            self.__init_handler(e)
+        
+        with self.__get_lock:
+            cbs, self.__get_cbs = self.__get_cbs, []
+        
+        for cb in cbs:
+            try:
+                cb(e)
+            except Exception:
+                logprint("Exception in get callback for {}:".format(self.name))
+                traceback.print_exc()
+
+
+    def __putevt_handler(self, e=None):
+        """
+        Called when the IOC has finished processing a put
+        """
+        with self.__put_lock:
+            if not self.__put_pending:
+                return
+            request = self.__put_pending.popleft()
+        request._complete(e)
+
+
+    def __init_handler(self, e=None):
+        """
+        Called when the first data arrives over the Channel
+        """
         if e == None:
             self.isinitialized = True
             self.do_initialize = False
-            self.getevt_cb = None
             if self.do_monitor:
                 self.monitor(pyca.DBE_VALUE | pyca.DBE_LOG | pyca.DBE_ALARM,
                              self.control, self.count)
@@ -209,24 +385,99 @@ class Pv(pyca.capv):
         Called during a monitor event
         """
         if not self.isinitialized:
-            self.__getevt_handler(e)
+            self.__init_handler(e)
+        if metrics.enabled:
+            metrics.count(self.name, 'events')
+        deadband = self.monitor_deadband
+        if (deadband is not None and e == None
+                and not deadband.accept(self.value, (self.severity,
+                                                     self.status))):
+            return
+        if self.monitor_max_rate:
+            limiter = self.__limiter
+            if (limiter is None or limiter.max_rate != self.monitor_max_rate
+                    or limiter.flush != self.monitor_flush):
+                limiter = filters.RateLimiter(self.__process_monitor,
+                                              self.monitor_max_rate,
+                                              self.monitor_flush)
+                self.__limiter = limiter
+            limiter(e)
+        else:
+            self.__process_monitor(e)
+
+
+    def __process_monitor(self, e=None):
+        """
+        Store a monitor event and run the callbacks
+        """
+        if self.value_ring is not None and e == None:
+            self.data['value'] = self.value_ring.store(self.data['value'])
         if self.monitor_append:
-            self.values.append(self.value)
-            self.timestamps.append(self.timestamp())
+            if self.monitor_buffer is not None:
+                self.monitor_buffer.append(self.value, self.timestamp())
+            elif self.value_ring is not None:
+                # The ring slots are reused, keep a copy
+                self.values.append(np.array(self.value))
+                self.timestamps.append(self.timestamp())
+            else:
+                self.values.append(self.value)
+                self.timestamps.append(self.timestamp())
+        if self.monitor_stats is not None:
+            # Like monitor_get, skip the value sent when the monitor starts
+            if self.__stats_skip:
+                self.__stats_skip = False
+            else:
+                self.monitor_stats.add(self.value)
+        if self.mon_cbs:
+            dispatcher = self.monitor_dispatcher or default_dispatcher
+            if dispatcher is not None:
+                dispatcher.submit(self, e, dict(self.data))
+            else:
+                self._run_monitor_callbacks(e)
+        if e == None:
+            if DEBUG != 0:
+                logprint("%s monitoring %s %s" % (utils.now(), self.name, self.timestr()))
+                logprint(self.value)
+        else:
+            logprint("%-30s %s" % (self.name, e))
+
+
+    def _run_monitor_callbacks(self, e=None):
+        """
+        Run the user monitor callbacks, inline or from a dispatcher
+        """
         for (id, (cb, once)) in self.mon_cbs.items():
             try:
-                cb(e)
+                self.__run_callback('monitor', id, cb, e)
             except Exception:
                 logprint("Exception in monitor callback for {}:".format(self.name))
                 traceback.print_exc()
             if once and e == None:
                 self.del_monitor_callback(id)
-        if e == None:
-            if DEBUG != 0:
-                logprint("%s monitoring %s %s" % (utils.now(), self.name, self.timestr()))
-                logprint(self.value)
+
+
+    def __run_callback(self, kind, id, cb, arg):
+        """
+        Run a monitor or connection callback, timing it when the metrics or
+        the callback profiler are enabled
+        """
+        timed = metrics.enabled and kind == 'monitor'
+        if profiling.enabled:
+            # Both share the run time measured by the profiler
+            profiling.call(self.name, kind, id, cb, arg,
+                           self.__record_callback if timed else None)
+        elif timed:
+            start = time.time()
+            try:
+                cb(arg)
+            finally:
+                self.__record_callback(time.time() - start)
         else:
-            logprint("%-30s %s" % (self.name, e))
+            cb(arg)
+
+
+    def __record_callback(self, seconds):
+        metrics.record(self.name, 'callback', seconds)
 
 
     def add_connection_callback(self, cb):
@@ -271,9 +522,11 @@ class Pv(pyca.capv):
             If the id does not correspond to an existing callback    
         """
         del self.con_cbs[id]
+        profiling.forget(self.name, 'connection', id)
 
 
-    def add_monitor_callback(self, cb, once=False):
+    def add_monitor_callback(self, cb, once=False, max_rate=None, flush=True,
+                             deadband=None, rel_deadband=None):
         """
         Add a monitor callback
 
@@ -284,6 +537,27 @@ class Pv(pyca.capv):
             a monitor event. The function must accept one boolean variable
             which represents the success of the connection attempt.
 
+        once : bool, optional
+            Remove the callback after the first successful monitor event
+
+        max_rate : float, optional
+            Run the callback at most this many times per second. Events in
+            between are coalesced, see :class:`.filters.RateLimiter`. Ignored
+            if once is set
+
+        flush : bool, optional
+            When max_rate is set, run the callback once more at the end of an
+            interval in which events were coalesced, so that the newest value
+            is always seen
+
+        deadband : float or array, optional
+            Skip events that change the value by at most this much since the
+            last event passed to the callback, see :class:`.filters.Deadband`
+
+        rel_deadband : float, optional
+            Skip events that change the value by at most this fraction of the
+            last value passed to the callback
+
         Returns
         -------
         id : int
@@ -294,6 +568,12 @@ class Pv(pyca.capv):
         --------
         :meth:`.add_connection_callback`
         """ 
+        if max_rate and not once:
+            cb = filters.RateLimiter(cb, max_rate, flush)
+        if deadband is not None or rel_deadband is not None:
+            cb = filters.FilteredCallback(cb, self,
+                                          filters.Deadband(deadband,
+                                                           rel_deadband))
         id = self.cbid
         self.cbid += 1
         self.mon_cbs[id] = (cb, once)
@@ -314,7 +594,42 @@ class Pv(pyca.capv):
         KeyError
             If the id does not correspond to an existing callback    
         """
-        del self.mon_cbs[id]
+        (cb, once) = self.mon_cbs.pop(id)
+        if isinstance(cb, (filters.RateLimiter, filters.FilteredCallback)):
+            cb.cancel()
+        profiling.forget(self.name, 'monitor', id)
+
+
+    def create_channel(self):
+        """
+        Start the search for the channel, noting the time for the connect
+        latency metrics
+        """
+        self.__connect_start = time.time() if metrics.enabled else None
+        try:
+            super(Pv, self).create_channel()
+        except pyca.pyexc:
+            self.__connect_start = None
+            raise
+
+
+    def __locked_request(self, op, tmo, request, *args):
+        """
+        Run a blocking get_data or put_data holding the PV lock
+
+        With metrics enabled, the time spent waiting for the lock and the
+        time of the request itself are recorded separately.
+        """
+        if not metrics.enabled:
+            with utils.TimeoutSem(self.__pyca_sem, tmo):
+                request(*args)
+            return
+        start = time.time()
+        with utils.TimeoutSem(self.__pyca_sem, tmo):
+            locked = time.time()
+            metrics.record(self.name, 'lock_wait', locked - start)
+            request(*args)
+        metrics.record(self.name, op, time.time() - locked)
 
 
     def connect(self, timeout=None):
@@ -366,6 +681,11 @@ class Pv(pyca.capv):
     def disconnect(self):
         """
         Disconnect the associated channel
+
+        Channel Access drops the callbacks of the requests still outstanding,
+        so the pending :meth:`.put_async` handles fail with a 'channel
+        cleared' error and the pending :meth:`.get_async` callbacks are
+        forgotten.
         """
         try:
             self.clear_channel()
@@ -376,10 +696,19 @@ class Pv(pyca.capv):
 
         self.__con_sem.clear()
         self.isconnected = False
+
+        with self.__get_lock:
+            self.__get_cbs = []
+        with self.__put_lock:
+            pending, self.__put_pending = (self.__put_pending,
+                                           collections.deque())
+        for request in pending:
+            request._complete("channel cleared for PV %s" % self.name)
   
 
     def monitor(self, mask=pyca.DBE_VALUE | pyca.DBE_LOG | pyca.DBE_ALARM,
-                ctrl=None, count=None):
+                ctrl=None, count=None, max_rate=None, deadband=None,
+                rel_deadband=None):
         """
         Subscribe to monitor events from the PV channel
         
@@ -401,11 +730,31 @@ class Pv(pyca.capv):
         count : int, optional
             Subsection of waveform record to monitor. By default,
             :attr:`.count` is used
+
+        max_rate : float, optional
+            Process at most this many monitor events per second, see
+            :attr:`.monitor_max_rate`. By default, the current setting is
+            kept. Use 0 to process every event again
+
+        deadband : float or array, optional
+            Ignore events that change the value by at most this much, see
+            :attr:`.monitor_deadband`. An array gives a deadband per waveform
+            element. By default, the current setting is kept
+
+        rel_deadband : float, optional
+            Ignore events that change the value by at most this fraction of
+            the last processed value
         
         See Also
         --------
         :meth:`.monitor_start`, :meth:`.monitor_stop`
         """
+        if max_rate is not None:
+            self.monitor_max_rate = max_rate or None
+
+        if deadband is not None or rel_deadband is not None:
+            self.monitor_deadband = filters.Deadband(deadband, rel_deadband)
+        
         if not self.isconnected:
             self.connect(DEFAULT_TIMEOUT)
         
@@ -448,6 +797,8 @@ class Pv(pyca.capv):
         """
         self.unsubscribe_channel()
         self.ismonitored = False
+        if self.__limiter is not None:
+            self.__limiter.deliver_pending()
 
 
     def get(self, count=None, timeout=DEFAULT_TIMEOUT, as_string=False, **kw):
@@ -486,6 +837,10 @@ class Pv(pyca.capv):
         ------
         pyca.pyexc
             If PV connection fails
+
+        threading.ThreadError
+            If another get or put on the same PV holds the channel for longer
+            than the timeout
         """
         if not count:
             count = self.count
@@ -512,26 +867,76 @@ class Pv(pyca.capv):
         if not self.isconnected and not self.connect(DEFAULT_TIMEOUT):
             raise pyca.pyexc, "get: connection timedout for PV %s" % self.name
         
-        with utils.TimeoutSem(self.__pyca_sem, tmo):
-            self.get_data(ctrl, tmo, count)
+        self.__locked_request('get', tmo, self.get_data, ctrl, tmo, count)
         
         if tmo > 0 and DEBUG != 0:
             logprint("got %s\n" % self.value.__str__())
         
         if as_string:
-            if self.type() == 'DBF_ENUM':
-                enums = self.get_enum_set(timeout=tmo)
-                if len(enums) > self.value >= 0:
-                    return enums[self.value]
-                else:
-                    raise IndexError('{:} is not a valid enumeration '\
-                                     'of {:}'.format(self.value,self.name))
-            else:
-                return str(self.value)
+            return self._as_string(tmo)
 
         return self.value
 
 
+    def _as_string(self, timeout):
+        """
+        Return the current value as a string, translating ENUM values
+        """
+        if self.type() == 'DBF_ENUM':
+            self.get_enum_set(timeout=timeout)
+            return self.enum_string()
+        else:
+            return str(self.value)
+
+
+    def get_async(self, callback=None, ctrl=None, count=None):
+        """
+        Request the value of the PV without waiting for the response
+
+        The request is only queued, it is sent once :func:`pyca.flush_io` is
+        called. This allows many requests to be sent over the network at once.
+        When the data arrives :attr:`.value` and :attr:`.data` are updated and
+        the callback is run on the Channel Access thread.
+
+        Parameters
+        ----------
+        callback : callable, optional
+            A function to be run when the data arrives. The function must
+            accept one argument, which is None on success or a description of
+            the error
+
+        ctrl : bool, optional
+            Whether to get the control form information. By default,
+            :attr:`.control` is used
+
+        count : int, optional
+            Maximum number of array elements to be return. By default uses
+            :attr:`.count`
+
+        Raises
+        ------
+        pyca.pyexc
+            If the PV is not connected
+
+        See Also
+        --------
+        :func:`.get_many`
+        """
+        if not self.isconnected:
+            raise pyca.pyexc, "get: PV %s is not connected" % self.name
+        
+        if ctrl == None:
+            ctrl = self.control
+        
+        if not count:
+            count = self.count
+        
+        with self.__get_lock:
+            self.get_data(ctrl, -1.0, count)
+            if callback is not None:
+                self.__get_cbs.append(callback)
+
+
     def put(self, value, timeout = DEFAULT_TIMEOUT, **kw):
         """
         Set the PV value
@@ -551,8 +956,16 @@ class Pv(pyca.capv):
         -------
         value : float, int, str, or array
             The value given to the PV
+
+        Raises
+        ------
+        threading.ThreadError
+            If another get or put on the same PV holds the channel for longer
+            than the timeout
         
-        TODO : Add a put_complete which confirms the success of the function
+        See Also
+        --------
+        :meth:`.put_async`
         """
         if DEBUG != 0:
             logprint("caput %s in %s\n" % (value, self.name))
@@ -575,25 +988,86 @@ class Pv(pyca.capv):
             
             self.wait_ready(DEFAULT_TIMEOUT * 2)
         
-        with utils.TimeoutSem(self.__pyca_sem, tmo):
-            self.put_data(value, tmo)
+        if tmo < 0:
+            self.put_async(value, complete=False)
+        else:
+            self.__locked_request('put', tmo, self.put_data, value, tmo)
         
         return value
 
-    def get_enum_set(self, timeout=1.0):
+
+    def put_async(self, value, callback=None, complete=True):
+        """
+        Set the PV value without waiting
+
+        The put is only queued, it is sent once :func:`pyca.flush_io` is
+        called, so many puts can be fired and then sent with a single flush.
+        The returned :class:`.PutCompletion` can be waited on, or a callback
+        given, to learn when the IOC has finished processing the record.
+
+        Parameters
+        ----------
+        value : float, int, str or array
+            Desired PV value
+
+        callback : callable, optional
+            A function to be run on completion. The function must accept one
+            argument, which is None on success or a description of the error
+
+        complete : bool, optional
+            If True, the put completes once the IOC reports that the record
+            has finished processing. If False, it completes as soon as it is
+            queued
+
+        Returns
+        -------
+        request : :class:`.PutCompletion`
+            A handle to wait on the completion
+
+        Raises
+        ------
+        pyca.pyexc
+            If the PV is not connected
+
+        See Also
+        --------
+        :func:`.put_many`
+        """
+        if not self.isconnected:
+            raise pyca.pyexc, "put: PV %s is not connected" % self.name
+        
+        if DEBUG != 0:
+            logprint("caput %s in %s\n" % (value, self.name))
+        
+        request = PutCompletion(self, value, callback)
+        # Every put made with a negative timeout reports its completion, in
+        # order, so all of them are queued to keep the completions aligned
+        with self.__put_lock:
+            self.put_data(value, -1.0)
+            self.__put_pending.append(request)
+        if not complete:
+            request._complete(None)
+        return request
+
+    def get_enum_set(self, timeout=1.0, refresh=False):
         """
         Return the ENUM types associated with the PV
 
         Since this information usually only changes when an IOC is remade, it is
         only necessary to get this information once. After the first call, the
         tuple is store in the dictionary :attr:`data` and accessible via the
-        property :attr:`enum_set`
+        property :attr:`enum_set`. It is also kept in the module level
+        ``enum_cache`` so that every PV object with the same name shares it.
+        The cached strings are requested again after the channel reconnects
 
         Parameters
         ----------
         timeout : float or None, optional
             Maximum time to wait to hear a response
 
+        refresh : bool, optional
+            Request the strings from the IOC even if they are cached
+
         Returns
         -------
         enum_set : tuple
@@ -604,11 +1078,57 @@ class Pv(pyca.capv):
         pyca.pyexc
             If the PV is not an ENUM type, this will be raised
         """
+        if (not refresh and self.name in enum_cache
+                and self.name not in _enum_stale):
+            self.enum_set = self.data["enum_set"] = enum_cache[self.name]
+            return self.enum_set
         tmo = float(timeout)
         self.get_enum_strings(tmo)
-        self.enum_set = self.data["enum_set"]
+        self.enum_set = enum_cache[self.name] = self.data["enum_set"]
+        _enum_stale.discard(self.name)
         return self.enum_set
 
+
+    def enum_string(self, value=None):
+        """
+        Translate an ENUM value to its string using the cached ENUM strings
+
+        No Channel Access request is made, so this is safe to use inside
+        monitor callbacks. The strings must have been fetched once with
+        :meth:`.get_enum_set` by any PV object with the same name.
+
+        Parameters
+        ----------
+        value : int, optional
+            The ENUM value to translate. By default, the current
+            :attr:`.value`
+
+        Returns
+        -------
+        string : str
+            The string associated with the value
+
+        Raises
+        ------
+        pyca.pyexc
+            If the ENUM strings have not been fetched yet
+
+        IndexError
+            If the value is not a valid enumeration
+        """
+        if value is None:
+            value = self.value
+        try:
+            enums = enum_cache[self.name]
+        except KeyError:
+            raise pyca.pyexc, "ENUM strings for PV %s have not been "\
+                              "fetched" % self.name
+        if len(enums) > value >= 0:
+            return enums[value]
+        else:
+            raise IndexError('{:} is not a valid enumeration '\
+                             'of {:}'.format(value,self.name))
+
 ###########################
 #  "Higher level" methods #
 ###########################
@@ -782,13 +1302,12 @@ class Pv(pyca.capv):
         """
         Return a string representation of the PV timestamp
         """
-        ts = time.localtime(self.secs+pyca.epoch)
-        tstr = time.strftime("%Y-%m-%d %H:%M:%S", ts)
-        tstr = tstr + ".%09d" % self.nsec
-        return tstr
+        return utils.timestr(self.secs + pyca.epoch, self.nsec)
 
 
-    def monitor_start(self, monitor_append=False):
+    def monitor_start(self, monitor_append=False, maxlen=None, stats=False,
+                      ewma=None, max_rate=None, deadband=None,
+                      rel_deadband=None):
         """
         Start a monitoring process on the PV channel.
         
@@ -798,7 +1317,41 @@ class Pv(pyca.capv):
             The choice of storing all updated values in a list, or simply
             overwriting the value attribute each time. This will change the
             :attr:`.monitor_append` attribute
+
+        maxlen : int, optional
+            Keep at most this many appended updates in preallocated NumPy
+            arrays, overwriting the oldest once full. Scalars are stored in a
+            1-D array and waveforms in a 2-D array. By default, the history
+            is kept in unbounded lists
+
+        stats : bool, optional
+            Keep running statistics of the updates in :attr:`.monitor_stats`
+            so that :meth:`.monitor_get` takes constant time. Waveform
+            statistics are computed element by element
+
+        ewma : float, optional
+            Weight of the newest update in an exponentially weighted moving
+            average kept with the statistics
+
+        max_rate : float, optional
+            Process at most this many monitor events per second, keeping only
+            the newest, see :attr:`.monitor_max_rate`. By default, the
+            current setting is kept. Use 0 to process every event again
+
+        deadband : float or array, optional
+            Ignore events that change the value by at most this much, see
+            :attr:`.monitor_deadband`. An array gives a deadband per waveform
+            element. By default, the current setting is kept. Set
+            :attr:`.monitor_deadband` to None to process every event again
+
+        rel_deadband : float, optional
+            Ignore events that change the value by at most this fraction of
+            the last processed value
         """
+        if max_rate is not None:
+            self.monitor_max_rate = max_rate or None
+        if deadband is not None or rel_deadband is not None:
+            self.monitor_deadband = filters.Deadband(deadband, rel_deadband)
         if not self.isinitialized:
             if self.isconnected:
                 self.get_data(self.control, -1.0, self.count)
@@ -809,14 +1362,23 @@ class Pv(pyca.capv):
             
             self.wait_ready()
         
+        if not stats:
+            self.monitor_stats = None
+        elif self.monitor_stats is None or self.monitor_stats.alpha != ewma:
+            self.monitor_stats = RunningStats(ewma)
+            self.__stats_skip = not self.ismonitored
+        
         if self.ismonitored:
-            if monitor_append == self.monitor_append:
+            if (monitor_append == self.monitor_append
+                    and maxlen == self.monitor_maxlen):
                 return
+            self.monitor_maxlen = maxlen
+            self.monitor_append = monitor_append
             if monitor_append:
                 self.monitor_clear()
-            self.monitor_append = monitor_append
             return
         self.monitor_append = monitor_append
+        self.monitor_maxlen = maxlen
         self.monitor_clear()
         self.monitor()
         pyca.flush_io()
@@ -834,12 +1396,82 @@ class Pv(pyca.capv):
             self.unsubscribe()
 
 
+    def set_value_buffers(self, depth=2, buffer=None):
+        """
+        Copy monitored waveforms into preallocated NumPy arrays
+
+        Each monitor update is copied into the next of depth preallocated
+        arrays and :attr:`.value` becomes a read-only view of it, so the
+        callbacks and statistics never hold on to the array created for the
+        event. The same few arrays are used for the life of the monitor,
+        which keeps large waveforms from churning memory. A value is
+        overwritten depth updates later, so callbacks that keep a waveform,
+        or run on a dispatcher that may fall behind, should copy it or use a
+        larger depth.
+
+        With monitor_append set and no :attr:`.monitor_maxlen`, every update
+        is still copied into a new array appended to :attr:`.values`, since
+        the views would be overwritten. Pass maxlen to :meth:`.monitor_start`
+        to keep the history in preallocated storage too.
+
+        Parameters
+        ----------
+        depth : int, optional
+            Number of arrays to cycle through, 0 to stop using them
+
+        buffer : numpy.ndarray, optional
+            Storage to use instead, a 2-D array with one row per update or a
+            1-D array to reuse a single one
+
+        See Also
+        --------
+        :class:`.buffers.ValueRing`
+        """
+        if buffer is None and not depth:
+            self.value_ring = None
+        else:
+            self.value_ring = buffers.ValueRing(depth, buffer)
+
+
     def monitor_clear(self):
         """ 
         Clear the :attr:`values` list
         """
         self.values = []
         self.timestamps = []
+        if not (self.monitor_append and self.monitor_maxlen):
+            self.monitor_buffer = None
+        elif (self.monitor_buffer is not None
+                and self.monitor_buffer.maxlen == self.monitor_maxlen):
+            self.monitor_buffer.clear()
+        else:
+            self.monitor_buffer = buffers.RingBuffer(self.monitor_maxlen)
+        if self.monitor_stats is not None:
+            self.monitor_stats.clear()
+            self.__stats_skip = True
+
+
+    @property
+    def values(self):
+        if self.monitor_buffer is not None:
+            return self.monitor_buffer.values
+        return self.__values
+
+    @values.setter
+    def values(self, values):
+        self.__values = values
+
+
+    @property
+    def timestamps(self):
+        if self.monitor_buffer is not None:
+            return self.monitor_buffer.timestamps
+        return self.__timestamps
+
+    @timestamps.setter
+    def timestamps(self, timestamps):
+        self.__timestamps = timestamps
+
 
     def monitor_get(self):
         """ 
@@ -850,8 +1482,15 @@ class Pv(pyca.capv):
         -------
         ret : dict
             A dictionary with the keys : mean, std, num, err. If no monitor
-            events have been stored, these will simply be np.nan values 
+            events have been stored, these will simply be np.nan values. When
+            :attr:`.monitor_stats` is kept, the running statistics are
+            returned instead, with the additional keys min, max and ewma
         """
+        if self.monitor_stats is not None:
+            if DEBUG != 0:
+                logprint("get monitoring for %s" % self.name)
+            return self.monitor_stats.get()
+        
         a=np.array(self.values[1:])
         ret = {}
         if (len(a)==0):
@@ -873,9 +1512,16 @@ class Pv(pyca.capv):
     def __getattr__(self, name):
         """
         Redefined to look in self.data for a keyword
+
+        Inside a monitor callback run by a :class:`.dispatch.MonitorDispatcher`
+        the data of the event being delivered is used instead
         """
-        if self.data.has_key(name):
-            return self.data[name]
+        data = self.data
+        event = getattr(dispatch.delivering, 'event', None)
+        if event is not None and event[0] is self:
+            data = event[1]
+        if data.has_key(name):
+            return data[name]
         else:
             return self.__dict__[name]
 
@@ -890,6 +1536,7 @@ def add_pv_to_cache(pvname):
     Add a PV to the save cache of PV objects
     
     If a PV with that name is already in the cache, it will not be added twice.
+    This is safe to call from several threads at once.
     
     Parameters
     ----------
@@ -902,12 +1549,93 @@ def add_pv_to_cache(pvname):
         A PV object         
     """
     utils.ensure_context()
-    if not pvname in pv_cache.keys():
-        pv_cache[pvname] = Pv(pvname)
-    return pv_cache[pvname]
+    return pv_cache.get_or_add(pvname, Pv)
+
 
+def _evict_pv(pv):
+    """
+    Disconnect a PV evicted from the cache
+    """
+    pv.disconnect()
+    metrics.forget(pv.name)
+
+
+def set_cache_policy(maxsize=None, max_idle=None):
+    """
+    Limit the number of PVs kept connected by the top level functions
 
-def monitor_start(pvname, monitor_append=False):
+    When the cache exceeds maxsize, or a PV has not been used for max_idle
+    seconds, the least recently used PVs that are not monitored, have no
+    monitor or connection callbacks and are not part of a running
+    :func:`.get_many`, :func:`.connect_many` or :func:`.put_many` are
+    disconnected and removed from the cache.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of PVs to keep, None for no limit
+
+    max_idle : float, optional
+        Time in seconds after which an unused PV is evicted, None for no limit
+
+    See Also
+    --------
+    :func:`.cache_stats`
+    """
+    pv_cache.configure(maxsize, max_idle)
+
+
+def cache_stats():
+    """
+    Return the hit, miss and eviction counters of the PV cache
+
+    Returns
+    -------
+    stats : dict
+        A dictionary with the keys : size, hits, misses, evictions
+    """
+    return pv_cache.stats()
+
+
+def set_monitor_dispatcher(dispatcher):
+    """
+    Run the monitor callbacks of every PV on a dispatcher
+
+    PVs with their own :attr:`.Pv.monitor_dispatcher` keep using it.
+
+    Parameters
+    ----------
+    dispatcher : :class:`.dispatch.MonitorDispatcher` or None
+        The dispatcher to use, None to run callbacks on the Channel Access
+        thread again
+
+    Returns
+    -------
+    dispatcher : :class:`.dispatch.MonitorDispatcher` or None
+        The previous dispatcher
+    """
+    global default_dispatcher
+    previous, default_dispatcher = default_dispatcher, dispatcher
+    return previous
+
+
+def lock_contention():
+    """
+    Return the contention counters of the per-PV locks used by get and put
+
+    A lock, and its counters, only last as long as a Pv of its name.
+
+    Returns
+    -------
+    stats : dict
+        PV name / counter dictionary pairings, see
+        :meth:`.utils.TimedLock.stats`
+    """
+    return dict((name, sem.stats()) for (name, sem) in pyca_sems.items())
+
+
+def monitor_start(pvname, monitor_append=False, maxlen=None, stats=False,
+                  ewma=None, max_rate=None, deadband=None, rel_deadband=None):
     """ 
     Start monitoring a PV.
     
@@ -920,13 +1648,36 @@ def monitor_start(pvname, monitor_append=False):
         The choice of storing all updated values in a list, or simply
         overwriting the value attribute each time. This will change the
         :attr:`.monitor_append` attribute
+
+    maxlen : int, optional
+        Keep at most this many appended updates, overwriting the oldest
+
+    stats : bool, optional
+        Keep running statistics of the updates for :func:`.monitor_get`
+
+    ewma : float, optional
+        Weight of the newest update in a moving average kept with the
+        statistics
+
+    max_rate : float, optional
+        Process at most this many monitor events per second. By default, the
+        current setting is kept. Use 0 to process every event again
+
+    deadband : float or array, optional
+        Ignore events that change the value by at most this much. By default,
+        the current setting is kept
+
+    rel_deadband : float, optional
+        Ignore events that change the value by at most this fraction of the
+        last processed value
     
     See Also
     --------
     :meth:`.Pv.monitor_start`
     """
-    add_pv_to_cache(pvname)
-    pv_cache[pvname].monitor_start(monitor_append)
+    pv = add_pv_to_cache(pvname)
+    pv.monitor_start(monitor_append, maxlen, stats, ewma, max_rate, deadband,
+                     rel_deadband)
   
 
 def monitor_stop(pvname):
@@ -942,8 +1693,8 @@ def monitor_stop(pvname):
     --------
     :meth:`.Pv.monitor_stop`
     """
-    add_pv_to_cache(pvname)
-    pv_cache[pvname].monitor_stop()
+    pv = add_pv_to_cache(pvname)
+    pv.monitor_stop()
  
 
 def monitor_clear(pvname):
@@ -959,8 +1710,8 @@ def monitor_clear(pvname):
     --------
     :meth:`.Pv.monitor_clear`
     """
-    add_pv_to_cache(pvname)
-    pv_cache[pvname].monitor_clear()
+    pv = add_pv_to_cache(pvname)
+    pv.monitor_clear()
 
 
 def monitor_get(pvname):
@@ -983,8 +1734,8 @@ def monitor_get(pvname):
     --------
     :meth:`.Pv.monitor_get`
     """
-    add_pv_to_cache(pvname)
-    return pv_cache[pvname].monitor_get()
+    pv = add_pv_to_cache(pvname)
+    return pv.monitor_get()
 
 
 def monitor_stop_all(clear=False):
@@ -1001,11 +1752,11 @@ def monitor_stop_all(clear=False):
     :func:`.monitor_stop`, :meth:`.Pv.monitor_clear`
 
     """
-    for pv in pv_cache.keys():
-        pv_cache[pv].monitor_stop()
+    for (name, pv) in pv_cache.items():
+        pv.monitor_stop()
         if clear:
-            pv_cache[pv].monitor_clear()
-        logprint("stopping monitoring for %s" % pv)
+            pv.monitor_clear()
+        logprint("stopping monitoring for %s" % name)
 
 
 def get(pvname,as_string=False):
@@ -1032,8 +1783,8 @@ def get(pvname,as_string=False):
     --------
     :meth:`.Pv.get`
     """
-    add_pv_to_cache(pvname)
-    return pv_cache[pvname].get(as_string=as_string, timeout=DEFAULT_TIMEOUT)
+    pv = add_pv_to_cache(pvname)
+    return pv.get(as_string=as_string, timeout=DEFAULT_TIMEOUT)
 
 
 def put(pvname,value):
@@ -1057,8 +1808,329 @@ def put(pvname,value):
     --------
     :meth:`.Pv.put`
     """
-    add_pv_to_cache(pvname)
-    return pv_cache[pvname].put(value, timeout=DEFAULT_TIMEOUT)
+    pv = add_pv_to_cache(pvname)
+    return pv.put(value, timeout=DEFAULT_TIMEOUT)
+
+
+class _Pending(object):
+    """
+    Track a batch of outstanding Channel Access requests by PV name
+
+    The batch is closed once :meth:`.wait` returns, after which late
+    requests are ignored.
+    """
+    def __init__(self, names):
+        self.cond    = threading.Condition()
+        self.pending = set(names)
+        self.errors  = {}
+        self.closed  = False
+
+
+    def done(self, name, error=None):
+        """
+        Mark the request for a PV as finished, returning whether it was still
+        outstanding in an open batch
+        """
+        with self.cond:
+            if self.closed or name not in self.pending:
+                return False
+            self.pending.discard(name)
+            if error is not None:
+                self.errors[name] = error
+            if not self.pending:
+                self.cond.notify_all()
+            return True
+
+
+    def wait(self, deadline):
+        """
+        Wait until all requests finish or the deadline passes, returning the
+        names of the requests still outstanding
+        """
+        with self.cond:
+            while self.pending:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            self.closed = True
+            return set(self.pending)
+
+
+def _deadline(timeout):
+    """
+    Convert a timeout into an absolute deadline
+    """
+    if timeout is None or timeout < 0:
+        return float('inf')
+    return time.time() + float(timeout)
+
+
+def _connect_pvs(pvs, deadline, on_connect=None):
+    """
+    Start the connection of all the PVs at once and wait for them together,
+    returning a dictionary of errors for the PVs that did not connect
+
+    If given, on_connect is called with each PV as soon as it connects so
+    that requests can be pipelined behind the slower connections. It is not
+    called for the PVs that connect after the deadline
+    """
+    batch = _Pending(pv.name for pv in pvs)
+    def connected(pv):
+        # Holding the lock keeps the batch from closing during on_connect
+        with batch.cond:
+            if not batch.done(pv.name) or on_connect is None:
+                return
+            on_connect(pv)
+        pyca.flush_io()
+
+    cb_ids = {}
+    for pv in pvs:
+        if pv.isconnected:
+            connected(pv)
+            continue
+        cb = lambda isconnected, pv=pv: isconnected and connected(pv)
+        cb_ids[pv.name] = pv.add_connection_callback(cb)
+        try:
+            pv.create_channel()
+        except pyca.pyexc:
+            pass # The channel is already searching for the IOC
+        if pv.isconnected:
+            connected(pv)
+    pyca.flush_io()
+    missing = batch.wait(deadline)
+    for pv in pvs:
+        if pv.name in cb_ids:
+            pv.del_connection_callback(cb_ids[pv.name])
+    return dict((name, "connection timedout for PV %s" % name)
+                for name in missing)
+
+
+def _fetch_enum_sets(pvs, deadline):
+    """
+    Fetch the ENUM strings that are not cached yet for the ENUM PVs among
+    pvs, from several threads so that the requests overlap, returning a
+    dictionary of errors for the PVs whose strings could not be fetched
+    """
+    needed = collections.deque(
+        pv for pv in pvs
+        if pv.type() == 'DBF_ENUM'
+        and (pv.name not in enum_cache or pv.name in _enum_stale))
+    if not needed:
+        return {}
+    names = [pv.name for pv in needed]
+    fetched = set()
+    errors = {}
+    def worker():
+        utils.ensure_context()
+        while True:
+            try:
+                pv = needed.popleft()
+            except IndexError:
+                return
+            try:
+                pv.get_enum_set(timeout=max(deadline - time.time(), 0.1))
+                fetched.add(pv.name)
+            except (pyca.pyexc, pyca.caexc) as exc:
+                errors[pv.name] = str(exc)
+
+    threads = [threading.Thread(target=worker, name='psp-enum-set')
+               for _ in range(min(len(needed), _ENUM_WORKERS))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        remaining = deadline - time.time()
+        thread.join(None if remaining == float('inf') else max(remaining, 0))
+    # Threads still running past the deadline must not change the result
+    errors = dict(errors)
+    for name in names:
+        if name not in fetched and name not in errors:
+            errors[name] = "get timedout for PV %s" % name
+    return errors
+
+
+def _batch_pvs(pvs):
+    """
+    Return a dictionary of PV name / Pv pairings for a batch, looking names up
+    in the cache. The names are pinned so the batch cannot evict its own PVs,
+    and must be released with ``pv_cache.unpin`` once the batch is over
+    """
+    batch = {}
+    for pv in pvs:
+        name = pv.name if isinstance(pv, Pv) else pv
+        if name not in batch:
+            batch[name] = pv
+    pv_cache.pin(batch)
+    try:
+        for (name, pv) in batch.items():
+            if not isinstance(pv, Pv):
+                batch[name] = add_pv_to_cache(pv)
+    except Exception:
+        pv_cache.unpin(batch)
+        raise
+    return batch
+
+
+def connect_many(pvnames, timeout=DEFAULT_TIMEOUT):
+    """
+    Connect to many PVs concurrently
+
+    All of the channels are created before waiting, so the total time is
+    limited by the slowest PV rather than the sum of all connection times.
+
+    Parameters
+    ----------
+    pvnames : iterable of str or :class:`.Pv`
+        The names of the desired PVs, or the PVs themselves. Names are
+        looked up with :func:`.add_pv_to_cache`
+
+    timeout : float or None, optional
+        Time to wait for all the PVs to connect. If None, wait indefinitely
+
+    Returns
+    -------
+    errors : dict
+        PV name / error message pairings for each PV that did not connect
+
+    See Also
+    --------
+    :func:`.get_many`, :func:`.put_many`
+    """
+    pvs = _batch_pvs(pvnames)
+    try:
+        return _connect_pvs(pvs.values(), _deadline(timeout))
+    finally:
+        pv_cache.unpin(pvs)
+
+
+def get_many(pvnames, timeout=DEFAULT_TIMEOUT, as_string=False, **kw):
+    """
+    Return the current values for many PVs at once
+
+    Every channel is created up front and each value is requested as soon
+    as its PV connects, without waiting on the others. All of the responses
+    share one deadline, so a handful of dead PVs only costs one timeout.
+    With as_string, the ENUM strings missing from the cache are fetched
+    concurrently within the same deadline.
+
+    Parameters
+    ----------
+    pvnames : iterable of str or :class:`.Pv`
+        The names of the desired PVs, or the PVs themselves. Names are
+        looked up with :func:`.add_pv_to_cache`
+
+    timeout : float or None, optional
+        Time to wait for the whole batch to connect and respond. If None,
+        wait indefinitely
+
+    as_string : bool , optional
+        Return the values as a string type, see :meth:`.Pv.get`
+
+    ctrl : bool, optional
+        Whether to get the control form information
+
+    Returns
+    -------
+    values : dict
+        PV name / value pairings for each PV that responded
+
+    errors : dict
+        PV name / error message pairings for each PV that failed
+
+    See Also
+    --------
+    :meth:`.Pv.get_async`, :func:`.get`
+    """
+    deadline = _deadline(timeout)
+    pvs = _batch_pvs(pvnames)
+    try:
+        batch = _Pending(pvs)
+        def request(pv):
+            try:
+                pv.get_async(lambda e: batch.done(pv.name, e),
+                             ctrl=kw.get('ctrl'))
+            except (pyca.pyexc, pyca.caexc) as exc:
+                batch.done(pv.name, str(exc))
+
+        errors = _connect_pvs(pvs.values(), deadline, request)
+        for name in errors:
+            batch.done(name)
+        for name in batch.wait(deadline):
+            errors[name] = "get timedout for PV %s" % name
+        errors.update(batch.errors)
+        if as_string:
+            errors.update(_fetch_enum_sets([pv for (name, pv) in pvs.items()
+                                            if name not in errors], deadline))
+
+        values = {}
+        for (name, pv) in pvs.items():
+            if name in errors:
+                continue
+            try:
+                if as_string:
+                    values[name] = pv._as_string(max(deadline - time.time(),
+                                                     0.1))
+                else:
+                    values[name] = pv.value
+            except (pyca.pyexc, pyca.caexc, IndexError) as exc:
+                errors[name] = str(exc)
+        return values, errors
+    finally:
+        pv_cache.unpin(pvs)
+
+
+def put_many(values, timeout=DEFAULT_TIMEOUT, complete=False):
+    """
+    Write values to many PVs at once
+
+    All of the PVs are connected concurrently and each put is sent as soon as
+    its PV connects.
+
+    Parameters
+    ----------
+    values : dict
+        PV name / desired value pairings
+
+    timeout : float or None, optional
+        Time to wait for all the PVs to connect and, if complete is set, for
+        the records to finish processing. If None, wait indefinitely
+
+    complete : bool, optional
+        Wait for the IOCs to report that every record has finished
+        processing
+
+    Returns
+    -------
+    errors : dict
+        PV name / error message pairings for each PV that could not be
+        written
+
+    See Also
+    --------
+    :func:`.put`, :func:`.get_many`, :meth:`.Pv.put_async`
+    """
+    deadline = _deadline(timeout)
+    requests = {}
+    put_errors = {}
+    def request(pv):
+        try:
+            requests[pv.name] = pv.put_async(values[pv.name], complete=complete)
+        except (pyca.pyexc, pyca.caexc) as exc:
+            put_errors[pv.name] = str(exc)
+
+    pvs = _batch_pvs(values)
+    try:
+        errors = _connect_pvs(pvs.values(), deadline, request)
+        errors.update(put_errors)
+        for (name, req) in requests.items():
+            if not req.wait(max(deadline - time.time(), 0)):
+                errors[name] = "put timedout for PV %s" % name
+            elif req.error is not None:
+                errors[name] = req.error
+        return errors
+    finally:
+        pv_cache.unpin(pvs)
 
 
 def wait_until_change(pvname,timeout=60):
@@ -1167,10 +2239,10 @@ def clear():
     """ 
     Stop monitoring and disconnect all PVs
     """
-    for pv in pv_cache:
-        monitor_stop(pv)
-        monitor_clear(pv)
-        pv_cache[pv].disconnect()
+    for pv in pv_cache.values():
+        pv.monitor_stop()
+        pv.monitor_clear()
+        pv.disconnect()
     pv_cache.clear()
 
 
@@ -1178,7 +2250,7 @@ def what_is_monitored():
     """ 
     Print a list of PVs that are currently monitored
     """
-    for pv in pv_cache:
-        if (pv_cache[pv].ismonitored):
-            logprint("pv %s is currently monitored" % pv_cache[pv].name)
+    for pv in pv_cache.values():
+        if (pv.ismonitored):
+            logprint("pv %s is currently monitored" % pv.name)
 
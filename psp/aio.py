@@ -0,0 +1,448 @@
+"""
+   asyncio interface to PV objects
+
+   Channel Access callbacks are turned into asyncio futures with
+   ``loop.call_soon_threadsafe``, so a single event loop can wait on any number
+   of PVs without blocking a thread per wait.
+
+   Every function returns a future and accepts either a :class:`.Pv` or a
+   PV name, which is looked up with :func:`.add_pv_to_cache`. PSP runs on
+   Python 2, where the event loop comes from the ``trollius`` backport and
+   futures are waited on with ``yield From(...)`` in a coroutine:
+
+   .. code-block:: python
+
+       import trollius
+       from trollius import From
+
+       @trollius.coroutine
+       def main():
+           value = yield From(aio.get('MY:PV'))
+           events = aio.updates('MY:PV')
+           while True:
+               update = yield From(events.get())
+               print(update.value)
+"""
+import collections
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+from .backend import pyca
+from . import utils
+from . import Pv as _pvmod
+
+try:
+    StopAsyncIteration = StopAsyncIteration
+except NameError:
+    StopAsyncIteration = StopIteration
+
+
+Update = collections.namedtuple('Update', ['value', 'timestamp',
+                                           'severity', 'status'])
+
+
+def _pv(pv):
+    if isinstance(pv, _pvmod.Pv):
+        return pv
+    return _pvmod.add_pv_to_cache(pv)
+
+
+def _loop(loop):
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    return loop
+
+
+def _future(loop):
+    try:
+        return loop.create_future()
+    except AttributeError:
+        return asyncio.Future(loop=loop)
+
+
+def _settle(fut, error=None, result=None):
+    """
+    Resolve a future unless it was already cancelled by a timeout
+    """
+    if fut.done():
+        return
+    if error is not None:
+        if not isinstance(error, Exception):
+            error = pyca.pyexc(error)
+        fut.set_exception(error)
+    else:
+        fut.set_result(result)
+
+
+def _then(first, fn, loop):
+    """
+    Return a future for fn(), run once the future first has succeeded. fn
+    itself returns a future. Cancelling the returned future, e.g. on a
+    timeout, cancels first and the future of fn, so that they remove their
+    callbacks
+    """
+    fut = _future(loop)
+    inner = []
+    def step(done):
+        if fut.done():
+            return
+        if done.cancelled():
+            fut.cancel()
+        elif done.exception() is not None:
+            _settle(fut, done.exception())
+        else:
+            try:
+                nxt = fn()
+            except Exception as exc:
+                _settle(fut, exc)
+                return
+            inner.append(nxt)
+            nxt.add_done_callback(
+                lambda n: fut.cancel() if n.cancelled()
+                          else _settle(fut, n.exception(),
+                                       None if n.exception() else n.result()))
+    def cancel(done):
+        if done.cancelled():
+            first.cancel()
+            for nxt in inner:
+                nxt.cancel()
+    first.add_done_callback(step)
+    fut.add_done_callback(cancel)
+    return fut
+
+
+def _timeout(fut, timeout, loop):
+    if timeout is None or timeout < 0:
+        return fut
+    return asyncio.wait_for(fut, timeout)
+
+
+def _connected(pv, loop):
+    """
+    Future resolved once the PV is connected
+    """
+    fut = _future(loop)
+    if pv.isconnected:
+        fut.set_result(True)
+        return fut
+
+    def on_connect(isconnected):
+        if isconnected:
+            loop.call_soon_threadsafe(_settle, fut, None, True)
+    cb_id = pv.add_connection_callback(on_connect)
+    fut.add_done_callback(lambda f: pv.del_connection_callback(cb_id))
+    try:
+        pv.create_channel()
+    except pyca.pyexc:
+        pass # The channel is already searching for the IOC
+    if pv.isconnected:
+        _settle(fut, None, True)
+    pyca.flush_io()
+    return fut
+
+
+def connect(pv, timeout=None, loop=None):
+    """
+    Connect to a PV
+
+    Parameters
+    ----------
+    pv : :class:`.Pv` or str
+        The PV object or the name of the desired PV
+
+    timeout : float or None, optional
+        Time to wait for the connection. If None, wait indefinitely
+
+    Returns
+    -------
+    awaitable
+        Resolves to True once connected, raises asyncio.TimeoutError if the
+        timeout is exceeded
+    """
+    loop = _loop(loop)
+    return _timeout(_connected(_pv(pv), loop), timeout, loop)
+
+
+def get(pv, timeout=_pvmod.DEFAULT_TIMEOUT, ctrl=None, count=None, loop=None,
+        as_string=False):
+    """
+    Get the value of a PV, connecting first if needed
+
+    Parameters
+    ----------
+    pv : :class:`.Pv` or str
+        The PV object or the name of the desired PV
+
+    timeout : float or None, optional
+        Time to wait for the connection and the data. If None, wait
+        indefinitely
+
+    ctrl : bool, optional
+        Whether to get the control form information
+
+    count : int, optional
+        Maximum number of array elements to be return
+
+    as_string : bool, optional
+        Translate ENUM values using the strings already cached with
+        :meth:`.Pv.get_enum_set`, other values are converted with str
+
+    Returns
+    -------
+    awaitable
+        Resolves to the value of the PV at the time the data arrived
+    """
+    loop = _loop(loop)
+    pv = _pv(pv)
+
+    def request():
+        fut = _future(loop)
+        def on_data(e):
+            if e is not None:
+                loop.call_soon_threadsafe(_settle, fut, e)
+                return
+            try:
+                if as_string and pv.type() == 'DBF_ENUM':
+                    value = pv.enum_string()
+                elif as_string:
+                    value = str(pv.value)
+                else:
+                    value = pv.value
+            except Exception as exc:
+                loop.call_soon_threadsafe(_settle, fut, exc)
+                return
+            loop.call_soon_threadsafe(_settle, fut, None, value)
+        pv.get_async(on_data, ctrl, count)
+        pyca.flush_io()
+        return fut
+
+    return _timeout(_then(_connected(pv, loop), request, loop), timeout, loop)
+
+
+def put(pv, value, timeout=_pvmod.DEFAULT_TIMEOUT, complete=False, loop=None):
+    """
+    Write a value to a PV, connecting first if needed
+
+    Parameters
+    ----------
+    pv : :class:`.Pv` or str
+        The PV object or the name of the desired PV
+
+    value : float, int, str or array
+        Desired PV value
+
+    timeout : float or None, optional
+        Time to wait for the connection and, if complete is set, for the put
+        to complete. If None, wait indefinitely
+
+    complete : bool, optional
+        Wait for the IOC to report that the record has finished processing
+
+    Returns
+    -------
+    awaitable
+        Resolves to the value once it has been sent or, if complete is set,
+        processed
+    """
+    loop = _loop(loop)
+    pv = _pv(pv)
+
+    def request():
+        fut = _future(loop)
+        def on_complete(e):
+            loop.call_soon_threadsafe(_settle, fut, e, value)
+        pv.put_async(value, on_complete, complete)
+        pyca.flush_io()
+        return fut
+
+    return _timeout(_then(_connected(pv, loop), request, loop), timeout, loop)
+
+
+def _monitored(pv, loop):
+    """
+    Future resolved once the PV is connected and subscribed to monitor events
+    """
+    def subscribe():
+        fut = _future(loop)
+        if not pv.ismonitored:
+            # Pv.monitor would also make a blocking get
+            pv.subscribe_channel(pyca.DBE_VALUE | pyca.DBE_LOG | pyca.DBE_ALARM,
+                                 pv.control, pv.count)
+            pv.ismonitored = True
+            pyca.flush_io()
+        fut.set_result(True)
+        return fut
+    return _then(_connected(pv, loop), subscribe, loop)
+
+
+def wait_condition(pv, condition, timeout=60, loop=None):
+    """
+    Wait for an arbitrary condition on a PV to be True
+
+    The condition is checked once the PV is monitored, and then on every
+    monitor event, in the Channel Access thread.
+
+    Parameters
+    ----------
+    pv : :class:`.Pv` or str
+        The PV object or the name of the desired PV
+
+    condition : callable
+        Called with the PV value, returns a bool
+
+    timeout : float or None, optional
+        Maximum time to wait. If None, wait indefinitely
+
+    Returns
+    -------
+    awaitable
+        Resolves to the value that satisfied the condition, raises
+        asyncio.TimeoutError if the timeout is exceeded
+    """
+    loop = _loop(loop)
+    pv = _pv(pv)
+
+    def watch():
+        fut = _future(loop)
+        def check(e=None):
+            if e is None and 'value' in pv.data:
+                value = pv.value
+                if condition(value):
+                    loop.call_soon_threadsafe(_settle, fut, None, value)
+        cb_id = pv.add_monitor_callback(check)
+        fut.add_done_callback(lambda f: pv.del_monitor_callback(cb_id))
+        check()
+        return fut
+
+    return _timeout(_then(_monitored(pv, loop), watch, loop), timeout, loop)
+
+
+def wait_for_value(pv, value, timeout=60, loop=None):
+    """
+    Wait for a PV to reach a specific value
+
+    See Also
+    --------
+    :func:`.wait_condition`, :meth:`.Pv.wait_for_value`
+    """
+    cond = lambda v: utils.all_condition(lambda: v == value)()
+    return wait_condition(pv, cond, timeout, loop)
+
+
+def wait_for_range(pv, low, high, timeout=60, loop=None):
+    """
+    Wait for a PV to enter a specific range
+
+    See Also
+    --------
+    :func:`.wait_condition`, :meth:`.Pv.wait_for_range`
+    """
+    low_cond = lambda v: utils.all_condition(lambda: low <= v)()
+    high_cond = lambda v: utils.all_condition(lambda: v <= high)()
+    return wait_condition(pv, lambda v: low_cond(v) and high_cond(v),
+                          timeout, loop)
+
+
+class updates(object):
+    """
+    Asynchronous iterator over the monitor events of a PV
+
+    Each event is delivered as an :class:`.Update` holding the value,
+    timestamp, severity and status at the time of the event, by the future
+    that :meth:`.get` returns. If the consumer falls behind by more than
+    maxsize events, the oldest are discarded and counted in :attr:`dropped`.
+    Once the iterator is closed, the futures raise ``StopIteration``, and
+    if the PV could not be subscribed to they raise the error.
+
+    Parameters
+    ----------
+    pv : :class:`.Pv` or str
+        The PV object or the name of the desired PV
+
+    maxsize : int, optional
+        Number of events to buffer, 0 for unbounded
+
+    .. code-block:: python
+
+        events = aio.updates(pv)
+        update = yield From(events.get())
+    """
+    def __init__(self, pv, maxsize=1000, loop=None):
+        self.pv = _pv(pv)
+        self.loop = _loop(loop)
+        self.maxsize = maxsize
+        self.dropped = 0
+        self.__events = collections.deque()
+        self.__waiter = None
+        self.__closed = False
+        self.__error = None
+        self.__cb_id = self.pv.add_monitor_callback(self.__on_event)
+        self.__ready = _monitored(self.pv, self.loop)
+        self.__ready.add_done_callback(self.__on_ready)
+
+    def __on_ready(self, ready):
+        if ready.cancelled():
+            self.close()
+        elif ready.exception() is not None:
+            self.__error = ready.exception()
+            self.close()
+
+    def __on_event(self, e=None):
+        if e is None:
+            update = Update(self.pv.value, self.pv.timestamp(),
+                            self.pv.severity, self.pv.status)
+            self.loop.call_soon_threadsafe(self.__push, update)
+
+    def __push(self, update):
+        if self.maxsize and len(self.__events) >= self.maxsize:
+            self.__events.popleft()
+            self.dropped += 1
+        self.__events.append(update)
+        if self.__waiter is not None:
+            self.__wake()
+
+    def __wake(self):
+        waiter, self.__waiter = self.__waiter, None
+        if waiter.done():
+            return
+        self.__deliver(waiter)
+
+    def __deliver(self, fut):
+        if self.__events:
+            fut.set_result(self.__events.popleft())
+        elif self.__error is not None:
+            fut.set_exception(self.__error)
+        elif self.__closed:
+            fut.set_exception(StopAsyncIteration())
+        else:
+            return False
+        return True
+
+    def __aiter__(self):
+        return self
+
+    def get(self):
+        """
+        Return a future resolved with the next :class:`.Update`
+        """
+        fut = _future(self.loop)
+        if not self.__deliver(fut):
+            self.__waiter = fut
+        return fut
+
+    __anext__ = get
+
+    def close(self):
+        """
+        Stop listening to the PV, ending the iteration. This is done
+        automatically if the PV cannot be subscribed to
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+        self.pv.del_monitor_callback(self.__cb_id)
+        if self.__waiter is not None:
+            self.__wake()
@@ -0,0 +1,21 @@
+from __future__ import absolute_import
+import os
+
+"""
+   Selection of the Channel Access backend
+
+   By default psp talks to Channel Access through the pyca extension module.
+   Setting the environment variable PSP_BACKEND=sim before psp is imported
+   selects the in-process simulator in :mod:`psp.sim` instead, so that the
+   Pv class, the top level functions and the command line tools run without
+   a Channel Access network.
+"""
+
+name = os.environ.get('PSP_BACKEND') or 'pyca'
+
+if name == 'pyca':
+    import pyca
+elif name == 'sim':
+    from . import sim as pyca
+else:
+    raise ImportError("unknown PSP_BACKEND '%s', expected pyca or sim" % name)
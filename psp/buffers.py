@@ -0,0 +1,218 @@
+import numpy as np
+
+"""
+   Preallocated storage for PV monitor updates
+"""
+
+class RingBuffer(object):
+    """
+    Fixed capacity storage for monitor updates backed by NumPy arrays
+
+    Scalar values are stored in a 1-D array and waveforms in a 2-D array with
+    one row per update. The arrays are allocated on the first append, using
+    the shape and type of that value. Once the buffer is full the oldest
+    update is overwritten and counted in :attr:`dropped`.
+
+    Every update is written twice, at its slot and at the slot offset by the
+    capacity, so that the stored history is always one contiguous block of
+    memory. This lets :attr:`values` and :attr:`timestamps` return views in
+    chronological order without copying.
+
+    Parameters
+    ----------
+    maxlen : int
+        Maximum number of updates to keep
+
+    Attributes
+    ----------
+    count : int
+        Total number of updates appended since the last clear
+
+    dropped : int
+        Number of updates overwritten since the last clear
+    """
+    def __init__(self, maxlen):
+        self.maxlen = int(maxlen)
+        if self.maxlen <= 0:
+            raise ValueError('maxlen must be a positive integer')
+        self.__data   = None
+        self.__stamps = np.zeros((2*self.maxlen, 2), dtype=np.int64)
+        self.clear()
+
+
+    def clear(self):
+        """
+        Forget all stored updates, keeping the allocated memory
+        """
+        self.__head   = 0
+        self.count    = 0
+        self.dropped  = 0
+
+
+    def __len__(self):
+        return min(self.count, self.maxlen)
+
+
+    def append(self, value, timestamp):
+        """
+        Store an update
+
+        Parameters
+        ----------
+        value : float, int, str or array
+            The PV value. Waveforms longer than the first stored waveform are
+            truncated and shorter ones are padded with zeros
+
+        timestamp : tuple
+            The (secs, nsec) timestamp of the update
+        """
+        if self.__data is None:
+            self.__allocate(value)
+        i = self.__head
+        j = i + self.maxlen
+        if self.__data.ndim == 1:
+            self.__data[i] = self.__data[j] = value
+        else:
+            row = self.__data[i]
+            value = np.asarray(value).ravel()
+            n = min(len(value), len(row))
+            row[:n] = value[:n]
+            row[n:] = 0
+            self.__data[j] = row
+        self.__stamps[i] = self.__stamps[j] = timestamp
+        self.__head = (i + 1) % self.maxlen
+        self.count += 1
+        if self.count > self.maxlen:
+            self.dropped += 1
+
+
+    def __allocate(self, value):
+        value = np.asarray(value)
+        dtype = value.dtype
+        if dtype.kind in 'SUO':
+            dtype = object
+        shape = (2*self.maxlen,)
+        if value.ndim > 0:
+            shape += (value.size,)
+        self.__data = np.zeros(shape, dtype=dtype)
+
+
+    def __view(self, array):
+        n = len(self)
+        start = (self.__head - n) % self.maxlen
+        view = array[start:start+n]
+        view.flags.writeable = False
+        return view
+
+
+    @property
+    def values(self):
+        """
+        Read-only view of the stored values, oldest first
+
+        The view shares memory with the buffer, so it changes as new updates
+        arrive. Copy it to keep a snapshot.
+        """
+        if self.__data is None:
+            return np.zeros(0)
+        return self.__view(self.__data)
+
+
+    @property
+    def timestamps(self):
+        """
+        Read-only view of the stored (secs, nsec) timestamps, oldest first
+        """
+        return self.__view(self.__stamps)
+
+
+class ValueRing(object):
+    """
+    Preallocated arrays that waveform updates are copied into
+
+    Each update is copied into the next of depth slots and returned as a
+    read-only view of that slot. The views are created once, with the slots,
+    so storing an update does not allocate any new array. A view keeps
+    referring to its slot, and is overwritten by the update arriving depth
+    updates later. Copy a value to keep it for longer.
+
+    Parameters
+    ----------
+    depth : int, optional
+        Number of slots. Ignored if buffer is given
+
+    buffer : numpy.ndarray, optional
+        Caller supplied storage, a 2-D array with one row per slot or a 1-D
+        array for a single slot. By default the slots are allocated on the
+        first update, with the size and type of that waveform
+
+    Attributes
+    ----------
+    count : int
+        Number of updates stored
+    """
+    def __init__(self, depth=2, buffer=None):
+        self.__rows  = None
+        self.__views = None
+        if buffer is not None:
+            if not isinstance(buffer, np.ndarray):
+                raise TypeError('buffer must be a numpy array')
+            if buffer.ndim == 1:
+                buffer = buffer.reshape(1, -1)
+            self.__use(buffer)
+        elif int(depth) <= 0:
+            raise ValueError('depth must be a positive integer')
+        else:
+            self.depth = int(depth)
+        self.__next = 0
+        self.count  = 0
+
+
+    def __use(self, slots):
+        self.depth = len(slots)
+        self.__rows  = list(slots)
+        self.__views = []
+        for row in self.__rows:
+            view = row[:]
+            view.flags.writeable = False
+            self.__views.append(view)
+
+
+    def store(self, value):
+        """
+        Copy a waveform into the next slot
+
+        Parameters
+        ----------
+        value : array or sequence
+            The waveform. Scalars and strings are returned unchanged
+
+        Returns
+        -------
+        view : numpy.ndarray
+            Read-only view of the slot holding the waveform. Waveforms
+            shorter than a slot get a view of the filled part, longer ones
+            are truncated
+        """
+        if not isinstance(value, (np.ndarray, tuple, list)):
+            return value
+        if self.__rows is None:
+            first = np.asarray(value)
+            if first.dtype.kind in 'SUO':
+                return value
+            self.__use(np.zeros((self.depth, first.size), dtype=first.dtype))
+        i = self.__next
+        row = self.__rows[i]
+        n = len(value)
+        if n == len(row):
+            np.copyto(row, value, casting='unsafe')
+            view = self.__views[i]
+        elif n > len(row):
+            row[:] = value[:len(row)]
+            view = self.__views[i]
+        else:
+            row[:n] = value
+            view = self.__views[i][:n]
+        self.__next = (i + 1) % self.depth
+        self.count += 1
+        return view
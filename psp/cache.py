@@ -0,0 +1,226 @@
+import time
+import threading
+import collections
+
+"""
+   Cache of PV objects shared by the top level functions
+"""
+
+class PvCache(object):
+    """
+    A thread-safe dictionary of PV name / PV object pairings with an optional
+    least-recently-used and idle eviction policy
+
+    By default the cache grows without limit, like a plain dictionary. Once
+    a maximum size or idle time is configured, PVs that are not in use are
+    evicted, least recently used first, whenever a PV is added to the cache.
+    A PV is in use while it is monitored, has monitor or connection callbacks
+    or is pinned by a batch operation, see :meth:`.pin`. Evicted PVs are
+    passed to ``on_evict``, which is expected to disconnect them.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of PVs to keep
+
+    max_idle : float, optional
+        Time in seconds after which an unused PV is evicted
+
+    on_evict : callable, optional
+        Called with each evicted PV object
+
+    Attributes
+    ----------
+    hits : int
+        Number of lookups that found an existing PV
+
+    misses : int
+        Number of lookups that created a PV
+
+    evictions : int
+        Number of PVs evicted
+    """
+    def __init__(self, maxsize=None, max_idle=None, on_evict=None):
+        self.__lock = threading.RLock()
+        self.__pvs  = collections.OrderedDict()
+        self.__used = {}
+        self.__pins = {}
+        self.maxsize  = maxsize
+        self.max_idle = max_idle
+        self.on_evict = on_evict
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+
+
+    def configure(self, maxsize=None, max_idle=None):
+        """
+        Set the eviction policy and apply it immediately
+
+        Parameters
+        ----------
+        maxsize : int, optional
+            Maximum number of PVs to keep, None for no limit
+
+        max_idle : float, optional
+            Time in seconds after which an unused PV is evicted, None for no
+            limit
+        """
+        with self.__lock:
+            self.maxsize  = maxsize
+            self.max_idle = max_idle
+        self.prune()
+
+
+    def get_or_add(self, pvname, factory):
+        """
+        Return the PV for this name, creating it with factory(pvname) if it is
+        not in the cache yet, and mark it as recently used
+        """
+        with self.__lock:
+            pv = self.__pvs.pop(pvname, None)
+            if pv is None:
+                self.misses += 1
+                pv = factory(pvname)
+            else:
+                self.hits += 1
+            self.__pvs[pvname] = pv
+            self.__used[pvname] = time.time()
+        self.prune(keep=pvname)
+        return pv
+
+
+    def prune(self, keep=None):
+        """
+        Evict the PVs that exceed the size or idle limits
+
+        The PVs are visited least recently used first, stopping at the first
+        PV that is neither idle nor needed to get under the size limit, so a
+        lookup in a cache within its limits costs constant time.
+
+        Parameters
+        ----------
+        keep : str, optional
+            Name of a PV that must not be evicted
+        """
+        evicted = []
+        with self.__lock:
+            if self.maxsize is None and self.max_idle is None:
+                return
+            now = time.time()
+            excess = 0
+            if self.maxsize is not None:
+                excess = len(self.__pvs) - self.maxsize
+            victims = []
+            for name in self.__pvs:
+                idle = (self.max_idle is not None
+                        and now - self.__used[name] > self.max_idle)
+                if excess <= 0 and not idle:
+                    break
+                if name == keep or self.__in_use(name, self.__pvs[name]):
+                    continue
+                victims.append(name)
+                excess -= 1
+            for name in victims:
+                evicted.append(self.__pvs.pop(name))
+                del self.__used[name]
+                self.evictions += 1
+        if self.on_evict is not None:
+            for pv in evicted:
+                self.on_evict(pv)
+
+
+    def __in_use(self, name, pv):
+        return (name in self.__pins or pv.ismonitored or bool(pv.mon_cbs)
+                or bool(pv.con_cbs))
+
+
+    def pin(self, pvnames):
+        """
+        Protect PVs from eviction until they are unpinned, whether or not they
+        are in the cache yet. Pins are counted, so batches may overlap
+        """
+        with self.__lock:
+            for name in pvnames:
+                self.__pins[name] = self.__pins.get(name, 0) + 1
+
+
+    def unpin(self, pvnames):
+        """
+        Release the pins taken with :meth:`.pin` and apply the eviction policy
+        """
+        with self.__lock:
+            for name in pvnames:
+                count = self.__pins.get(name, 0) - 1
+                if count > 0:
+                    self.__pins[name] = count
+                else:
+                    self.__pins.pop(name, None)
+        self.prune()
+
+
+    def stats(self):
+        """
+        Return the cache counters as a dictionary
+        """
+        return {'size'      : len(self),
+                'hits'      : self.hits,
+                'misses'    : self.misses,
+                'evictions' : self.evictions}
+
+
+    # Dictionary interface
+    def __getitem__(self, pvname):
+        with self.__lock:
+            pv = self.__pvs.pop(pvname)
+            self.__pvs[pvname] = pv
+            self.__used[pvname] = time.time()
+            return pv
+
+    def __setitem__(self, pvname, pv):
+        with self.__lock:
+            self.__pvs.pop(pvname, None)
+            self.__pvs[pvname] = pv
+            self.__used[pvname] = time.time()
+
+    def __delitem__(self, pvname):
+        with self.__lock:
+            del self.__pvs[pvname]
+            del self.__used[pvname]
+
+    def __contains__(self, pvname):
+        return pvname in self.__pvs
+
+    def __len__(self):
+        return len(self.__pvs)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, pvname, default=None):
+        with self.__lock:
+            if pvname in self.__pvs:
+                return self[pvname]
+            return default
+
+    def pop(self, pvname, *default):
+        with self.__lock:
+            self.__used.pop(pvname, None)
+            return self.__pvs.pop(pvname, *default)
+
+    def keys(self):
+        with self.__lock:
+            return list(self.__pvs.keys())
+
+    def values(self):
+        with self.__lock:
+            return list(self.__pvs.values())
+
+    def items(self):
+        with self.__lock:
+            return list(self.__pvs.items())
+
+    def clear(self):
+        with self.__lock:
+            self.__pvs.clear()
+            self.__used.clear()
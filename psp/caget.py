@@ -1,12 +1,15 @@
 #!/usr/bin/env python
 
-import pyca
-from Pv import Pv
+from backend import pyca
+from Pv import Pv, get_many
 
 import sys
 import time
 
-from options import Options
+from options import Options, read_pvnames
+from output import RecordWriter
+
+FIELDS = ['name', 'value', 'secs', 'nsec', 'severity', 'status', 'error']
 
 def caget(pvname):
   pv = Pv(pvname)
@@ -14,18 +17,52 @@ def caget(pvname):
   pv.get(False, 1.)
   pv.disconnect()
   return pv.value
-  
+
+def show(pv, ctrl, hex):
+  if ctrl:
+    print "%-30s " %(pv.name), pv.data
+  else:
+    if pv.status == pyca.NO_ALARM:
+      if hex:
+        print "%-30s %08x.%08x" %(pv.name, pv.secs, pv.nsec), pv.value
+      else:
+        print "%-30s %s" %(pv.name, pv.timestr()), pv.value
+    else:
+      print "%-30s %s %s" %(pv.name,
+                            pyca.severity[pv.severity],
+                            pyca.alarm[pv.status])
+
+def record(pv):
+  rec = {'name' : pv.name, 'value' : pv.value,
+         'severity' : pyca.severity[pv.severity],
+         'status' : pyca.alarm[pv.status], 'error' : None}
+  if 'secs' in pv.data:
+    rec['secs'] = pv.secs + pyca.epoch
+    rec['nsec'] = pv.nsec
+  return rec
+
+def error_record(pvname, msg):
+  return {'name' : pvname, 'error' : str(msg)}
+
 
 if __name__ == '__main__':
-  options = Options(['pvnames'], ['connect_timeout','get_timeout'], ['ctrl', 'hex'])
+  options = Options([], ['pvnames', 'file', 'format',
+                         'connect_timeout','get_timeout'],
+                    ['ctrl', 'hex', 'batch'])
   try:
     options.parse()
+    pvnames = read_pvnames(options.pvnames, options.file)
+    if not pvnames:
+      raise RuntimeError, 'no PV names given, use --pvnames or --file'
+    writer = None
+    if options.format not in (None, 'text'):
+      writer = RecordWriter(options.format, FIELDS)
   except Exception, msg:
     options.usage(str(msg))
     sys.exit()
 
-  pvnames = options.pvnames.split()
   ctrl = options.ctrl is not None
+  hex = options.hex is not None
   if options.connect_timeout is not None:
     connect_timeout = float(options.connect_timeout)
   else:
@@ -35,26 +72,39 @@ if __name__ == '__main__':
   else:
     get_timeout = 1.0
 
+  if options.batch is not None:
+    # Connect and read every PV concurrently with a single deadline
+    pvs = dict((pvname, Pv(pvname)) for pvname in pvnames)
+    values, errors = get_many(pvs.values(), connect_timeout + get_timeout,
+                              ctrl=ctrl)
+    for pvname in pvnames:
+      if pvname in errors:
+        if writer is not None:
+          writer.write(error_record(pvname, errors[pvname]))
+        else:
+          print "%-30s %s" %(pvname, errors[pvname])
+      elif writer is not None:
+        writer.write(record(pvs[pvname]))
+      else:
+        show(pvs[pvname], ctrl, hex)
+    sys.exit()
+
   for pvname in pvnames:
     try:
       pv = Pv(pvname)
       pv.connect(connect_timeout)
       pv.get(ctrl, get_timeout)
-      if ctrl:
-        print "%-30s " %(pv.name), pv.data
+      if writer is not None:
+        writer.write(record(pv))
       else:
-        if pv.status == pyca.NO_ALARM:
-          ts = time.localtime(pv.secs+pyca.epoch)
-          tstr = time.strftime("%Y-%m-%d %H:%M:%S", ts)
-          if options.hex is not None:
-            print "%-30s %08x.%08x" %(pv.name, pv.secs, pv.nsec), pv.value
-          else:
-            print "%-30s %s.%09d" %(pv.name, tstr, pv.nsec), pv.value
-        else:
-          print "%-30s %s %s" %(pv.name, 
-                                pyca.severity[pv.severity],
-                                pyca.alarm[pv.status])
+        show(pv, ctrl, hex)
     except pyca.pyexc, e:
-      print 'pyca exception: %s' %(e)
+      if writer is not None:
+        writer.write(error_record(pvname, e))
+      else:
+        print 'pyca exception: %s' %(e)
     except pyca.caexc, e:
-      print 'channel access exception: %s' %(e)
+      if writer is not None:
+        writer.write(error_record(pvname, e))
+      else:
+        print 'channel access exception: %s' %(e)
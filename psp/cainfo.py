@@ -1,41 +1,86 @@
 #!/usr/bin/env python
 
-import pyca
-from Pv import Pv
+from backend import pyca
+from Pv import Pv, connect_many
 
 import sys
 
-from options import Options
+from options import Options, read_pvnames
+from output import RecordWriter
+
+FIELDS = ['name', 'state', 'host', 'access', 'type', 'count', 'error']
+
+states = ["never connected", "previously connected", "connected", "closed"]
+access = ['none', 'read only', 'write only', 'read-write']
+
+def show(pv):
+  print pv.name
+  print '  State: ', states[pv.state()]
+  print '  Host:  ', pv.host()
+  print '  Access:', access[pv.rwaccess()]
+  print '  Type:  ', pv.type()
+  print '  Count: ', pyca.capv.count(pv)
+
+def record(pv):
+  return {'name' : pv.name, 'state' : states[pv.state()],
+          'host' : pv.host(), 'access' : access[pv.rwaccess()],
+          'type' : pv.type(), 'count' : pyca.capv.count(pv), 'error' : None}
+
+def report(pv, writer):
+  try:
+    if writer is not None:
+      writer.write(record(pv))
+    else:
+      show(pv)
+  except pyca.pyexc, e:
+    error(pv.name, 'pyca exception: %s' %(e), writer)
+  except pyca.caexc, e:
+    error(pv.name, 'channel access exception: %s' %(e), writer)
+
+def error(pvname, msg, writer):
+  if writer is not None:
+    writer.write({'name' : pvname, 'error' : msg})
+  else:
+    print msg
 
 if __name__ == '__main__':
-  options = Options(['pvnames'], ['timeout'], [])
+  options = Options([], ['pvnames', 'file', 'format', 'timeout'], ['batch'])
   try:
     options.parse()
+    pvnames = read_pvnames(options.pvnames, options.file)
+    if not pvnames:
+      raise RuntimeError, 'no PV names given, use --pvnames or --file'
+    writer = None
+    if options.format not in (None, 'text'):
+      writer = RecordWriter(options.format, FIELDS)
   except Exception, msg:
     options.usage(str(msg))
     sys.exit()
 
-  pvnames = options.pvnames.split()
-
   if options.timeout is not None:
     timeout = float(options.timeout)
   else:
     timeout = 1.0
 
-  states = ["never connected", "previously connected", "connected", "closed"]
-  access = ['none', 'read only', 'write only', 'read-write']
+  if options.batch is not None:
+    # Connect every PV concurrently with a single deadline
+    pvs = dict((pvname, Pv(pvname)) for pvname in pvnames)
+    errors = connect_many(pvs.values(), timeout)
+    for pvname in pvnames:
+      if pvname in errors:
+        error(pvname, 'pyca exception: %s' %(errors[pvname]), writer)
+      else:
+        report(pvs[pvname], writer)
+    sys.exit()
 
   for pvname in pvnames:
     try:
       pv = Pv(pvname)
       pv.connect(timeout)
-      print pv.name
-      print '  State: ', states[pv.state()]
-      print '  Host:  ', pv.host()
-      print '  Access:', access[pv.rwaccess()]
-      print '  Type:  ', pv.type()
-      print '  Count: ', pv.count()
     except pyca.pyexc, e:
-      print 'pyca exception: %s' %(e)
+      error(pvname, 'pyca exception: %s' %(e), writer)
+      continue
     except pyca.caexc, e:
-      print 'channel access exception: %s' %(e)
+      error(pvname, 'channel access exception: %s' %(e), writer)
+      continue
+    report(pv, writer)
@@ -1,38 +1,34 @@
 #!/usr/bin/env python
 
-import pyca
+from backend import pyca
 from Pv import Pv
 
 import sys
 import time
 
-from options import Options
+from options import Options, read_pvnames
+from output import EventWriter, format_value
 
 class monitor(Pv):
-  def __init__(self, name, maxlen, hex):
+  def __init__(self, name, maxlen, hex, writer=None):
     Pv.__init__(self, name)
     self.monitor_cb = self.monitor_handler
     self.__maxlen = maxlen
     self.__hex = hex
+    self.__writer = writer
 
   def monitor_handler(self, exception=None):
+    if self.__writer is not None:
+      # Only queue the event, the writer thread formats it
+      data = self.data
+      self.__writer.put((self.name, data.get('secs'), data.get('nsec'),
+                         data.get('severity'), data.get('status'),
+                         data.get('value'), exception))
+      return
     try:
       if exception is None:
         if self.status == pyca.NO_ALARM:
-          ts = time.localtime(self.secs+pyca.epoch)
-          tstr = time.strftime("%Y-%m-%d %H:%M:%S", ts)
-          try:
-            if (self.__maxlen is not None) and (len(self.value) > int(self.__maxlen)):
-              value = self.value[0:10]
-            else:
-              value = self.value
-          except:
-            value = self.value
-          if self.__hex:
-            try:
-              value = ["0x%x" % v for v in value]
-            except:
-              value = "0x%x" % value  # must be a scalar!
+          value = format_value(self.value, self.__maxlen, self.__hex)
           print "%-30s %08x.%08x" %(self.name, self.secs, self.nsec), value
         else:
           print "%-30s %s %s" %(self.name, 
@@ -44,16 +40,28 @@ class monitor(Pv):
       print e
 
 if __name__ == '__main__':
-  options = Options(['pvnames'], ['timeout', 'maxlen'], ['hex'])
+  options = Options([], ['pvnames', 'file', 'format', 'queue',
+                         'timeout', 'maxlen'], ['hex', 'buffered'])
   try:
     options.parse()
+    pvnames = read_pvnames(options.pvnames, options.file)
+    if not pvnames:
+      raise RuntimeError, 'no PV names given, use --pvnames or --file'
+    writer = None
+    hex = False if ( options.hex == None ) else True
+    if options.buffered is not None or options.format not in (None, 'text'):
+      # Format and print the events from a writer thread, in batches
+      maxsize = 100000
+      if options.queue is not None:
+        maxsize = int(options.queue)
+      writer = EventWriter(options.format or 'text', sys.stdout, maxsize,
+                           maxlen=options.maxlen, hex=hex)
   except Exception, msg:
     options.usage(str(msg))
     sys.exit()
 
-  hex = False if ( options.hex == None ) else True
-  print hex
-  pvnames = options.pvnames.split()
+  if writer is None:
+    print hex
   if options.timeout is not None:
     timeout = float(options.timeout)
   else:
@@ -63,7 +71,7 @@ if __name__ == '__main__':
 
   for pvname in pvnames:
     try:
-      pv = monitor(pvname, options.maxlen, hex)
+      pv = monitor(pvname, options.maxlen, hex, writer)
       pv.connect(timeout)
       pv.monitor(evtmask, ctrl=False)
     except pyca.pyexc, e:
@@ -76,4 +84,6 @@ if __name__ == '__main__':
     while True: raw_input()
   except:
     pass
+  if writer is not None:
+    writer.stop()
 
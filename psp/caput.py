@@ -2,7 +2,7 @@
 
 from Pv import Pv
 
-import pyca
+from backend import pyca
 import sys
 
 from options import Options
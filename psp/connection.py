@@ -0,0 +1,184 @@
+import math
+import time
+import threading
+
+from .backend import pyca
+from . import Pv as _pvmod
+
+"""
+   Parallel connection of large numbers of PVs
+"""
+
+
+class ConnectionManager(object):
+    """
+    Connect many PVs in parallel and wait until enough of them are ready
+
+    :meth:`.start` creates the channel of every PV and flushes once, so the
+    searches for all of the PVs are in flight together instead of one after
+    the other as with :meth:`.Pv.connect`. The manager then keeps a
+    connection callback on each PV, so :attr:`connected` follows
+    disconnections and reconnections until :meth:`.close` is called.
+
+    Parameters
+    ----------
+    pvs : list of :class:`.Pv` or str, optional
+        The PVs, or PV names looked up with :func:`.add_pv_to_cache`
+
+    progress : callable, optional
+        Called as ``progress(pvname, connected, total)`` each time a PV
+        connects or disconnects, on the Channel Access thread
+
+    Attributes
+    ----------
+    connected : set
+        Names of the PVs currently connected
+    """
+    def __init__(self, pvs=(), progress=None):
+        self.progress = progress
+        self.pvs = {}
+        self.connected = set()
+        self.__cond = threading.Condition(threading.Lock())
+        self.__cb_ids = {}
+        self.add(pvs)
+
+
+    def add(self, pvs):
+        """
+        Add PVs to the manager. Their channels are created by the next call
+        to :meth:`.start`
+
+        Parameters
+        ----------
+        pvs : list of :class:`.Pv` or str
+            The PVs, or PV names looked up with :func:`.add_pv_to_cache`
+        """
+        for pv in pvs:
+            if not isinstance(pv, _pvmod.Pv):
+                pv = _pvmod.add_pv_to_cache(pv)
+            if pv.name in self.pvs:
+                continue
+            self.pvs[pv.name] = pv
+            self.__cb_ids[pv.name] = pv.add_connection_callback(
+                lambda isconnected, pv=pv: self.__on_connection(pv,
+                                                                isconnected))
+            if pv.isconnected:
+                self.__on_connection(pv, True)
+
+
+    def __on_connection(self, pv, isconnected):
+        with self.__cond:
+            if isconnected:
+                if pv.name in self.connected:
+                    return
+                self.connected.add(pv.name)
+                self.__cond.notify_all()
+            else:
+                if pv.name not in self.connected:
+                    return
+                self.connected.discard(pv.name)
+            count = len(self.connected)
+        if self.progress is not None:
+            self.progress(pv.name, count, len(self.pvs))
+
+
+    def start(self):
+        """
+        Create the channels of all the PVs that are not connected and flush
+        the requests once
+        """
+        for pv in self.pvs.values():
+            if pv.isconnected:
+                continue
+            try:
+                pv.create_channel()
+            except pyca.pyexc:
+                pass # The channel is already searching for the IOC
+        pyca.flush_io()
+
+
+    def __required(self, fraction, critical):
+        if fraction is None and critical is None:
+            fraction = 1.0
+        if fraction is None:
+            return 0
+        return int(math.ceil(fraction * len(self.pvs)))
+
+
+    def ready(self, fraction=None, critical=None):
+        """
+        Return whether the readiness condition is met
+
+        Parameters
+        ----------
+        fraction : float, optional
+            Fraction of the PVs, between 0 and 1, that must be connected. If
+            neither fraction nor critical is given, every PV is required
+
+        critical : iterable of str, optional
+            Names of PVs that must all be connected
+        """
+        critical = set(critical or ())
+        with self.__cond:
+            return self.__ready(self.__required(fraction, critical or None),
+                                critical)
+
+
+    def __ready(self, required, critical):
+        return (len(self.connected) >= required
+                and critical.issubset(self.connected))
+
+
+    def wait(self, timeout=_pvmod.DEFAULT_TIMEOUT, fraction=None,
+             critical=None):
+        """
+        Start the connections and wait until the readiness condition is met
+
+        Parameters
+        ----------
+        timeout : float or None, optional
+            Time to wait. If None, wait indefinitely
+
+        fraction : float, optional
+            Fraction of the PVs, between 0 and 1, that must be connected. If
+            neither fraction nor critical is given, every PV is required
+
+        critical : iterable of str, optional
+            Names of PVs that must all be connected. They are added to the
+            manager if needed
+
+        Returns
+        -------
+        unconnected : set
+            Names of the PVs not connected when the wait ended. Use
+            :meth:`.ready` to tell whether the condition was met
+        """
+        critical = set(critical or ())
+        self.add(critical)
+        self.start()
+        deadline = _pvmod._deadline(timeout)
+        required = self.__required(fraction, critical or None)
+        with self.__cond:
+            while not self.__ready(required, critical):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.__cond.wait(remaining)
+            return set(self.pvs) - self.connected
+
+
+    def unconnected(self):
+        """
+        Return the names of the PVs not currently connected
+        """
+        with self.__cond:
+            return set(self.pvs) - self.connected
+
+
+    def close(self):
+        """
+        Stop tracking the connections. The channels are left open
+        """
+        for (name, cb_id) in self.__cb_ids.items():
+            self.pvs[name].del_connection_callback(cb_id)
+        self.__cb_ids.clear()
@@ -0,0 +1,280 @@
+import time
+import threading
+import collections
+
+from .backend import pyca
+from . import Pv as _pvmod
+
+"""
+   Assembly of the monitor events of several PVs into per-pulse records
+"""
+
+FIDUCIAL_MASK = 0x1ffff
+
+Record = collections.namedtuple('Record', ['key', 'values', 'timestamps'])
+
+
+def fiducial(pv):
+    """
+    Return the pulse ID carried in the low bits of the PV nanoseconds
+    """
+    return pv.nsec & FIDUCIAL_MASK
+
+
+def timestamp(pv):
+    """
+    Return the PV timestamp as a (secs, nsec) tuple
+    """
+    return (pv.secs, pv.nsec)
+
+
+class _Pending(object):
+    """
+    A record that is waiting for some of its PVs
+    """
+    def __init__(self, key, ref):
+        self.key = key
+        self.ref = ref
+        self.values = {}
+        self.timestamps = {}
+        self.created = time.time()
+
+    def record(self):
+        return Record(self.key, self.values, self.timestamps)
+
+
+class Correlator(object):
+    """
+    Combine the monitor events of several PVs that belong to the same pulse
+
+    Each event is keyed by its timestamp, by the fiducial held in the low 17
+    bits of the nanoseconds, or by any function of the PV. Events are held per
+    key until every PV has reported, at which point a :class:`.Record` of the
+    values and timestamps is passed to the callback and kept in
+    :attr:`records`. Matching is done with a dictionary lookup, or by
+    comparing against the few pending records when a timestamp tolerance is
+    given.
+
+    A record that is still missing PVs when more than maxlen records are
+    pending, or that is found to be older than max_age seconds when the next
+    event arrives, is dropped and counted as incomplete. Events arriving for a
+    key that has already been completed or dropped are counted as late.
+
+    Parameters
+    ----------
+    pvs : list of :class:`.Pv` or str
+        The PVs, or PV names looked up with :func:`.add_pv_to_cache`
+
+    callback : callable, optional
+        Called with each complete :class:`.Record`, on the thread running the
+        monitor callbacks
+
+    key : str or callable, optional
+        ``'timestamp'``, ``'fiducial'`` or a function of the PV returning a
+        hashable key
+
+    tolerance : float, optional
+        With ``key='timestamp'``, events whose timestamps differ by at most
+        this many seconds are considered the same pulse
+
+    maxlen : int, optional
+        Maximum number of pending records
+
+    max_age : float, optional
+        Time in seconds after which a pending record is dropped
+
+    on_incomplete : callable, optional
+        Called with each dropped record, holding the PVs that did arrive
+
+    history : int, optional
+        Number of complete records kept in :attr:`records`
+
+    Attributes
+    ----------
+    records : collections.deque
+        The most recent complete records, oldest first
+
+    complete : int
+        Number of complete records
+
+    incomplete : int
+        Number of records dropped before all PVs arrived
+
+    late : int
+        Number of events for records already completed or dropped
+
+    duplicates : int
+        Number of events replacing a value already held for the same PV and
+        key
+    """
+    def __init__(self, pvs, callback=None, key='timestamp', tolerance=0.0,
+                 maxlen=100, max_age=None, on_incomplete=None, history=100):
+        self.pvs = [pv if isinstance(pv, _pvmod.Pv)
+                    else _pvmod.add_pv_to_cache(pv) for pv in pvs]
+        self.names = frozenset(pv.name for pv in self.pvs)
+        if len(self.names) != len(self.pvs):
+            raise ValueError("the PVs of a Correlator must be distinct")
+        if key == 'timestamp':
+            self.key = timestamp
+        elif key == 'fiducial':
+            self.key = fiducial
+        elif callable(key):
+            self.key = key
+        else:
+            raise ValueError("key must be 'timestamp', 'fiducial' or callable")
+        if tolerance and key != 'timestamp':
+            raise ValueError("tolerance can only be used with timestamp keys")
+        self.tolerance = tolerance
+        self.callback = callback
+        self.on_incomplete = on_incomplete
+        self.maxlen  = maxlen
+        self.max_age = max_age
+        self.records = collections.deque(maxlen=history)
+        self.complete   = 0
+        self.incomplete = 0
+        self.late       = 0
+        self.duplicates = 0
+        self.__lock = threading.Lock()
+        self.__pending = collections.OrderedDict()
+        self.__finished = collections.OrderedDict()
+        self.__cb_ids = {}
+
+
+    def start(self, timeout=_pvmod.DEFAULT_TIMEOUT):
+        """
+        Connect to the PVs and start monitoring them
+
+        Parameters
+        ----------
+        timeout : float or None, optional
+            Time to wait for all the PVs to connect. If None, wait
+            indefinitely
+
+        Raises
+        ------
+        pyca.pyexc
+            If some of the PVs did not connect
+        """
+        errors = _pvmod._connect_pvs(self.pvs, _pvmod._deadline(timeout))
+        if errors:
+            raise pyca.pyexc("correlator: PVs did not connect: %s"
+                             % ', '.join(sorted(errors)))
+        for pv in self.pvs:
+            if pv.name not in self.__cb_ids:
+                self.__cb_ids[pv.name] = pv.add_monitor_callback(
+                    lambda e, pv=pv: self.__on_event(pv, e))
+            if not pv.ismonitored:
+                pv.monitor_start()
+
+
+    def stop(self):
+        """
+        Stop listening to the PVs and drop the pending records
+
+        The PVs themselves are left monitored, as other code may share them.
+        """
+        for pv in self.pvs:
+            cb_id = self.__cb_ids.pop(pv.name, None)
+            if cb_id is not None:
+                pv.del_monitor_callback(cb_id)
+        with self.__lock:
+            self.__pending.clear()
+            self.__finished.clear()
+
+
+    def pending(self):
+        """
+        Return the number of records waiting for some of their PVs
+        """
+        return len(self.__pending)
+
+
+    def stats(self):
+        """
+        Return the correlator counters as a dictionary
+        """
+        return {'complete'   : self.complete,
+                'incomplete' : self.incomplete,
+                'late'       : self.late,
+                'duplicates' : self.duplicates,
+                'pending'    : self.pending()}
+
+
+    def __is_finished(self, key, ref):
+        if not self.tolerance:
+            return key in self.__finished
+        for other in self.__finished.values():
+            if abs(other - ref) <= self.tolerance:
+                return True
+        return False
+
+
+    def __find_pending(self, key, ref):
+        if not self.tolerance:
+            return self.__pending.get(key)
+        for entry in self.__pending.values():
+            if abs(entry.ref - ref) <= self.tolerance:
+                return entry
+        return None
+
+
+    def __on_event(self, pv, e=None):
+        if e is not None:
+            return
+        key = self.key(pv)
+        ref = None
+        if self.tolerance:
+            ref = key[0] + key[1] * 1e-9
+        done = []
+        dropped = []
+        with self.__lock:
+            if self.__is_finished(key, ref):
+                self.late += 1
+                return
+            entry = self.__find_pending(key, ref)
+            if entry is None:
+                entry = _Pending(key, ref)
+                self.__pending[key] = entry
+            if pv.name in entry.values:
+                self.duplicates += 1
+            entry.values[pv.name] = pv.value
+            entry.timestamps[pv.name] = pv.timestamp()
+            if len(entry.values) == len(self.names):
+                del self.__pending[entry.key]
+                self.__finish(entry)
+                self.complete += 1
+                self.records.append(entry.record())
+                done.append(entry.record())
+            dropped = self.__expire()
+        if self.on_incomplete is not None:
+            for record in dropped:
+                self.on_incomplete(record)
+        if self.callback is not None:
+            for record in done:
+                self.callback(record)
+
+
+    def __finish(self, entry):
+        self.__finished[entry.key] = entry.ref
+        while len(self.__finished) > self.maxlen:
+            self.__finished.popitem(last=False)
+
+
+    def __expire(self):
+        """
+        Drop the pending records over the size or age limits
+        """
+        dropped = []
+        now = time.time()
+        while self.__pending:
+            key = next(iter(self.__pending))
+            entry = self.__pending[key]
+            if (len(self.__pending) <= self.maxlen
+                    and (self.max_age is None
+                         or now - entry.created <= self.max_age)):
+                break
+            del self.__pending[key]
+            self.__finish(entry)
+            self.incomplete += 1
+            dropped.append(entry.record())
+        return dropped
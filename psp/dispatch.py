@@ -0,0 +1,241 @@
+import time
+import threading
+import traceback
+import collections
+
+"""
+   Delivery of monitor callbacks outside of the Channel Access thread
+"""
+
+POLICIES = ('block', 'drop_oldest', 'latest')
+
+# Set on a worker thread while it runs the callbacks of one event
+delivering = threading.local()
+
+
+class _Queue(object):
+    """
+    Events waiting for one worker thread
+    """
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.events = collections.deque()
+        self.pending = {}
+        self.busy = False
+        self.submitted = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+
+class MonitorDispatcher(object):
+    """
+    Run monitor callbacks on a pool of worker threads
+
+    By default :class:`.Pv` runs its monitor callbacks inline, on the Channel
+    Access thread, so one slow callback delays the updates of every PV in the
+    process. When a dispatcher is installed, either for one PV with
+    :attr:`.Pv.monitor_dispatcher` or for every PV with
+    :func:`.set_monitor_dispatcher`, the monitor handler only stores the
+    update and queues a snapshot of the PV data. The callbacks then run on a
+    worker thread, where :attr:`.Pv.value`, :attr:`.Pv.data` lookups and
+    :meth:`.Pv.timestamp` report the queued event rather than the newest one.
+
+    Every PV is always served by the same worker, so the callbacks of a PV
+    run one event at a time and in the order the events arrived. Each worker
+    has a queue of at most maxsize events. What happens when it is full is
+    decided by the policy :
+
+    * ``'block'``, the Channel Access thread waits for the worker to catch up.
+      Nothing is lost but every PV is delayed
+    * ``'drop_oldest'``, the oldest queued event is discarded
+    * ``'latest'``, only the newest event of each PV is kept. A new event
+      replaces the one already queued for the same PV, so slow callbacks
+      simply see fewer, more recent updates
+
+    Parameters
+    ----------
+    workers : int, optional
+        Number of worker threads
+
+    maxsize : int, optional
+        Maximum number of events queued for each worker
+
+    policy : str, optional
+        One of ``'block'``, ``'drop_oldest'`` or ``'latest'``
+    """
+    def __init__(self, workers=1, maxsize=1000, policy='block'):
+        if policy not in POLICIES:
+            raise ValueError("policy must be one of %s" % ', '.join(POLICIES))
+        if workers < 1 or maxsize < 1:
+            raise ValueError("workers and maxsize must be at least 1")
+        self.policy  = policy
+        self.maxsize = maxsize
+        self.__running = True
+        self.__queues  = [_Queue() for _ in range(workers)]
+        self.__threads = []
+        for (i, queue) in enumerate(self.__queues):
+            t = threading.Thread(target=self.__run, args=(queue,),
+                                 name='psp-monitor-%d' % i)
+            t.daemon = True
+            t.start()
+            self.__threads.append(t)
+
+
+    def submit(self, pv, e, data):
+        """
+        Queue the monitor callbacks of a PV
+
+        Parameters
+        ----------
+        pv : :class:`.Pv`
+            The PV whose callbacks should run
+
+        e : str or None
+            The argument given to the callbacks, None unless Channel Access
+            reported an error
+
+        data : dict
+            A copy of the PV data at the time of the event
+
+        Returns
+        -------
+        queued : bool
+            False if the dispatcher has been stopped
+        """
+        queue = self.__queues[hash(pv.name) % len(self.__queues)]
+        latest = self.policy == 'latest'
+        with queue.cond:
+            if not self.__running:
+                return False
+            queue.submitted += 1
+            if latest and id(pv) in queue.pending:
+                entry = queue.pending[id(pv)]
+                entry[1] = e
+                entry[2] = data
+                queue.dropped += 1
+                return True
+            while len(queue.events) >= self.maxsize:
+                # A callback adding events must never wait for itself
+                if (self.policy == 'block' and self.__running
+                        and not getattr(delivering, 'worker', False)):
+                    queue.cond.wait()
+                    continue
+                if self.policy == 'block':
+                    break
+                old = queue.events.popleft()
+                if latest:
+                    queue.pending.pop(id(old[0]), None)
+                queue.dropped += 1
+            entry = [pv, e, data]
+            queue.events.append(entry)
+            if latest:
+                queue.pending[id(pv)] = entry
+            queue.max_depth = max(queue.max_depth, len(queue.events))
+            queue.cond.notify_all()
+        return True
+
+
+    def __run(self, queue):
+        delivering.worker = True
+        latest = self.policy == 'latest'
+        while True:
+            with queue.cond:
+                while self.__running and not queue.events:
+                    queue.cond.wait()
+                if not queue.events:
+                    return
+                (pv, e, data) = queue.events.popleft()
+                if latest:
+                    queue.pending.pop(id(pv), None)
+                queue.busy = True
+                queue.cond.notify_all()
+            delivering.event = (pv, data)
+            try:
+                pv._run_monitor_callbacks(e)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                delivering.event = None
+            with queue.cond:
+                queue.busy = False
+                queue.delivered += 1
+                queue.cond.notify_all()
+
+
+    def flush(self, timeout=None):
+        """
+        Wait until every queued event has been delivered
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum time to wait. If None, wait indefinitely
+
+        Returns
+        -------
+        result : bool
+            False if the timeout was exceeded
+        """
+        if timeout is not None:
+            deadline = time.time() + timeout
+        for queue in self.__queues:
+            with queue.cond:
+                while queue.events or queue.busy:
+                    if timeout is None:
+                        queue.cond.wait()
+                        continue
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    queue.cond.wait(remaining)
+        return True
+
+
+    def stop(self, timeout=None):
+        """
+        Stop accepting events and end the worker threads once the events
+        already queued have been delivered
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum time to wait for each worker. If None, wait indefinitely
+        """
+        self.__running = False
+        for queue in self.__queues:
+            with queue.cond:
+                queue.cond.notify_all()
+        for t in self.__threads:
+            if t is not threading.current_thread():
+                t.join(timeout)
+
+
+    def depth(self):
+        """
+        Return the number of events waiting to be delivered
+        """
+        return sum(len(queue.events) for queue in self.__queues)
+
+
+    def stats(self):
+        """
+        Return the dispatcher counters as a dictionary
+
+        Returns
+        -------
+        stats : dict
+            A dictionary with the keys : depth, max_depth, submitted,
+            delivered and dropped. max_depth is the largest number of events
+            seen queued for a single worker
+        """
+        stats = {'depth' : 0, 'max_depth' : 0, 'submitted' : 0,
+                 'delivered' : 0, 'dropped' : 0}
+        for queue in self.__queues:
+            with queue.cond:
+                stats['depth']    += len(queue.events)
+                stats['max_depth'] = max(stats['max_depth'], queue.max_depth)
+                stats['submitted'] += queue.submitted
+                stats['delivered'] += queue.delivered
+                stats['dropped']   += queue.dropped
+        return stats
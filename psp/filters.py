@@ -0,0 +1,322 @@
+import time
+import atexit
+import threading
+import collections
+import numpy as np
+
+from . import utils
+
+"""
+   Filters applied to monitor events before they reach the callbacks
+"""
+
+# Flushes run user callbacks, so they have a thread of their own rather than
+# holding up the timers of utils.scheduler
+flush_scheduler = utils.Scheduler('psp-rate-limit')
+atexit.register(flush_scheduler.stop)
+
+
+class RateLimiter(object):
+    """
+    Call a monitor callback at most max_rate times per second
+
+    The first event is passed through immediately. Events arriving less than
+    1 / max_rate seconds after the last delivered one are coalesced: if flush
+    is set, the callback is run once more at the end of the interval, from the
+    :data:`.filters.flush_scheduler` thread, when the PV holds the newest value.
+    Without flush they are simply discarded. Error events are never held back.
+
+    The callback never runs on two threads at once. An event arriving while
+    another thread is running it is handed over to that thread, which runs
+    the callback again once done, so the Channel Access thread does not wait
+    on a slow flush.
+
+    Parameters
+    ----------
+    fn : callable
+        Called with the argument of the monitor event
+
+    max_rate : float
+        Maximum number of calls per second
+
+    flush : bool, optional
+        Deliver the newest coalesced event at the end of each interval
+
+    Attributes
+    ----------
+    events : int
+        Number of events received
+
+    delivered : int
+        Number of times fn has been called
+    """
+    def __init__(self, fn, max_rate, flush=True, scheduler=None):
+        if max_rate <= 0:
+            raise ValueError("max_rate must be positive")
+        self.fn = fn
+        self.max_rate  = max_rate
+        self.interval  = 1.0 / max_rate
+        self.flush     = flush
+        self.scheduler = scheduler or flush_scheduler
+        self.events    = 0
+        self.delivered = 0
+        self.__lock  = threading.Lock()
+        self.__last  = None
+        self.__timer = None
+        # Delivery state, under its own lock
+        self.__delivery = threading.Lock()
+        self.__busy   = False
+        self.__queued = collections.deque()
+
+
+    def __call__(self, e=None):
+        if e is not None:
+            self.__run(e)
+            return
+        with self.__lock:
+            self.events += 1
+            now = time.time()
+            if self.__timer is not None:
+                return
+            if self.__last is not None and now - self.__last < self.interval:
+                if self.flush:
+                    self.__timer = self.scheduler.schedule(
+                        self.__last + self.interval - now, self.__flush)
+                return
+            self.__last = now
+        self.__run(None)
+
+
+    def __run(self, arg):
+        """
+        Call fn with arg, or leave the call to the thread already calling it.
+        fn runs without the lock, so a slow callback does not hold back the
+        events
+        """
+        with self.__delivery:
+            if self.__busy:
+                # Value events carry no data, one pending call is enough
+                if (arg is not None or not self.__queued
+                        or self.__queued[-1] is not None):
+                    self.__queued.append(arg)
+                return
+            self.__busy = True
+            if arg is None:
+                self.delivered += 1
+        finished = False
+        try:
+            while True:
+                self.fn(arg)
+                with self.__delivery:
+                    if not self.__queued:
+                        self.__busy = False
+                        finished = True
+                        return
+                    arg = self.__queued.popleft()
+                    if arg is None:
+                        self.delivered += 1
+        finally:
+            if not finished:
+                with self.__delivery:
+                    self.__busy = False
+
+
+    def __flush(self):
+        with self.__lock:
+            if self.__timer is None:
+                return
+            self.__timer = None
+            self.__last = time.time()
+        self.__run(None)
+
+
+    @property
+    def suppressed(self):
+        """
+        Number of events that did not result in a call
+        """
+        return self.events - self.delivered
+
+
+    def deliver_pending(self):
+        """
+        Run the pending flush now rather than at the end of the interval
+        """
+        with self.__lock:
+            if self.__timer is None:
+                return
+            self.scheduler.cancel(self.__timer)
+            self.__timer = None
+            self.__last = time.time()
+        self.__run(None)
+
+
+    def cancel(self):
+        """
+        Drop the pending flush, if any
+        """
+        with self.__lock:
+            if self.__timer is not None:
+                self.scheduler.cancel(self.__timer)
+                self.__timer = None
+
+
+class Deadband(object):
+    """
+    Decide whether a monitor update differs enough from the last accepted one
+
+    An update is accepted when it changes by more than the deadband, which is
+    the larger of the absolute deadband and the relative deadband times the
+    magnitude of the last accepted value. Waveforms are compared element by
+    element with NumPy, and accepted as soon as any element is outside its
+    deadband. An absolute deadband given as an array sets a separate
+    deadband per element, and a scalar PV must then stay within every one of
+    them. Changes of size, of non-numeric values and of the alarm state are
+    always accepted, as is the first update.
+
+    Parameters
+    ----------
+    absolute : float or array, optional
+        Absolute deadband, in the units of the PV
+
+    relative : float, optional
+        Relative deadband, as a fraction of the last accepted value
+
+    Attributes
+    ----------
+    events : int
+        Number of updates checked
+
+    filtered : int
+        Number of updates rejected
+    """
+    def __init__(self, absolute=None, relative=None):
+        if absolute is None and relative is None:
+            raise ValueError("an absolute or relative deadband is needed")
+        if isinstance(absolute, (np.ndarray, tuple, list)):
+            absolute = np.asarray(absolute, dtype=np.float64)
+        self.absolute = absolute
+        self.relative = relative
+        self.events   = 0
+        self.filtered = 0
+        self.__lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self):
+        """
+        Accept the next update whatever its value
+        """
+        self.__last  = None
+        self.__alarm = None
+        self.__diff  = None
+        self.__over  = None
+
+
+    def accept(self, value, alarm=None):
+        """
+        Check an update, remembering it if it is accepted
+
+        Parameters
+        ----------
+        value : float, int, str or array
+            The new value
+
+        alarm : tuple, optional
+            The (severity, status) of the update
+
+        Returns
+        -------
+        accepted : bool
+        """
+        with self.__lock:
+            self.events += 1
+            if (self.__last is not None and alarm == self.__alarm
+                    and self.__inside(value)):
+                self.filtered += 1
+                return False
+            self.__alarm = alarm
+            self.__remember(value)
+            return True
+
+
+    def __inside(self, value):
+        last = self.__last
+        if isinstance(last, np.ndarray):
+            value = np.asarray(value)
+            if value.shape != last.shape or value.dtype.kind in 'SUO':
+                return False
+            diff = self.__diff
+            np.subtract(value, last, out=diff, dtype=np.float64)
+            np.abs(diff, out=diff)
+            band = self.__band(last)
+            return not np.any(np.greater(diff, band, out=self.__over))
+        try:
+            # Reduced, as the band may be an array
+            return bool(np.all(abs(value - last) <= self.__band(last)))
+        except TypeError:
+            return value == last
+
+
+    def __band(self, last):
+        absolute = self.absolute if self.absolute is not None else 0.0
+        if self.relative is None:
+            return absolute
+        if isinstance(last, np.ndarray) or isinstance(absolute, np.ndarray):
+            return np.maximum(absolute, self.relative * np.abs(last))
+        return max(absolute, self.relative * abs(last))
+
+
+    def __remember(self, value):
+        if not isinstance(value, (np.ndarray, tuple, list)):
+            self.__last = value
+            return
+        value = np.asarray(value)
+        last = self.__last
+        if (isinstance(last, np.ndarray) and last.shape == value.shape
+                and last.dtype == value.dtype):
+            np.copyto(last, value)
+        elif value.dtype.kind in 'SUO':
+            self.__last = value.copy()
+        else:
+            self.__last = value.copy()
+            self.__diff = np.empty(value.shape, dtype=np.float64)
+            self.__over = np.empty(value.shape, dtype=bool)
+
+
+class FilteredCallback(object):
+    """
+    Run a monitor callback only for the updates accepted by a
+    :class:`.Deadband`
+
+    Parameters
+    ----------
+    fn : callable
+        Called with the argument of the monitor event
+
+    pv : :class:`.Pv`
+        The PV whose value and alarm state are checked
+
+    deadband : :class:`.Deadband`
+        The filter
+    """
+    def __init__(self, fn, pv, deadband):
+        self.fn = fn
+        self.pv = pv
+        self.deadband = deadband
+
+
+    def __call__(self, e=None):
+        if e is None:
+            pv = self.pv
+            if not self.deadband.accept(pv.value, (pv.severity, pv.status)):
+                return
+        self.fn(e)
+
+
+    def cancel(self):
+        """
+        Cancel the wrapped callback, if it supports it
+        """
+        if isinstance(self.fn, RateLimiter):
+            self.fn.cancel()
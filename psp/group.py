@@ -0,0 +1,224 @@
+import time
+import threading
+import collections
+
+from .backend import pyca
+from . import Pv as _pvmod
+from . import utils
+
+"""
+   Waiting on a condition over a group of PVs
+"""
+
+MODES = ('all', 'any')
+
+GroupResult = collections.namedtuple('GroupResult', ['done', 'satisfied',
+                                                     'blocking', 'triggered'])
+
+
+def _as_predicate(condition):
+    """
+    Turn a target value into a predicate of the PV value, comparing waveforms
+    element by element as :meth:`.Pv.wait_for_value` does
+    """
+    if callable(condition):
+        return condition
+    return lambda value: utils.all_condition(lambda: value == condition)()
+
+
+class GroupWait(object):
+    """
+    Wait for a condition over many PVs with one event and one timeout
+
+    Each PV has its own predicate, called with the PV value. The result of
+    every predicate is cached and only the predicate of the PV that sent a
+    monitor event is evaluated again, after which the group condition is
+    checked against the set of satisfied PVs. The group condition is that
+    all or any of the PVs are satisfied, or any function of the dictionary of
+    PV name / satisfied pairings. Independently, any abort predicate becoming
+    True ends the wait, e.g. an interlock tripping while motors move.
+
+    All the PVs are connected and subscribed together, without waiting for
+    them one at a time. PVs that are not monitored yet are left monitored
+    afterwards, like :meth:`.Pv.wait_condition` does.
+
+    Parameters
+    ----------
+    conditions : dict
+        PV name / condition pairings. A condition is a callable taking the
+        PV value and returning a bool, or a value the PV must reach
+
+    mode : str or callable, optional
+        ``'all'``, ``'any'`` or a function taking the dictionary of PV name /
+        satisfied pairings and returning whether the group is satisfied
+
+    abort : dict, optional
+        PV name / condition pairings that end the wait as soon as one of them
+        is True
+
+    Attributes
+    ----------
+    evaluations : int
+        Number of times a predicate was evaluated
+    """
+    def __init__(self, conditions, mode='all', abort=None):
+        if not callable(mode) and mode not in MODES:
+            raise ValueError("mode must be 'all', 'any' or callable")
+        self.mode = mode
+        self.conditions = dict((name, _as_predicate(cond))
+                               for (name, cond) in conditions.items())
+        self.abort = dict((name, _as_predicate(cond))
+                          for (name, cond) in (abort or {}).items())
+        self.evaluations = 0
+        self.__lock = threading.Lock()
+        self.__event = threading.Event()
+        self.__met = set()
+        self.__triggered = set()
+        self.__cb_ids = {}
+
+
+    def __group_met(self):
+        if self.mode == 'all':
+            return len(self.__met) == len(self.conditions)
+        if self.mode == 'any':
+            return bool(self.__met)
+        return bool(self.mode(dict((name, name in self.__met)
+                                   for name in self.conditions)))
+
+
+    def __update(self, pv, e=None):
+        if e is not None or 'value' not in pv.data:
+            return
+        value = pv.value
+        name = pv.name
+        with self.__lock:
+            if name in self.conditions:
+                self.evaluations += 1
+                if self.conditions[name](value):
+                    self.__met.add(name)
+                else:
+                    self.__met.discard(name)
+            if name in self.abort:
+                self.evaluations += 1
+                if self.abort[name](value):
+                    self.__triggered.add(name)
+                else:
+                    self.__triggered.discard(name)
+            if self.__triggered or self.__group_met():
+                self.__event.set()
+
+
+    def wait(self, timeout=60):
+        """
+        Connect to the PVs and wait for the group condition
+
+        Parameters
+        ----------
+        timeout : float or None, optional
+            Maximum time to wait, including the connection of the PVs. If
+            None, wait indefinitely
+
+        Returns
+        -------
+        result : :class:`.GroupResult`
+            done is False if the wait timed out. satisfied and blocking are
+            the sorted names of the PVs whose condition held or did not hold
+            when the wait ended, and triggered those of the abort conditions
+            that ended it, if any. PVs that did not connect are blocking
+        """
+        deadline = _pvmod._deadline(timeout)
+        names = set(self.conditions) | set(self.abort)
+        pvs = [_pvmod.add_pv_to_cache(name) for name in names]
+        self.__event.clear()
+        with self.__lock:
+            self.__met.clear()
+            self.__triggered.clear()
+        for pv in pvs:
+            self.__cb_ids[pv.name] = pv.add_monitor_callback(
+                lambda e, pv=pv: self.__update(pv, e))
+        try:
+            _pvmod._connect_pvs(pvs, deadline)
+            for pv in pvs:
+                if not pv.isconnected:
+                    continue
+                if pv.ismonitored:
+                    self.__update(pv)
+                else:
+                    # Pv.monitor would also make a blocking get, the first
+                    # monitor event brings the current value instead
+                    pv.subscribe_channel(pyca.DBE_VALUE | pyca.DBE_LOG
+                                         | pyca.DBE_ALARM,
+                                         pv.control, pv.count)
+                    pv.ismonitored = True
+            pyca.flush_io()
+            remaining = deadline - time.time()
+            if remaining == float('inf'):
+                self.__event.wait()
+            elif remaining > 0:
+                self.__event.wait(remaining)
+        finally:
+            for pv in pvs:
+                cb_id = self.__cb_ids.pop(pv.name, None)
+                if cb_id is not None:
+                    pv.del_monitor_callback(cb_id)
+        with self.__lock:
+            met = set(self.__met)
+            triggered = sorted(self.__triggered)
+            done = bool(triggered) or self.__group_met()
+        return GroupResult(done, sorted(met),
+                           sorted(set(self.conditions) - met), triggered)
+
+
+def wait_all(conditions, timeout=60, abort=None):
+    """
+    Wait for every PV to meet its condition
+
+    Parameters
+    ----------
+    conditions : dict
+        PV name / condition pairings. A condition is a callable taking the
+        PV value and returning a bool, or a value the PV must reach
+
+    timeout : float or None, optional
+        Maximum time to wait
+
+    abort : dict, optional
+        PV name / condition pairings that end the wait as soon as one of them
+        is True
+
+    Returns
+    -------
+    result : :class:`.GroupResult`
+        Whether the wait ended before the timeout and which PVs satisfied or
+        blocked it
+
+    See Also
+    --------
+    :class:`.GroupWait`
+    """
+    return GroupWait(conditions, 'all', abort).wait(timeout)
+
+
+def wait_any(conditions, timeout=60):
+    """
+    Wait for any of the PVs to meet its condition
+
+    Parameters
+    ----------
+    conditions : dict
+        PV name / condition pairings. A condition is a callable taking the
+        PV value and returning a bool, or a value the PV must reach
+
+    timeout : float or None, optional
+        Maximum time to wait
+
+    Returns
+    -------
+    result : :class:`.GroupResult`
+        Whether the wait ended before the timeout and which PVs satisfied it
+
+    See Also
+    --------
+    :class:`.GroupWait`
+    """
+    return GroupWait(conditions, 'any').wait(timeout)
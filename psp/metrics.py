@@ -0,0 +1,434 @@
+import sys
+import json
+import time
+import bisect
+import threading
+
+from . import utils
+
+"""
+   Opt-in latency and throughput metrics for PV operations
+"""
+
+OPERATIONS = ('connect', 'get', 'put', 'lock_wait', 'callback')
+
+# Upper bounds in seconds of the histogram buckets, doubling from 1 us to
+# about 2 minutes. Slower samples fall in a final overflow bucket
+BOUNDS = tuple(1e-6 * 2**i for i in range(28))
+
+enabled = False
+
+
+class Histogram(object):
+    """
+    Latency histogram with fixed, logarithmic buckets
+
+    Recording a sample is a binary search over :data:`BOUNDS` and a few
+    additions, so no samples are kept. Percentiles are estimated as the upper
+    bound of the bucket holding them, capped by the largest sample, which is
+    within a factor of two of the true value.
+
+    Attributes
+    ----------
+    count : int
+        Number of samples
+
+    total : float
+        Sum of the samples in seconds
+
+    max : float
+        Largest sample in seconds
+    """
+    def __init__(self):
+        self.buckets = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max   = 0.0
+
+
+    def add(self, seconds):
+        """
+        Record a sample, in seconds
+        """
+        self.buckets[bisect.bisect_left(BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+
+    def percentile(self, q):
+        """
+        Return an estimate of the q-th percentile, q between 0 and 100
+        """
+        if not self.count:
+            return None
+        rank = q / 100.0 * self.count
+        seen = 0
+        for (i, n) in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                if i < len(BOUNDS):
+                    return min(BOUNDS[i], self.max)
+                return self.max
+        return self.max
+
+
+    def merge(self, other):
+        """
+        Add the samples of another histogram
+        """
+        for (i, n) in enumerate(other.buckets):
+            self.buckets[i] += n
+        self.count += other.count
+        self.total += other.total
+        if other.max > self.max:
+            self.max = other.max
+
+
+    def snapshot(self):
+        """
+        Return the histogram as a dictionary
+
+        Returns
+        -------
+        snapshot : dict
+            A dictionary with the keys : count, total, mean, max, p50, p90,
+            p99 and buckets, a list of [upper bound, count] pairs for the
+            non-empty buckets. The overflow bucket has a bound of None
+        """
+        return {'count'   : self.count,
+                'total'   : self.total,
+                'mean'    : self.total / self.count if self.count else None,
+                'max'     : self.max,
+                'p50'     : self.percentile(50),
+                'p90'     : self.percentile(90),
+                'p99'     : self.percentile(99),
+                'buckets' : [[BOUNDS[i] if i < len(BOUNDS) else None, n]
+                             for (i, n) in enumerate(self.buckets) if n]}
+
+
+class _Entry(object):
+    """
+    The counters and histograms of one PV, or of all of them
+    """
+    def __init__(self):
+        self.counters = {}
+        self.latency = {}
+
+
+    def count(self, name, n):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+
+    def record(self, op, seconds):
+        hist = self.latency.get(op)
+        if hist is None:
+            hist = self.latency[op] = Histogram()
+        hist.add(seconds)
+
+
+    def merge(self, other):
+        for (name, n) in other.counters.items():
+            self.count(name, n)
+        for (op, hist) in other.latency.items():
+            mine = self.latency.get(op)
+            if mine is None:
+                mine = self.latency[op] = Histogram()
+            mine.merge(hist)
+
+
+    def snapshot(self, elapsed):
+        rates = {}
+        if elapsed > 0:
+            rates = dict((name, n / elapsed)
+                         for (name, n) in self.counters.items())
+        return {'counters' : dict(self.counters),
+                'rates'    : rates,
+                'latency'  : dict((op, hist.snapshot())
+                                 for (op, hist) in self.latency.items())}
+
+
+class _Shard(object):
+    """
+    The per-PV entries written by one thread
+    """
+    def __init__(self, thread=None):
+        self.thread = thread
+        self.lock = threading.Lock()
+        self.clear()
+
+
+    def clear(self):
+        self.pvs = {}
+        # The totals of the PVs that were forgotten
+        self.retired = _Entry()
+
+
+    def entry(self, pvname):
+        entry = self.pvs.get(pvname)
+        if entry is None:
+            entry = self.pvs[pvname] = _Entry()
+        return entry
+
+
+    def absorb(self, other):
+        for (name, entry) in other.pvs.items():
+            self.entry(name).merge(entry)
+        self.retired.merge(other.retired)
+
+
+class Registry(object):
+    """
+    Global and per-PV counters and latency histograms
+
+    Latencies are recorded for the operations in :data:`OPERATIONS`. Each
+    thread records into its own accumulators, under a lock that only
+    :meth:`.snapshot`, :meth:`.forget` and :meth:`.reset` contend for, and
+    the global totals are the sum of every PV, computed by
+    :meth:`.snapshot`. The accumulators of threads that have exited are
+    merged into a common one, so short-lived threads do not add up.
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__shards = []
+        self.__exited = _Shard()
+        self.reset()
+
+
+    def reset(self):
+        """
+        Clear all the counters and histograms
+        """
+        with self.__lock:
+            self.started = time.time()
+            for shard in self.__shards + [self.__exited]:
+                with shard.lock:
+                    shard.clear()
+
+
+    def __shard(self):
+        shard = getattr(self.__local, 'shard', None)
+        if shard is None:
+            shard = _Shard(threading.current_thread())
+            self.__local.shard = shard
+            with self.__lock:
+                self.__shards.append(shard)
+        return shard
+
+
+    def __collect(self):
+        """
+        Merge the accumulators of the threads that have exited, returning
+        all the accumulators. Called with the lock held
+        """
+        live = []
+        for shard in self.__shards:
+            if shard.thread.is_alive():
+                live.append(shard)
+                continue
+            with shard.lock:
+                self.__exited.absorb(shard)
+        self.__shards = live
+        return live + [self.__exited]
+
+
+    def count(self, pvname, name, n=1):
+        """
+        Add n to a counter
+        """
+        shard = self.__shard()
+        with shard.lock:
+            shard.entry(pvname).count(name, n)
+
+
+    def record(self, pvname, op, seconds):
+        """
+        Add a latency sample for an operation, and count the operation
+        """
+        shard = self.__shard()
+        with shard.lock:
+            entry = shard.entry(pvname)
+            entry.count(op, 1)
+            entry.record(op, seconds)
+
+
+    def forget(self, pvname):
+        """
+        Drop the metrics of a PV. They still count in the global totals
+        """
+        with self.__lock:
+            for shard in self.__collect():
+                with shard.lock:
+                    entry = shard.pvs.pop(pvname, None)
+                    if entry is not None:
+                        shard.retired.merge(entry)
+
+
+    def snapshot(self, per_pv=True):
+        """
+        Return the metrics as a dictionary
+
+        Parameters
+        ----------
+        per_pv : bool, optional
+            Include the metrics of every PV, and not only the totals
+
+        Returns
+        -------
+        snapshot : dict
+            A dictionary with the keys : time, elapsed, the seconds since the
+            last reset, global and, if per_pv, pvs, a dictionary of PV name /
+            metric pairings. The metrics of the totals and of each PV have
+            the keys counters, rates, the counters divided by elapsed, and
+            latency, a dictionary of operation / :meth:`.Histogram.snapshot`
+            pairings
+        """
+        now = time.time()
+        total = _Entry()
+        pvs = {}
+        with self.__lock:
+            elapsed = now - self.started
+            for shard in self.__collect():
+                with shard.lock:
+                    total.merge(shard.retired)
+                    for (name, entry) in shard.pvs.items():
+                        total.merge(entry)
+                        if per_pv:
+                            pvs.setdefault(name, _Entry()).merge(entry)
+        snap = {'time'    : now,
+                'elapsed' : elapsed,
+                'global'  : total.snapshot(elapsed)}
+        if per_pv:
+            snap['pvs'] = dict((name, entry.snapshot(elapsed))
+                               for (name, entry) in pvs.items())
+        return snap
+
+
+registry = Registry()
+
+
+def enable(reset=True):
+    """
+    Start collecting metrics
+
+    Parameters
+    ----------
+    reset : bool, optional
+        Clear the metrics collected previously
+    """
+    global enabled
+    if reset:
+        registry.reset()
+    enabled = True
+
+
+def disable():
+    """
+    Stop collecting metrics. The metrics collected so far are kept
+    """
+    global enabled
+    enabled = False
+
+
+def count(pvname, name, n=1):
+    """
+    Add n to a counter of a PV, if metrics are enabled
+    """
+    if enabled:
+        registry.count(pvname, name, n)
+
+
+def record(pvname, op, seconds):
+    """
+    Add a latency sample in seconds for an operation on a PV, if metrics are
+    enabled
+    """
+    if enabled:
+        registry.record(pvname, op, seconds)
+
+
+def forget(pvname):
+    """
+    Drop the metrics of a PV, e.g. once it is evicted from the cache. They
+    still count in the global totals
+    """
+    registry.forget(pvname)
+
+
+def snapshot(per_pv=True):
+    """
+    Return the collected metrics as a dictionary, see
+    :meth:`.Registry.snapshot`
+    """
+    return registry.snapshot(per_pv)
+
+
+class _Dump(object):
+    """
+    A periodic call of a function with a metrics snapshot
+    """
+    def __init__(self, interval, fn, per_pv):
+        self.interval = interval
+        self.fn = fn
+        self.per_pv = per_pv
+        self.stopped = False
+        self.handle = utils.scheduler.schedule(interval, self.run)
+
+    def run(self):
+        if self.stopped:
+            return
+        self.handle = utils.scheduler.schedule(self.interval, self.run)
+        self.fn(snapshot(self.per_pv))
+
+    def cancel(self):
+        self.stopped = True
+        utils.scheduler.cancel(self.handle)
+
+
+_dump = None
+
+
+def _write_json(stream):
+    def write(snap):
+        stream.write(json.dumps(snap, sort_keys=True) + '\n')
+        stream.flush()
+    return write
+
+
+def start_dump(interval=60.0, callback=None, stream=sys.stderr,
+               per_pv=False):
+    """
+    Periodically dump a metrics snapshot, replacing any previous dump
+
+    Parameters
+    ----------
+    interval : float, optional
+        Seconds between dumps
+
+    callback : callable, optional
+        Called with each snapshot dictionary on the scheduler thread. By
+        default the snapshot is written to the stream as one line of JSON
+
+    stream : file, optional
+        Stream written to when no callback is given
+
+    per_pv : bool, optional
+        Include the metrics of every PV
+    """
+    global _dump
+    stop_dump()
+    if callback is None:
+        callback = _write_json(stream)
+    _dump = _Dump(interval, callback, per_pv)
+
+
+def stop_dump():
+    """
+    Stop the periodic dump
+    """
+    global _dump
+    if _dump is not None:
+        _dump.cancel()
+        _dump = None
@@ -45,3 +45,27 @@ class Options(object):
       if option not in self.opts:
         raise RuntimeError, 'mandatory option \'--%s\' not found' %(option)
 
+
+def read_pvnames(pvnames=None, filename=None):
+  """
+  Gather PV names from a whitespace separated string and from a file with
+  one or more names per line, where a filename of '-' reads stdin. Blank
+  lines and lines starting with '#' are skipped. The input order is kept.
+  """
+  names = []
+  if pvnames is not None:
+    names.extend(pvnames.split())
+  if filename is not None:
+    if filename == '-':
+      lines = sys.stdin.readlines()
+    else:
+      f = open(filename)
+      try:
+        lines = f.readlines()
+      finally:
+        f.close()
+    for line in lines:
+      line = line.strip()
+      if line and not line.startswith('#'):
+        names.extend(line.split())
+  return names
@@ -0,0 +1,186 @@
+import sys
+import csv
+import json
+import time
+import threading
+import collections
+
+from backend import pyca
+
+FORMATS = ['text', 'json', 'csv']
+
+def _plain(value):
+  if hasattr(value, 'tolist'):
+    return value.tolist()
+  if isinstance(value, tuple):
+    return list(value)
+  return value
+
+def _default(value):
+  if hasattr(value, 'tolist'):
+    return value.tolist()
+  return str(value)
+
+def _cell(value):
+  value = _plain(value)
+  if isinstance(value, list):
+    return ' '.join([str(v) for v in value])
+  if value is None:
+    return ''
+  return value
+
+class RecordWriter(object):
+  """
+  Write one record per line as JSON or CSV for the command line tools.
+  Records are dictionaries, CSV columns follow the order of fields and the
+  header is written before the first record.
+  """
+  def __init__(self, format, fields, stream=sys.stdout):
+    if format not in FORMATS[1:]:
+      raise ValueError('unknown output format \'%s\'' %(format))
+    self.format = format
+    self.fields = fields
+    self.stream = stream
+    self.__csv = None
+
+  def write(self, record):
+    if self.format == 'json':
+      self.stream.write(json.dumps(record, default=_default) + '\n')
+    else:
+      if self.__csv is None:
+        self.__csv = csv.writer(self.stream)
+        self.__csv.writerow(self.fields)
+      self.__csv.writerow([_cell(record.get(f)) for f in self.fields])
+
+  def flush(self):
+    self.stream.flush()
+
+
+def format_value(value, maxlen=None, hex=False):
+  """
+  Format a monitored value like camonitor, keeping the first 10 elements of
+  waveforms longer than maxlen
+  """
+  try:
+    if (maxlen is not None) and (len(value) > int(maxlen)):
+      value = value[0:10]
+  except:
+    pass
+  if hex:
+    try:
+      value = ["0x%x" % v for v in value]
+    except:
+      value = "0x%x" % value  # must be a scalar!
+  return value
+
+class EventWriter(object):
+  """
+  Write monitor events from a background thread. Events are queued by put,
+  which never blocks the Channel Access thread, and written in batches with
+  one buffered write. When more than maxsize events are waiting, new ones
+  are dropped and a line reporting how many is written at most once every
+  report seconds. The format is 'text', the same lines as the unbuffered
+  camonitor output, or 'json', one object per line. Events are (name, secs,
+  nsec, severity, status, value, error) tuples, with secs relative to the
+  EPICS epoch as in Pv.secs.
+  """
+  def __init__(self, format='text', stream=sys.stdout, maxsize=100000,
+               report=1.0, maxlen=None, hex=False):
+    if format not in FORMATS[:2]:
+      raise ValueError('unknown output format \'%s\'' %(format))
+    self.format = format
+    self.stream = stream
+    self.maxsize = maxsize
+    self.report = report
+    self.maxlen = maxlen
+    self.hex = hex
+    self.written = 0
+    self.dropped = 0
+    self.__reported = 0
+    self.__cond = threading.Condition(threading.Lock())
+    self.__events = collections.deque()
+    self.__running = True
+    self.__thread = threading.Thread(target=self.__run,
+                                     name='camonitor-writer')
+    self.__thread.daemon = True
+    self.__thread.start()
+
+  def put(self, event):
+    self.__cond.acquire()
+    try:
+      if len(self.__events) >= self.maxsize:
+        self.dropped += 1
+        return
+      self.__events.append(event)
+      if len(self.__events) == 1:
+        self.__cond.notify()
+    finally:
+      self.__cond.release()
+
+  def __run(self):
+    last_report = time.time()
+    while True:
+      self.__cond.acquire()
+      try:
+        if self.__running and not self.__events:
+          self.__cond.wait(self.report)
+        events, self.__events = self.__events, collections.deque()
+        running = self.__running
+      finally:
+        self.__cond.release()
+      lines = [self.__format(event) for event in events]
+      now = time.time()
+      if not running or now - last_report >= self.report:
+        last_report = now
+        lines.extend(self.__drop_report())
+      if lines:
+        try:
+          self.stream.write(''.join(lines))
+          self.stream.flush()
+        except IOError:
+          # The reader has gone away, e.g. camonitor | head
+          self.__running = False
+          return
+        self.written += len(events)
+      if not running:
+        return
+
+  def __drop_report(self):
+    count = self.dropped - self.__reported
+    if count == 0:
+      return []
+    self.__reported += count
+    if self.format == 'json':
+      return [json.dumps({'dropped' : count}) + '\n']
+    return ['%d events dropped\n' %(count)]
+
+  def __format(self, event):
+    (name, secs, nsec, severity, status, value, error) = event
+    if self.format == 'json':
+      rec = {'name' : name, 'error' : None if error is None else str(error)}
+      if error is None:
+        rec['value'] = _plain(value)
+        rec['secs'] = secs + pyca.epoch
+        rec['nsec'] = nsec
+        rec['severity'] = pyca.severity[severity]
+        rec['status'] = pyca.alarm[status]
+      return json.dumps(rec, default=_default) + '\n'
+    if error is not None:
+      return '%-30s  %s\n' %(name, error)
+    if status != pyca.NO_ALARM:
+      return '%-30s %s %s\n' %(name, pyca.severity[severity],
+                                pyca.alarm[status])
+    value = format_value(value, self.maxlen, self.hex)
+    return '%-30s %08x.%08x %s\n' %(name, secs, nsec, value)
+
+  def stop(self):
+    """
+    Write the queued events and stop the thread
+    """
+    self.__cond.acquire()
+    try:
+      self.__running = False
+      self.__cond.notify()
+    finally:
+      self.__cond.release()
+    self.__thread.join()
@@ -0,0 +1,291 @@
+from __future__ import print_function
+import time
+import threading
+import traceback
+
+"""
+   Profiling of monitor and connection callbacks
+"""
+
+logprint = print
+
+enabled = False
+hooks = []
+
+
+def callback_name(cb):
+    """
+    Return a readable name for a callback, looking through the wrappers
+    added by :meth:`.Pv.add_monitor_callback`
+    """
+    while hasattr(cb, 'fn'):
+        cb = cb.fn
+    name = getattr(cb, '__name__', None) or repr(cb)
+    owner = getattr(cb, '__self__', None)
+    if owner is not None:
+        name = '%s.%s' % (type(owner).__name__, name)
+    module = getattr(cb, '__module__', None)
+    if module:
+        name = '%s.%s' % (module, name)
+    return name
+
+
+class _CallbackStats(object):
+    """
+    Run times of one callback of one PV
+    """
+    def __init__(self, pvname, kind, cbid, name):
+        self.pvname = pvname
+        self.kind = kind
+        self.cbid = cbid
+        self.name = name
+        self.calls = 0
+        self.total = 0.0
+        self.max   = 0.0
+        self.slow  = 0
+        self.unwarned = 0
+        self.last_warning = None
+
+
+    def snapshot(self):
+        return {'pv'       : self.pvname,
+                'kind'     : self.kind,
+                'id'       : self.cbid,
+                'callback' : self.name,
+                'calls'    : self.calls,
+                'total'    : self.total,
+                'mean'     : self.total / self.calls if self.calls else None,
+                'max'      : self.max,
+                'slow'     : self.slow}
+
+
+class CallbackProfiler(object):
+    """
+    Cumulative and maximum run time of every callback
+
+    Callbacks are identified by PV name, kind, ``'monitor'`` or
+    ``'connection'``, and callback ID. The run times of deleted callbacks are
+    summed in one entry per PV and kind, with the ID None. A call taking longer than threshold
+    seconds is counted as slow and reported through :data:`logprint`, at
+    most once every warn_interval seconds per callback, with the number of
+    slow calls since the last report.
+
+    Parameters
+    ----------
+    threshold : float or None, optional
+        Run time in seconds above which a call is slow. None disables the
+        warnings
+
+    warn_interval : float, optional
+        Minimum time in seconds between two warnings for the same callback
+    """
+    def __init__(self, threshold=0.05, warn_interval=10.0):
+        self.threshold = threshold
+        self.warn_interval = warn_interval
+        self.__lock = threading.Lock()
+        self.__stats = {}
+
+
+    def reset(self):
+        """
+        Forget the recorded run times
+        """
+        with self.__lock:
+            self.__stats = {}
+
+
+    def record(self, pvname, kind, cbid, cb, seconds):
+        """
+        Add the run time in seconds of one call
+        """
+        key = (pvname, kind, cbid)
+        warning = None
+        with self.__lock:
+            entry = self.__stats.get(key)
+            if entry is None:
+                entry = self.__stats[key] = _CallbackStats(pvname, kind, cbid,
+                                                           callback_name(cb))
+            entry.calls += 1
+            entry.total += seconds
+            if seconds > entry.max:
+                entry.max = seconds
+            if self.threshold is not None and seconds > self.threshold:
+                entry.slow += 1
+                entry.unwarned += 1
+                now = time.time()
+                if (entry.last_warning is None
+                        or now - entry.last_warning >= self.warn_interval):
+                    warning = ("slow %s callback %s (%s) for PV %s took "
+                               "%.3f s, %d slow calls since the last warning"
+                               % (kind, cbid, entry.name, pvname, seconds,
+                                  entry.unwarned))
+                    entry.last_warning = now
+                    entry.unwarned = 0
+        if warning is not None:
+            logprint(warning)
+
+
+    def forget(self, pvname, kind, cbid):
+        """
+        Fold the run times of a deleted callback into the entry of the
+        deleted callbacks of its PV and kind
+        """
+        with self.__lock:
+            entry = self.__stats.pop((pvname, kind, cbid), None)
+            if entry is None:
+                return
+            key = (pvname, kind, None)
+            deleted = self.__stats.get(key)
+            if deleted is None:
+                deleted = self.__stats[key] = _CallbackStats(
+                    pvname, kind, None, '<deleted callbacks>')
+            deleted.calls += entry.calls
+            deleted.total += entry.total
+            deleted.slow  += entry.slow
+            deleted.max = max(deleted.max, entry.max)
+
+
+    def stats(self):
+        """
+        Return the run times of every callback, the slowest in total first
+
+        Returns
+        -------
+        stats : list of dict
+            One dictionary per callback with the keys : pv, kind, id,
+            callback, the name of the function, calls, total, mean, max and
+            slow, the number of calls over the threshold
+        """
+        with self.__lock:
+            entries = [entry.snapshot() for entry in self.__stats.values()]
+        entries.sort(key=lambda entry: entry['total'], reverse=True)
+        return entries
+
+
+    def by_pv(self):
+        """
+        Return the run times of the callbacks summed per PV
+
+        Returns
+        -------
+        stats : dict
+            PV name / dictionary pairings, with the keys calls, total, max
+            and slow
+        """
+        totals = {}
+        for entry in self.stats():
+            pv = totals.setdefault(entry['pv'], {'calls' : 0, 'total' : 0.0,
+                                                 'max' : 0.0, 'slow' : 0})
+            pv['calls'] += entry['calls']
+            pv['total'] += entry['total']
+            pv['slow']  += entry['slow']
+            pv['max'] = max(pv['max'], entry['max'])
+        return totals
+
+
+profiler = CallbackProfiler()
+
+
+def enable(threshold=0.05, warn_interval=10.0, reset=True):
+    """
+    Start profiling the callbacks of every PV
+
+    Parameters
+    ----------
+    threshold : float or None, optional
+        Run time in seconds above which a call is reported as slow. None
+        disables the warnings
+
+    warn_interval : float, optional
+        Minimum time in seconds between two warnings for the same callback
+
+    reset : bool, optional
+        Forget the run times recorded previously
+    """
+    global enabled
+    profiler.threshold = threshold
+    profiler.warn_interval = warn_interval
+    if reset:
+        profiler.reset()
+    enabled = True
+
+
+def disable():
+    """
+    Stop profiling. The recorded run times are kept
+    """
+    global enabled
+    enabled = False
+
+
+def add_hook(hook):
+    """
+    Add a function called around every profiled callback
+
+    The hook is called as ``hook(pvname, kind, cbid, callback)`` before the
+    callback runs, kind being ``'monitor'`` or ``'connection'``. If it
+    returns a callable, that is called with the run time in seconds once the
+    callback returns, even if it raised. This lets external profilers start
+    and stop around each callback. Exceptions raised by hooks are printed
+    and otherwise ignored.
+    """
+    hooks.append(hook)
+
+
+def remove_hook(hook):
+    """
+    Remove a hook added with :func:`.add_hook`
+    """
+    hooks.remove(hook)
+
+
+def stats():
+    """
+    Return the run times of every callback, see
+    :meth:`.CallbackProfiler.stats`
+    """
+    return profiler.stats()
+
+
+def by_pv():
+    """
+    Return the run times of the callbacks summed per PV, see
+    :meth:`.CallbackProfiler.by_pv`
+    """
+    return profiler.by_pv()
+
+
+def forget(pvname, kind, cbid):
+    """
+    Fold the run times of a deleted callback into those of the deleted
+    callbacks of its PV, see :meth:`.CallbackProfiler.forget`
+    """
+    profiler.forget(pvname, kind, cbid)
+
+
+def call(pvname, kind, cbid, cb, arg, finish=None):
+    """
+    Run a callback with its argument, recording its run time and running the
+    hooks. If given, finish is called with the run time in seconds, like the
+    functions returned by hooks. Exceptions raised by the callback propagate
+    """
+    finishers = [finish] if finish is not None else []
+    for hook in list(hooks):
+        try:
+            finish = hook(pvname, kind, cbid, cb)
+        except Exception:
+            traceback.print_exc()
+            continue
+        if finish is not None:
+            finishers.append(finish)
+    start = time.time()
+    try:
+        cb(arg)
+    finally:
+        seconds = time.time() - start
+        profiler.record(pvname, kind, cbid, cb, seconds)
+        for finish in finishers:
+            try:
+                finish(seconds)
+            except Exception:
+                traceback.print_exc()
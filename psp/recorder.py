@@ -0,0 +1,336 @@
+import os
+import re
+import json
+import threading
+import traceback
+import collections
+import numpy as np
+
+from . import Pv as _pvmod
+
+"""
+   Recording of PV monitor events to memory-mapped files
+"""
+
+STRING_DTYPE = 'S40'
+
+Column = collections.namedtuple('Column', ['values', 'timestamps', 'meta'])
+
+
+def _filename(pvname):
+    return re.sub(r'[^A-Za-z0-9_.:-]', '_', pvname)
+
+
+def _write_json(path, obj):
+    """
+    Replace a JSON file atomically, so a crash leaves the old or new content
+    """
+    tmp = path + '.tmp'
+    f = open(tmp, 'w')
+    try:
+        json.dump(obj, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+
+class _ColumnWriter(object):
+    """
+    The value and timestamp files of one PV
+    """
+    def __init__(self, directory, pvname, chunk):
+        base = os.path.join(directory, _filename(pvname))
+        self.pvname = pvname
+        self.chunk  = chunk
+        self.values_path = base + '.values'
+        self.times_path  = base + '.times'
+        self.meta_path   = base + '.json'
+        self.dtype = None
+        self.width = 0
+        self.count = 0
+        self.capacity = 0
+        self.values = None
+        self.times  = None
+
+    def __setup(self, value):
+        value = np.asarray(value)
+        dtype = value.dtype
+        if dtype.kind in 'SUO':
+            dtype = np.dtype(STRING_DTYPE)
+        self.dtype = dtype
+        self.width = value.size if value.ndim > 0 else 0
+        for path in (self.values_path, self.times_path):
+            open(path, 'wb').close()
+
+    def __shape(self, n):
+        return (n, self.width) if self.width else (n,)
+
+    def __map(self, path, dtype, shape):
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        f = open(path, 'r+b')
+        try:
+            f.truncate(size)
+        finally:
+            f.close()
+        return np.memmap(path, dtype=dtype, mode='r+', shape=shape)
+
+    def __grow(self):
+        """
+        Make room for one more chunk, after committing the records so far
+        """
+        self.sync()
+        self.capacity += self.chunk
+        self.values = self.__map(self.values_path, self.dtype,
+                                 self.__shape(self.capacity))
+        self.times = self.__map(self.times_path, np.int64,
+                                (self.capacity, 2))
+
+    def append(self, value, timestamp):
+        if self.dtype is None:
+            self.__setup(value)
+        if self.count == self.capacity:
+            self.__grow()
+        i = self.count
+        if self.width:
+            row = self.values[i]
+            value = np.asarray(value).ravel()
+            n = min(len(value), self.width)
+            row[:n] = value[:n]
+            row[n:] = 0
+        else:
+            self.values[i] = value
+        self.times[i] = timestamp
+        self.count += 1
+
+    def sync(self):
+        """
+        Flush the mapped files and record how many records they hold
+        """
+        if self.dtype is None:
+            return
+        if self.values is not None:
+            self.values.flush()
+            self.times.flush()
+        _write_json(self.meta_path, self.meta())
+
+    def meta(self):
+        return {'pv'         : self.pvname,
+                'count'      : self.count,
+                'dtype'      : self.dtype.str,
+                'width'      : self.width,
+                'chunk'      : self.chunk,
+                'values'     : os.path.basename(self.values_path),
+                'timestamps' : os.path.basename(self.times_path)}
+
+    def close(self):
+        self.sync()
+        self.values = self.times = None
+        if self.dtype is not None:
+            # Trim the unused part of the last chunk
+            for (path, itemsize) in ((self.values_path,
+                                      self.dtype.itemsize * max(self.width, 1)),
+                                     (self.times_path, 16)):
+                f = open(path, 'r+b')
+                try:
+                    f.truncate(self.count * itemsize)
+                finally:
+                    f.close()
+            self.capacity = self.count
+
+
+class Recorder(object):
+    """
+    Record the monitor events of many PVs to disk
+
+    The monitor callback only queues the value and timestamp of each event. A
+    background thread writes them into one pair of preallocated,
+    memory-mapped files per PV: ``<pv>.values`` holds the raw values, one row
+    per event for waveforms, and ``<pv>.times`` the timestamps as int64
+    (secs, nsec) pairs, as returned by :meth:`.Pv.timestamp`. The files grow
+    chunk events at a time. Each time a chunk is filled, the files are
+    flushed and the ``<pv>.json`` sidecar, which gives the type, width and
+    number of valid records, is rewritten atomically. If the process dies, at
+    most the last chunk of each PV is lost. Use :func:`.load` to read the
+    files back with ``np.memmap``.
+
+    Waveforms keep the length of the first event, longer ones are truncated
+    and shorter ones padded with zeros. Strings are stored as 40 byte
+    strings, the size of an EPICS string.
+
+    Parameters
+    ----------
+    directory : str
+        Directory for the files, created if needed
+
+    pvs : list of :class:`.Pv` or str
+        The PVs, or PV names looked up with :func:`.add_pv_to_cache`
+
+    chunk : int, optional
+        Number of events by which the files grow
+
+    maxsize : int, optional
+        Maximum number of events waiting for the writer. Further events are
+        dropped and counted
+
+    Attributes
+    ----------
+    recorded : int
+        Number of events written
+
+    dropped : int
+        Number of events dropped because the writer fell behind
+    """
+    def __init__(self, directory, pvs, chunk=1024, maxsize=100000):
+        self.directory = directory
+        self.pvs = [pv if isinstance(pv, _pvmod.Pv)
+                    else _pvmod.add_pv_to_cache(pv) for pv in pvs]
+        self.chunk   = chunk
+        self.maxsize = maxsize
+        self.recorded = 0
+        self.dropped  = 0
+        self.__cond = threading.Condition(threading.Lock())
+        self.__queue = collections.deque()
+        self.__columns = {}
+        self.__cb_ids = {}
+        self.__thread = None
+        self.__running = False
+
+
+    def start(self):
+        """
+        Start the writer thread and subscribe to the PVs
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        for pv in self.pvs:
+            if pv.name not in self.__columns:
+                self.__columns[pv.name] = _ColumnWriter(self.directory,
+                                                        pv.name, self.chunk)
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run,
+                                         name='psp-recorder')
+        self.__thread.daemon = True
+        self.__thread.start()
+        for pv in self.pvs:
+            self.__cb_ids[pv.name] = pv.add_monitor_callback(
+                lambda e, pv=pv: self.__on_event(pv, e))
+            if not pv.ismonitored:
+                pv.monitor_start()
+
+
+    def stop(self):
+        """
+        Unsubscribe, write the queued events and close the files
+        """
+        for pv in self.pvs:
+            cb_id = self.__cb_ids.pop(pv.name, None)
+            if cb_id is not None:
+                pv.del_monitor_callback(cb_id)
+        with self.__cond:
+            self.__running = False
+            self.__cond.notify()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        for column in self.__columns.values():
+            column.close()
+
+
+    def __on_event(self, pv, e=None):
+        if e is not None:
+            return
+        value = pv.value
+        if isinstance(value, np.ndarray) and not value.flags.writeable:
+            # A view of reused storage, see Pv.set_value_buffers
+            value = value.copy()
+        with self.__cond:
+            if len(self.__queue) >= self.maxsize:
+                self.dropped += 1
+                return
+            self.__queue.append((pv.name, value, pv.timestamp()))
+            self.__cond.notify()
+
+
+    def __run(self):
+        while True:
+            with self.__cond:
+                while self.__running and not self.__queue:
+                    self.__cond.wait()
+                if not self.__queue:
+                    return
+                events, self.__queue = self.__queue, collections.deque()
+            for (name, value, timestamp) in events:
+                try:
+                    self.__columns[name].append(value, timestamp)
+                    self.recorded += 1
+                except Exception:
+                    traceback.print_exc()
+
+
+    def stats(self):
+        """
+        Return the recorder counters as a dictionary
+
+        Returns
+        -------
+        stats : dict
+            A dictionary with the keys : recorded, dropped, queued and
+            counts, the number of records per PV
+        """
+        return {'recorded' : self.recorded,
+                'dropped'  : self.dropped,
+                'queued'   : len(self.__queue),
+                'counts'   : dict((name, column.count) for (name, column)
+                                  in self.__columns.items())}
+
+
+def load(directory, pvname=None):
+    """
+    Open recorded PVs with ``np.memmap``
+
+    Only the records committed to the sidecar files are included.
+
+    Parameters
+    ----------
+    directory : str
+        Directory given to the :class:`.Recorder`
+
+    pvname : str, optional
+        Load a single PV. By default every PV in the directory is loaded
+
+    Returns
+    -------
+    columns : :class:`.Column` or dict
+        The values, timestamps and metadata of the PV, or a dictionary of PV
+        name / Column pairings
+    """
+    if pvname is not None:
+        paths = [os.path.join(directory, _filename(pvname) + '.json')]
+    else:
+        paths = [os.path.join(directory, name)
+                 for name in sorted(os.listdir(directory))
+                 if name.endswith('.json')]
+    columns = {}
+    for path in paths:
+        f = open(path)
+        try:
+            meta = json.load(f)
+        finally:
+            f.close()
+        count = meta['count']
+        shape = (count, meta['width']) if meta['width'] else (count,)
+        if count:
+            values = np.memmap(os.path.join(directory, meta['values']),
+                               dtype=np.dtype(str(meta['dtype'])), mode='r',
+                               shape=shape)
+            times = np.memmap(os.path.join(directory, meta['timestamps']),
+                              dtype=np.int64, mode='r', shape=(count, 2))
+        else:
+            values = np.zeros(shape, dtype=np.dtype(str(meta['dtype'])))
+            times = np.zeros((0, 2), dtype=np.int64)
+        columns[meta['pv']] = Column(values, times, meta)
+    if pvname is not None:
+        return columns[meta['pv']]
+    return columns
@@ -0,0 +1,460 @@
+import os
+import time
+import errno
+import ctypes
+import traceback
+import collections
+import multiprocessing
+import numpy as np
+
+from .backend import pyca
+from . import Pv as _pvmod
+from . import utils
+
+"""
+   Monitoring of large PV sets from several processes
+"""
+
+# Per-PV header, one int64 each
+FIELDS = ('seq', 'updates', 'secs', 'nsec', 'severity', 'status', 'length',
+          'connected')
+(SEQ, UPDATES, SECS, NSEC, SEVERITY, STATUS, LENGTH, CONNECTED) = \
+    range(len(FIELDS))
+
+Entry = collections.namedtuple('Entry', ['value', 'secs', 'nsec', 'severity',
+                                         'status', 'connected', 'updates'])
+
+
+def table_size(n, width=1):
+    """
+    Return the size in bytes of a :class:`.SharedTable`
+    """
+    return n * (len(FIELDS) * 8 + width * 8)
+
+
+class SharedTable(object):
+    """
+    Latest value, timestamp and alarm state of n PVs in shared memory
+
+    Each PV has a fixed slot: a header of int64 fields, see :data:`FIELDS`,
+    and width float64 values. Slots are written by a single process and read
+    by any number of others without locks. The writer makes the sequence
+    number odd while it updates a slot and even again once done, and a
+    reader copies the slot and retries if the sequence number was odd or has
+    changed meanwhile. A writer that dies during an update leaves the
+    sequence number odd, until :meth:`.release` is called for the slot.
+
+    Values are stored as float64, so ENUM PVs hold their index and string PVs
+    are stored as NaN. Waveforms longer than width are truncated.
+
+    Parameters
+    ----------
+    n : int
+        Number of PVs
+
+    width : int, optional
+        Maximum number of elements per value
+
+    buffer : buffer, optional
+        Writable memory of at least :func:`.table_size` bytes. By default a
+        ``multiprocessing.RawArray`` is allocated, which is shared with the
+        processes forked afterwards
+
+    Attributes
+    ----------
+    buffer : buffer
+        The shared memory
+    """
+    def __init__(self, n, width=1, buffer=None):
+        self.n = int(n)
+        self.width = int(width)
+        size = table_size(self.n, self.width)
+        if buffer is None:
+            buffer = multiprocessing.RawArray(ctypes.c_char, max(size, 1))
+        self.buffer = buffer
+        raw = np.frombuffer(buffer, dtype=np.uint8, count=size)
+        split = self.n * len(FIELDS) * 8
+        self.header = raw[:split].view(np.int64).reshape(self.n, len(FIELDS))
+        self.values = raw[split:].view(np.float64).reshape(self.n, self.width)
+
+
+    def write(self, i, value, secs, nsec, severity, status):
+        """
+        Store an update of the PV in slot i
+
+        Parameters
+        ----------
+        value : float, int or array
+            The PV value
+
+        secs : int
+            Seconds of the timestamp, since the UNIX epoch
+
+        nsec : int
+            Nanoseconds of the timestamp
+        """
+        header = self.header[i]
+        row = self.values[i]
+        header[SEQ] += 1
+        try:
+            if isinstance(value, (np.ndarray, list, tuple)):
+                value = np.asarray(value).ravel()
+                n = min(len(value), self.width)
+                try:
+                    row[:n] = value[:n]
+                except (TypeError, ValueError):
+                    row[:n] = np.nan
+            else:
+                # A length of 0 marks a scalar
+                n = 0
+                try:
+                    row[0] = value
+                except (TypeError, ValueError):
+                    row[0] = np.nan
+            header[LENGTH]   = n
+            header[SECS]     = secs
+            header[NSEC]     = nsec
+            header[SEVERITY] = severity
+            header[STATUS]   = status
+            header[UPDATES] += 1
+        finally:
+            header[SEQ] += 1
+
+
+    def set_connected(self, i, connected):
+        """
+        Record the connection state of the PV in slot i
+        """
+        header = self.header[i]
+        header[SEQ] += 1
+        header[CONNECTED] = 1 if connected else 0
+        header[SEQ] += 1
+
+
+    def release(self, i):
+        """
+        Make the sequence number of slot i even again, after its writer died
+        during an update. No process may be writing the slot
+        """
+        header = self.header[i]
+        header[SEQ] += header[SEQ] & 1
+
+
+    def read(self, i, timeout=1.0, writer_alive=None):
+        """
+        Return a consistent copy of slot i
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum time in seconds to retry while the slot is being written
+
+        writer_alive : callable, optional
+            Called without arguments while the slot is being written, returns
+            whether the writing process is still running
+
+        Returns
+        -------
+        entry : :class:`.Entry`
+            The value is a float for scalar PVs and an array for waveforms,
+            unless the table is one element wide. It is None if the PV was
+            never updated
+
+        Raises
+        ------
+        pyca.pyexc
+            If the slot is still being written after timeout seconds, or its
+            writer has died during an update
+        """
+        header = self.header[i]
+        row = self.values[i]
+        deadline = None
+        while True:
+            seq = header[SEQ]
+            if not seq & 1:
+                fields = header.copy()
+                if self.width == 1 or not fields[LENGTH]:
+                    value = float(row[0])
+                else:
+                    value = row[:fields[LENGTH]].copy()
+                if header[SEQ] == seq:
+                    break
+            elif writer_alive is not None and not writer_alive():
+                raise pyca.pyexc("the writer of slot %d died during an update"
+                                 % i)
+            if deadline is None:
+                deadline = time.time() + timeout
+            elif time.time() > deadline:
+                raise pyca.pyexc("slot %d still being written after %g s"
+                                 % (i, timeout))
+            time.sleep(0)
+        if not fields[UPDATES]:
+            value = None
+        return Entry(value, int(fields[SECS]), int(fields[NSEC]),
+                     int(fields[SEVERITY]), int(fields[STATUS]),
+                     bool(fields[CONNECTED]), int(fields[UPDATES]))
+
+
+def _publish(table, i, pv):
+    """
+    Write the updates and connection changes of a PV into slot i of a table,
+    subscribing to the PV once it connects
+
+    Returns
+    -------
+    ids : tuple
+        The IDs of the connection and monitor callbacks
+    """
+    def on_connection(isconnected):
+        table.set_connected(i, isconnected)
+        if isconnected and not pv.ismonitored:
+            pv.monitor()
+            pyca.flush_io()
+    def on_monitor(e=None):
+        if e is None:
+            table.write(i, pv.value, pv.secs + pyca.epoch, pv.nsec,
+                        pv.severity, pv.status)
+    con_id = pv.add_connection_callback(on_connection)
+    mon_id = pv.add_monitor_callback(on_monitor)
+    if pv.isconnected:
+        on_connection(True)
+        if 'value' in pv.data:
+            on_monitor()
+    return (con_id, mon_id)
+
+
+def _run_worker(buffer, n, width, slots, stop, setup):
+    """
+    Body of a worker process: monitor the PVs of its slots and write their
+    updates into the table until the stop flag is set or the launcher exits
+    """
+    if setup is not None:
+        setup()
+    utils.ensure_context()
+    table = SharedTable(n, width, buffer)
+    pvs = []
+    for (i, name) in slots:
+        # The PV cache may have been inherited from the parent
+        pv = _pvmod.Pv(name)
+        _publish(table, i, pv)
+        pvs.append(pv)
+    for pv in pvs:
+        pv.create_channel()
+    pyca.flush_io()
+    # A lock-free flag, as a killed worker could leave the lock of a
+    # multiprocessing.Event held
+    parent = os.getppid()
+    while not stop.value and os.getppid() == parent:
+        time.sleep(0.2)
+
+
+def _fork_worker(table, slots, stop, setup):
+    """
+    Fork a worker for the given slots, returning its PID
+    """
+    for (i, name) in slots:
+        # The previous worker may have died in the middle of a write
+        table.release(i)
+        table.set_connected(i, False)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            _run_worker(table.buffer, table.n, table.width, slots, stop, setup)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            os._exit(0)
+    return pid
+
+
+def _run_launcher(buffer, n, width, shards, stop, setup, restart, interval,
+                  pids, restarts):
+    """
+    Body of the launcher process: fork the workers and restart those that
+    exit, until the stop flag is set or the parent exits
+
+    The launcher is single threaded and never uses Channel Access, so it is
+    always safe for it to fork.
+    """
+    table = SharedTable(n, width, buffer)
+    parent = os.getppid()
+    for (k, slots) in enumerate(shards):
+        pids[k] = _fork_worker(table, slots, stop, setup)
+    checked = time.time()
+    while not stop.value and os.getppid() == parent:
+        time.sleep(min(interval, 0.2))
+        if time.time() - checked < interval:
+            continue
+        checked = time.time()
+        for (k, slots) in enumerate(shards):
+            if not pids[k] or not os.waitpid(pids[k], os.WNOHANG)[0]:
+                continue
+            pids[k] = 0
+            if restart and not stop.value:
+                try:
+                    pids[k] = _fork_worker(table, slots, stop, setup)
+                    restarts[k] += 1
+                except OSError:
+                    traceback.print_exc()
+    # The workers also stop once they see the flag
+    stop.value = 1
+    for k in range(len(shards)):
+        if pids[k]:
+            os.waitpid(pids[k], 0)
+            pids[k] = 0
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    # A dead worker stays a zombie until the launcher reaps it
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            return f.read().rsplit(')', 1)[-1].split()[0] != 'Z'
+    except (IOError, IndexError):
+        return True
+
+
+class ShardedMonitor(object):
+    """
+    Monitor many PVs from several worker processes
+
+    The PV names are split across the workers, each of which has its own
+    Channel Access context and runs the monitor callbacks of its PVs on its
+    own interpreter. Workers write each update into a :class:`.SharedTable`
+    that this process reads directly, without any message per update.
+
+    :meth:`.start` forks a launcher process, which forks the workers and
+    restarts those that die. Workers are therefore never forked from a
+    thread of this process, which may hold a Channel Access context by
+    then. Call :meth:`.start` before connecting to any PV in this process.
+
+    Parameters
+    ----------
+    pvnames : list of str
+        Names of the PVs
+
+    workers : int, optional
+        Number of worker processes
+
+    width : int, optional
+        Maximum number of elements per value, see :class:`.SharedTable`
+
+    restart : bool, optional
+        Restart the workers that exit
+
+    interval : float, optional
+        Time in seconds between two checks of the workers
+
+    setup : callable, optional
+        Called without arguments at the start of each worker process
+    """
+    def __init__(self, pvnames, workers=2, width=1, restart=True,
+                 interval=1.0, setup=None):
+        self.names = []
+        for name in pvnames:
+            if name not in self.names:
+                self.names.append(name)
+        self.index = dict((name, i) for (i, name) in enumerate(self.names))
+        self.workers = max(1, min(int(workers), len(self.names)))
+        self.width = width
+        self.restart = restart
+        self.interval = interval
+        self.setup = setup
+        self.table = SharedTable(len(self.names), width)
+        self.shards = [[(i, self.names[i])
+                        for i in range(k, len(self.names), self.workers)]
+                       for k in range(self.workers)]
+        self.__stop = multiprocessing.RawValue(ctypes.c_int, 0)
+        self.__pids = multiprocessing.RawArray(ctypes.c_long, self.workers)
+        self.__restarts = multiprocessing.RawArray(ctypes.c_int, self.workers)
+        self.__launcher = None
+
+
+    @property
+    def restarts(self):
+        """
+        Number of times each worker was restarted
+        """
+        return list(self.__restarts)
+
+
+    def start(self):
+        """
+        Start the launcher process, which starts the workers
+        """
+        if self.__launcher is not None and self.__launcher.is_alive():
+            return
+        self.__stop.value = 0
+        self.__launcher = multiprocessing.Process(
+            target=_run_launcher, name='psp-shard-launcher',
+            args=(self.table.buffer, self.table.n, self.width, self.shards,
+                  self.__stop, self.setup, self.restart, self.interval,
+                  self.__pids, self.__restarts))
+        self.__launcher.daemon = True
+        self.__launcher.start()
+
+
+    def stop(self, timeout=5.0):
+        """
+        Stop the launcher and the workers, terminating the launcher if they
+        do not exit within timeout seconds. The workers then exit on their
+        own, as they watch their parent
+        """
+        self.__stop.value = 1
+        if self.__launcher is None:
+            return
+        self.__launcher.join(timeout)
+        if self.__launcher.is_alive():
+            self.__launcher.terminate()
+            self.__launcher.join()
+        self.__launcher = None
+
+
+    def alive(self):
+        """
+        Return whether each worker process is running
+        """
+        return [self.__worker_alive(k) for k in range(self.workers)]
+
+
+    def __worker_alive(self, k):
+        pid = self.__pids[k]
+        return (self.__launcher is not None and self.__launcher.is_alive()
+                and pid != 0 and _pid_alive(pid))
+
+
+    def read(self, pvname, timeout=1.0):
+        """
+        Return the latest update of a PV as an :class:`.Entry`
+
+        Raises
+        ------
+        pyca.pyexc
+            If the worker of the PV died while writing it and has not been
+            restarted yet, or the slot stays busy for timeout seconds
+        """
+        i = self.index[pvname]
+        return self.table.read(i, timeout,
+                               lambda: self.__worker_alive(i % self.workers))
+
+
+    def value(self, pvname):
+        """
+        Return the latest value of a PV, or None before its first update
+        """
+        return self.read(pvname).value
+
+
+    def snapshot(self):
+        """
+        Return the latest update of every PV
+
+        Returns
+        -------
+        entries : dict
+            PV name / :class:`.Entry` pairings
+        """
+        return dict((name, self.read(name)) for name in self.names)
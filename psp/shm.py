@@ -0,0 +1,283 @@
+import os
+import mmap
+import errno
+import struct
+import tempfile
+import numpy as np
+
+from . import Pv as _pvmod
+from .shard import SharedTable, table_size, _publish
+
+"""
+   Latest PV values shared with other local processes through a file in
+   /dev/shm
+"""
+
+MAGIC = b'PSPSHM01'
+
+# Magic, number of PVs, width, publisher PID
+HEADER = struct.Struct('<8sqqq')
+
+NAME_SIZE = 64
+
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+def segment_path(segment):
+    """
+    Return the path of a segment, a name in :data:`SHM_DIR` unless it is a
+    path already
+    """
+    if os.sep in segment:
+        return segment
+    return os.path.join(SHM_DIR, segment)
+
+
+def _layout(n, width):
+    """
+    Return the offset of the table and the total size of a segment
+    """
+    offset = HEADER.size + n * NAME_SIZE
+    offset += -offset % 8
+    return (offset, offset + table_size(n, width))
+
+
+class Publisher(object):
+    """
+    Monitor PVs and publish their latest values in a shared-memory segment
+
+    The segment is a file of fixed layout: a header, the PV names and a
+    :class:`.shard.SharedTable` holding the value, timestamp, alarm state and
+    connection state of each PV. Each PV slot is written under its own
+    sequence counter, so a :class:`.Reader` in another process gets a
+    consistent copy without locks and without any Channel Access traffic.
+    The segment is built under a temporary name and renamed into place, so
+    readers never see it half written. There should be a single publisher
+    per segment.
+
+    Parameters
+    ----------
+    segment : str
+        Name of the segment in :data:`SHM_DIR`, or a path
+
+    pvs : list of :class:`.Pv` or str
+        The PVs, or PV names looked up with :func:`.add_pv_to_cache`
+
+    width : int, optional
+        Maximum number of elements per value, see :class:`.shard.SharedTable`
+    """
+    def __init__(self, segment, pvs, width=1):
+        self.path = segment_path(segment)
+        self.pvs = []
+        for pv in pvs:
+            if not isinstance(pv, _pvmod.Pv):
+                pv = _pvmod.add_pv_to_cache(pv)
+            if pv not in self.pvs:
+                self.pvs.append(pv)
+        self.__names = []
+        for pv in self.pvs:
+            try:
+                name = pv.name.encode('ascii')
+            except UnicodeError:
+                raise ValueError("PV name is not ASCII: %r" % pv.name)
+            if len(name) > NAME_SIZE:
+                raise ValueError("PV name longer than %d characters: %s"
+                                 % (NAME_SIZE, pv.name))
+            self.__names.append(name)
+        self.width = int(width)
+        self.table = None
+        self.__cb_ids = {}
+        self.__subscribed = []
+
+
+    def __create(self):
+        """
+        Build the segment under a temporary name and move it into place,
+        returning its table
+        """
+        n = len(self.pvs)
+        (offset, size) = _layout(n, self.width)
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            try:
+                os.ftruncate(fd, size)
+                segment = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+            segment[:HEADER.size] = HEADER.pack(MAGIC, n, self.width,
+                                                os.getpid())
+            for (i, name) in enumerate(self.__names):
+                start = HEADER.size + i * NAME_SIZE
+                segment[start:start+len(name)] = name
+            # The arrays keep the mapping alive for as long as they are used
+            table = SharedTable(n, self.width,
+                                np.frombuffer(segment, dtype=np.uint8,
+                                              count=size - offset,
+                                              offset=offset))
+            os.rename(tmp, self.path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+        return table
+
+
+    def start(self):
+        """
+        Create the segment and start publishing. Does nothing if the
+        publisher is already started
+        """
+        if self.table is not None:
+            return
+        self.table = self.__create()
+        self.__subscribed = [pv for pv in self.pvs if not pv.ismonitored]
+        for (i, pv) in enumerate(self.pvs):
+            self.__cb_ids[pv.name] = _publish(self.table, i, pv)
+            if not pv.isconnected:
+                try:
+                    pv.create_channel()
+                except _pvmod.pyca.pyexc:
+                    pass # The channel is already searching for the IOC
+        _pvmod.pyca.flush_io()
+
+
+    def stop(self, unlink=True):
+        """
+        Stop publishing and stop monitoring the PVs that :meth:`.start`
+        subscribed to
+
+        The mapping is released once the callbacks still running, if any,
+        and the users of :attr:`table` are done with it.
+
+        Parameters
+        ----------
+        unlink : bool, optional
+            Remove the segment. Readers that have it open keep the last
+            values
+        """
+        for pv in self.pvs:
+            ids = self.__cb_ids.pop(pv.name, None)
+            if ids is not None:
+                pv.del_connection_callback(ids[0])
+                pv.del_monitor_callback(ids[1])
+        for pv in self.__subscribed:
+            if pv.ismonitored:
+                pv.monitor_stop()
+        self.__subscribed = []
+        self.table = None
+        if unlink:
+            try:
+                os.unlink(self.path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+
+class Reader(object):
+    """
+    Read the latest PV values from a segment written by a :class:`.Publisher`
+
+    Lookups go through a dictionary of PV names to slots and read the
+    mapped memory directly. No Channel Access connection is made. A read
+    raises ``pyca.pyexc`` if the publisher died while writing the slot.
+
+    Parameters
+    ----------
+    segment : str
+        Name of the segment in :data:`SHM_DIR`, or a path
+
+    Attributes
+    ----------
+    names : list of str
+        The published PV names, in slot order
+
+    table : :class:`.shard.SharedTable`
+        The mapped table, whose ``values`` and ``header`` arrays give direct
+        read-only access to every slot, without consistency checks. The
+        arrays keep the mapping alive, even after :meth:`.close`
+    """
+    def __init__(self, segment):
+        self.path = segment_path(segment)
+        f = open(self.path, 'rb')
+        try:
+            segment = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        (magic, n, width, self.pid) = HEADER.unpack(segment[:HEADER.size])
+        if magic != MAGIC:
+            raise ValueError("%s is not a PV segment" % self.path)
+        self.names = []
+        for i in range(n):
+            start = HEADER.size + i * NAME_SIZE
+            name = segment[start:start+NAME_SIZE].rstrip(b'\0')
+            self.names.append(str(name.decode('ascii')))
+        self.index = dict((name, i) for (i, name) in enumerate(self.names))
+        (offset, size) = _layout(n, width)
+        self.table = SharedTable(n, width,
+                                 np.frombuffer(segment, dtype=np.uint8,
+                                               count=size - offset,
+                                               offset=offset))
+
+
+    def __contains__(self, pvname):
+        return pvname in self.index
+
+
+    def read(self, pvname, timeout=1.0):
+        """
+        Return the latest update of a PV as a :class:`.shard.Entry`
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum time in seconds to retry while the slot is being written
+
+        Raises
+        ------
+        KeyError
+            If the PV is not published in the segment
+
+        pyca.pyexc
+            If the publisher died while writing the slot, or the slot stays
+            busy for timeout seconds
+        """
+        return self.table.read(self.index[pvname], timeout,
+                               self.publisher_alive)
+
+
+    def value(self, pvname):
+        """
+        Return the latest value of a PV, or None before its first update
+        """
+        return self.read(pvname).value
+
+
+    def snapshot(self):
+        """
+        Return the latest update of every PV
+
+        Returns
+        -------
+        entries : dict
+            PV name / :class:`.shard.Entry` pairings
+        """
+        return dict((name, self.read(name)) for name in self.names)
+
+
+    def publisher_alive(self):
+        """
+        Return whether the process that created the segment is still running
+        """
+        try:
+            os.kill(self.pid, 0)
+        except OSError as e:
+            return e.errno == errno.EPERM
+        return True
+
+
+    def close(self):
+        """
+        Release the segment. It is unmapped once no array taken from
+        :attr:`table` remains
+        """
+        self.table = None
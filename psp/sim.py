@@ -0,0 +1,601 @@
+"""
+   Simulated Channel Access backend
+
+   A pure-Python stand-in for the ``pyca`` extension module. Simulated PVs
+   live in an in-process registry and every Channel Access callback is run on
+   a single background thread, mimicking the auxiliary thread that pyca uses
+   for its callbacks. Select it for the whole package by setting the
+   environment variable ``PSP_BACKEND=sim`` before importing :mod:`psp`.
+
+   Simulated PVs are created with :func:`add_pv`, or loaded from a JSON file
+   with :func:`load`. If the environment variable ``PSP_SIM_PVS`` names such a
+   file it is loaded on import, which lets the command line tools run against
+   the simulator unchanged.
+"""
+from __future__ import print_function
+import os
+import json
+import time
+import atexit
+import heapq
+import random
+import threading
+import traceback
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#Constants mirrored from pyca
+epoch = 631152000
+
+DBE_VALUE    = 1
+DBE_LOG      = 2
+DBE_ALARM    = 4
+DBE_PROPERTY = 8
+
+NO_ALARM    = 0
+MINOR_ALARM = 1
+MAJOR_ALARM = 2
+INVALID_ALARM = 3
+
+severity = ['NO_ALARM', 'MINOR', 'MAJOR', 'INVALID']
+alarm = ['NO_ALARM', 'READ', 'WRITE', 'HIHI', 'HIGH', 'LOLO', 'LOW', 'STATE',
+         'COS', 'COMM', 'TIMEOUT', 'HWLIMIT', 'CALC', 'SCAN', 'LINK', 'SOFT',
+         'BAD_SUB', 'UDF', 'DISABLE', 'SIMM', 'READ_ACCESS', 'WRITE_ACCESS']
+
+#Channel states as reported by capv.state
+NEVER_CONNECTED = 0
+PREVIOUSLY_CONNECTED = 1
+CONNECTED = 2
+CLOSED = 3
+
+
+class pyexc(Exception):
+    pass
+
+
+class caexc(Exception):
+    pass
+
+
+_use_numpy = False
+stats = {'flush_io' : 0, 'get' : 0, 'put' : 0, 'events' : 0}
+
+
+def set_numpy(use_numpy):
+    global _use_numpy
+    _use_numpy = bool(use_numpy)
+
+
+def new_context():
+    pass
+
+
+def attach_context():
+    pass
+
+
+def flush_io():
+    stats['flush_io'] += 1
+
+
+def pend_io(timeout):
+    flush_io()
+
+
+def pend_event(timeout):
+    time.sleep(max(timeout, 0))
+
+
+class _Dispatcher(object):
+    """
+    Single thread running timed Channel Access events in order
+    """
+    def __init__(self):
+        self.pid = os.getpid()
+        self.cond = threading.Condition()
+        self.queue = []
+        self.seq = 0
+        self.thread = None
+        self.running = True
+
+    def schedule(self, delay, fn, *args):
+        if self.pid != os.getpid():
+            # A forked process starts over, as with a new pyca context
+            self.__init__()
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run,
+                                               name='psp-sim-ca')
+                self.thread.daemon = True
+                self.thread.start()
+            self.seq += 1
+            heapq.heappush(self.queue, (time.time() + max(delay, 0),
+                                        self.seq, fn, args))
+            self.cond.notify()
+
+    def in_callback(self):
+        return threading.current_thread() is self.thread
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not None and not self.in_callback():
+            self.thread.join(1.0)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running and (not self.queue
+                                        or self.queue[0][0] > time.time()):
+                    if self.queue:
+                        self.cond.wait(self.queue[0][0] - time.time())
+                    else:
+                        self.cond.wait()
+                if not self.running:
+                    return
+                (_, _, fn, args) = heapq.heappop(self.queue)
+            try:
+                fn(*args)
+            except Exception:
+                traceback.print_exc()
+
+
+_dispatcher = _Dispatcher()
+atexit.register(_dispatcher.stop)
+_records = {}
+_records_lock = threading.Lock()
+
+
+class SimRecord(object):
+    """
+    The IOC side of a simulated PV
+    """
+    def __init__(self, name, value=0.0, type=None, count=None,
+                 enum_strings=None, units='', precision=3, limits=(0, 0),
+                 connect_latency=0.0, latency=0.0, host='localhost:5064',
+                 access=3):
+        self.name = name
+        if count is None:
+            count = 1 if _is_scalar(value) else len(value)
+        if type is None:
+            type = _guess_type(value, enum_strings)
+        self.type = type
+        self.count = count
+        self.enum_strings = tuple(enum_strings or ())
+        self.units = units
+        self.precision = precision
+        self.limits = limits
+        self.connect_latency = connect_latency
+        self.latency = latency
+        self.host = host
+        self.access = access
+        self.online = True
+        self.channels = []
+        self.severity = NO_ALARM
+        self.status = NO_ALARM
+        self.timer = None
+        self.value = value
+        self.stamp()
+
+    def stamp(self):
+        now = time.time()
+        self.secs = int(now) - epoch
+        self.nsec = int((now % 1) * 1e9)
+
+    def process(self, value, sevr=None, stat=None):
+        mask = DBE_VALUE | DBE_LOG
+        self.value = value
+        if sevr is not None and (sevr, stat) != (self.severity, self.status):
+            self.severity = sevr
+            self.status = stat or NO_ALARM
+            mask |= DBE_ALARM
+        self.stamp()
+        self.post(mask)
+
+    def alarm(self, sevr, stat):
+        self.severity = sevr
+        self.status = stat
+        self.stamp()
+        self.post(DBE_ALARM)
+
+    def post(self, mask):
+        for ch in list(self.channels):
+            ch._post(mask)
+
+
+def _is_scalar(value):
+    if isinstance(value, (str, bytes)):
+        return True
+    try:
+        len(value)
+    except TypeError:
+        return True
+    return False
+
+
+def _guess_type(value, enum_strings):
+    if enum_strings:
+        return 'DBF_ENUM'
+    if not _is_scalar(value):
+        value = value[0]
+    if isinstance(value, (str, bytes)):
+        return 'DBF_STRING'
+    if isinstance(value, bool) or isinstance(value, int):
+        return 'DBF_LONG'
+    return 'DBF_DOUBLE'
+
+
+def add_pv(name, value=0.0, **kw):
+    """
+    Create or replace a simulated PV
+
+    Parameters
+    ----------
+    name : str
+        Name of the PV
+
+    value : float, int, str or sequence
+        Initial value. Sequences create waveform records
+
+    kw :
+        Any of ``type``, ``count``, ``enum_strings``, ``units``,
+        ``precision``, ``limits``, ``connect_latency``, ``latency``, ``host``
+        and ``access``. Latencies are in seconds
+
+    Returns
+    -------
+    record : SimRecord
+    """
+    rec = SimRecord(name, value, **kw)
+    with _records_lock:
+        old = _records.get(name)
+        _records[name] = rec
+    if old is not None:
+        old.timer = None
+    return rec
+
+
+def load(path):
+    """
+    Create simulated PVs from a JSON file
+
+    The file holds an object of PV name / definition pairings. Each
+    definition holds the keyword arguments of :func:`add_pv`, plus an
+    optional ``rate`` in updates per second passed to :func:`start_updates`.
+
+    .. code-block:: json
+
+        {"SIM:TEMP" : {"value" : 20.0, "units" : "C", "rate" : 10},
+         "SIM:MODE" : {"value" : 0, "enum_strings" : ["Off", "On"]},
+         "SIM:WAVE" : {"value" : [0, 0, 0, 0], "connect_latency" : 0.1}}
+    """
+    f = open(path)
+    try:
+        config = json.load(f)
+    finally:
+        f.close()
+    for (name, kw) in config.items():
+        kw = dict((str(k), v) for (k, v) in kw.items())
+        rate = kw.pop('rate', None)
+        add_pv(str(name), **kw)
+        if rate:
+            start_updates(str(name), rate)
+
+
+def remove_pv(name):
+    """
+    Remove a simulated PV, disconnecting every channel to it
+    """
+    disconnect(name)
+    with _records_lock:
+        _records.pop(name, None)
+
+
+def reset():
+    """
+    Remove every simulated PV
+    """
+    for name in list(_records):
+        remove_pv(name)
+
+
+def get_record(name):
+    return _records[name]
+
+
+def set_value(name, value, severity=None, status=None):
+    """
+    Change the value of a simulated PV as if the IOC had processed the record
+    """
+    rec = _records[name]
+    _dispatcher.schedule(rec.latency, rec.process, value, severity, status)
+
+
+def set_alarm(name, sevr, stat):
+    """
+    Change the alarm state of a simulated PV
+    """
+    rec = _records[name]
+    _dispatcher.schedule(rec.latency, rec.alarm, sevr, stat)
+
+
+def disconnect(name):
+    """
+    Simulate the IOC hosting a PV going offline
+    """
+    rec = _records[name]
+    rec.online = False
+    for ch in list(rec.channels):
+        _dispatcher.schedule(0, ch._connection, False)
+
+
+def reconnect(name):
+    """
+    Bring a simulated PV back online
+    """
+    rec = _records[name]
+    rec.online = True
+    for ch in list(rec.channels):
+        _dispatcher.schedule(rec.connect_latency, ch._connection, True)
+
+
+def outage(name, duration, after=0.0):
+    """
+    Take a simulated PV offline for a while
+
+    Parameters
+    ----------
+    name : str
+        Name of the simulated PV
+
+    duration : float
+        Time in seconds the PV stays offline
+
+    after : float, optional
+        Delay in seconds before the outage starts
+    """
+    _dispatcher.schedule(after, disconnect, name)
+    _dispatcher.schedule(after + duration, reconnect, name)
+
+
+def start_updates(name, rate, generator=None):
+    """
+    Periodically update a simulated PV
+
+    Parameters
+    ----------
+    name : str
+        Name of the simulated PV
+
+    rate : float
+        Updates per second
+
+    generator : callable, optional
+        Called with the previous value, returns the next one. By default
+        numeric values perform a small random walk
+    """
+    rec = _records[name]
+    stop_updates(name)
+    if generator is None and rec.type == 'DBF_ENUM':
+        nstates = max(len(rec.enum_strings), 1)
+        generator = lambda value: (value + 1) % nstates
+    elif generator is None:
+        generator = _random_walk
+    period = 1.0 / rate
+    token = object()
+    rec.timer = token
+
+    def tick():
+        if rec.timer is not token:
+            return
+        if rec.online:
+            rec.process(generator(rec.value))
+        _dispatcher.schedule(period, tick)
+
+    _dispatcher.schedule(period, tick)
+
+
+def stop_updates(name):
+    """
+    Stop periodic updates started by :func:`start_updates`
+    """
+    _records[name].timer = None
+
+
+def _random_walk(value):
+    if _is_scalar(value):
+        if isinstance(value, (str, bytes)):
+            return value
+        if isinstance(value, int):
+            return value + random.choice((-1, 1))
+        return value + random.gauss(0, 1)
+    if np is not None:
+        return np.asarray(value) + np.random.normal(0, 1, len(value))
+    return [v + random.gauss(0, 1) for v in value]
+
+
+class capv(object):
+    """
+    Simulated Channel Access channel with the interface of pyca.capv
+    """
+    def __init__(self, name):
+        self.data = {}
+        self.name = name
+        self.connect_cb = None
+        self.monitor_cb = None
+        self.getevt_cb = None
+        self.putevt_cb = None
+        self.use_numpy = None
+        self._record = None
+        self._state = NEVER_CONNECTED
+        self._connected = False
+        self._sub = None
+        # Incremented by clear_channel, which drops the pending callbacks
+        self._channel_id = 0
+
+    # Channel management
+    def create_channel(self):
+        if self._record is not None:
+            raise pyexc("channel already exists for PV %s" % self.name)
+        rec = _records.get(self.name)
+        self._record = rec or False
+        if rec:
+            rec.channels.append(self)
+            if rec.online:
+                _dispatcher.schedule(rec.connect_latency, self._connection,
+                                     True)
+
+    def clear_channel(self):
+        if self._record is None:
+            raise pyexc("channel is not open for PV %s" % self.name)
+        if self._record and self in self._record.channels:
+            self._record.channels.remove(self)
+        self._record = None
+        self._connected = False
+        self._sub = None
+        self._state = CLOSED
+        self._channel_id += 1
+
+    def subscribe_channel(self, mask, ctrl, count):
+        rec = self._check()
+        self._sub = (mask, ctrl, count)
+        _dispatcher.schedule(rec.latency, self._post, mask)
+
+    def unsubscribe_channel(self):
+        self._sub = None
+
+    def get_data(self, ctrl, timeout, count):
+        rec = self._check()
+        stats['get'] += 1
+        if timeout is None or timeout >= 0:
+            if _dispatcher.in_callback():
+                raise caexc("cannot wait for data inside a callback")
+            if rec.latency:
+                if timeout and rec.latency > timeout:
+                    time.sleep(timeout)
+                    raise pyexc("get timedout for PV %s" % self.name)
+                time.sleep(rec.latency)
+            self._fill(rec, ctrl, count)
+        else:
+            _dispatcher.schedule(rec.latency, self._getevt, ctrl, count,
+                                 self._channel_id)
+
+    def put_data(self, value, timeout):
+        rec = self._check()
+        stats['put'] += 1
+        if rec.access & 2 == 0:
+            raise caexc("no write access to PV %s" % self.name)
+        if timeout is None or timeout >= 0:
+            if rec.latency:
+                time.sleep(rec.latency)
+            done = threading.Event()
+            _dispatcher.schedule(0, self._record.process, value)
+            _dispatcher.schedule(0, done.set)
+            if not _dispatcher.in_callback():
+                done.wait(timeout or None)
+        else:
+            _dispatcher.schedule(rec.latency, self._putevt, value,
+                                 self._channel_id)
+
+    def get_enum_strings(self, timeout):
+        rec = self._check()
+        if rec.type != 'DBF_ENUM':
+            raise pyexc("PV %s is not an enum" % self.name)
+        if rec.latency and timeout and timeout > 0:
+            time.sleep(rec.latency)
+        self.data['enum_set'] = rec.enum_strings
+
+    # Channel information
+    def state(self):
+        return self._state
+
+    def host(self):
+        return self._check().host
+
+    def rwaccess(self):
+        return self._check().access
+
+    def type(self):
+        return self._check().type
+
+    def count(self):
+        return self._check().count
+
+    # Simulation internals, called on the dispatcher thread
+    def _check(self):
+        if not self._connected:
+            raise pyexc("channel not connected for PV %s" % self.name)
+        return self._record
+
+    def _connection(self, isconnected):
+        if not self._record:
+            return
+        self._connected = isconnected
+        self._state = CONNECTED if isconnected else PREVIOUSLY_CONNECTED
+        if self.connect_cb is not None:
+            self.connect_cb(isconnected)
+        if isconnected and self._sub is not None:
+            self._post(self._sub[0])
+
+    def _fill(self, rec, ctrl, count):
+        value = rec.value
+        if rec.count > 1 or not _is_scalar(value):
+            value = list(value)[:count or rec.count]
+            use_numpy = self.use_numpy
+            if use_numpy is None:
+                use_numpy = _use_numpy
+            if use_numpy and np is not None:
+                value = np.array(value)
+            else:
+                value = tuple(value)
+        data = self.data
+        data['value'] = value
+        data['status'] = rec.status
+        data['severity'] = rec.severity
+        if ctrl:
+            data['units'] = rec.units
+            data['precision'] = rec.precision
+            for key in ('display', 'warn', 'alarm', 'ctrl'):
+                data[key + '_llim'] = rec.limits[0]
+                data[key + '_hlim'] = rec.limits[1]
+        else:
+            data['secs'] = rec.secs
+            data['nsec'] = rec.nsec
+
+    def _post(self, mask):
+        if self._sub is None or not self._connected:
+            return
+        (sub_mask, ctrl, count) = self._sub
+        if not sub_mask & mask:
+            return
+        stats['events'] += 1
+        self._fill(self._record, ctrl, count)
+        if self.monitor_cb is not None:
+            self.monitor_cb(None)
+
+    def _getevt(self, ctrl, count, channel_id):
+        if not self._connected or channel_id != self._channel_id:
+            return
+        self._fill(self._record, ctrl, count)
+        if self.getevt_cb is not None:
+            self.getevt_cb(None)
+
+    def _putevt(self, value, channel_id):
+        if channel_id != self._channel_id:
+            # Like CA, a cleared channel never calls back
+            return
+        if not self._connected:
+            if self.putevt_cb is not None:
+                self.putevt_cb('channel disconnected')
+            return
+        self._record.process(value)
+        if self.putevt_cb is not None:
+            self.putevt_cb(None)
+
+
+if os.environ.get('PSP_SIM_PVS'):
+    load(os.environ['PSP_SIM_PVS'])
@@ -0,0 +1,131 @@
+import numpy as np
+
+"""
+   Streaming statistics for PV monitor updates
+"""
+
+class RunningStats(object):
+    """
+    Running statistics updated one sample at a time
+
+    The mean and variance are accumulated with Welford's algorithm, so each
+    update and each query takes constant time and no samples are kept.
+    Waveforms are handled element by element, every statistic then being an
+    array the length of the waveform. If the waveform length changes, the
+    statistics are restarted.
+
+    Parameters
+    ----------
+    ewma : float, optional
+        Weight of the newest sample in an exponentially weighted moving
+        average, between 0 and 1. By default no moving average is kept
+
+    Attributes
+    ----------
+    num : int
+        Number of samples seen since the last clear
+    """
+    def __init__(self, ewma=None):
+        if ewma is not None and not 0 < ewma <= 1:
+            raise ValueError('ewma must be between 0 and 1')
+        self.alpha = ewma
+        self.clear()
+
+
+    def clear(self):
+        """
+        Forget all samples
+        """
+        self.num  = 0
+        self.mean = np.nan
+        self.min  = np.nan
+        self.max  = np.nan
+        self.ewma = np.nan
+        self.__m2 = 0.0
+
+
+    def add(self, value):
+        """
+        Add a sample
+
+        Parameters
+        ----------
+        value : float, int or array
+            A scalar, or a waveform of the same length as previous samples
+        """
+        if np.ndim(value) == 0:
+            self.__add_scalar(float(value))
+        else:
+            self.__add_array(np.asarray(value, dtype=float).ravel())
+
+
+    def __add_scalar(self, x):
+        self.num += 1
+        if self.num == 1:
+            self.mean = self.min = self.max = self.ewma = x
+            self.__m2 = 0.0
+            return
+        delta = x - self.mean
+        self.mean += delta / self.num
+        self.__m2 += delta * (x - self.mean)
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+        if self.alpha is not None:
+            self.ewma += self.alpha * (x - self.ewma)
+
+
+    def __add_array(self, x):
+        if self.num == 0 or np.shape(self.mean) != x.shape:
+            self.num  = 1
+            self.mean = x.copy()
+            self.min  = x.copy()
+            self.max  = x.copy()
+            self.ewma = x.copy()
+            self.__m2 = np.zeros_like(x)
+            return
+        self.num += 1
+        delta = x - self.mean
+        self.mean += delta / self.num
+        self.__m2 += delta * (x - self.mean)
+        np.minimum(self.min, x, out=self.min)
+        np.maximum(self.max, x, out=self.max)
+        if self.alpha is not None:
+            self.ewma += self.alpha * (x - self.ewma)
+
+
+    @property
+    def var(self):
+        """
+        Population variance of the samples
+        """
+        if self.num == 0:
+            return np.nan
+        return self.__m2 / self.num
+
+
+    def get(self):
+        """
+        Return the statistics as a dictionary
+
+        Returns
+        -------
+        ret : dict
+            A dictionary with the keys : mean, std, num, err, min, max and,
+            if a moving average is kept, ewma. If no samples have been added,
+            these will simply be np.nan values
+        """
+        ret = {}
+        ret["num"] = self.num
+        if self.num == 0:
+            ret["mean"]=ret["std"]=ret["err"]=ret["min"]=ret["max"]=np.nan
+        else:
+            ret["mean"] = np.copy(self.mean)[()]
+            ret["std"]  = np.sqrt(self.var)
+            ret["err"]  = ret["std"]/np.sqrt(self.num)
+            ret["min"]  = np.copy(self.min)[()]
+            ret["max"]  = np.copy(self.max)[()]
+        if self.alpha is not None:
+            ret["ewma"] = np.copy(self.ewma)[()]
+        return ret
@@ -1,15 +1,137 @@
-import pyca
-import datetime
+from .backend import pyca
+import time
+import heapq
 import threading
+import atexit
+import traceback
+import numpy as np
 
 def now():
   """ 
   Return string with current date and time
   """
-  now = datetime.datetime.now()
-  return "%04d-%02d-%02d %02d:%02d:%02d.%03d" % (now.year, now.month, now.day,
-                                                 now.hour, now.minute, now.second,
-                                                 int(now.microsecond/1e3))
+  now = time.time()
+  secs = int(now)
+  return timestr(secs, int((now - secs) * 1e9), digits=3)
+
+
+class TimestampFormatter(object):
+    """
+    Format (secs, nsec) POSIX timestamps as strings
+
+    The date and time part is formatted with :func:`time.strftime` once per
+    second and cached, so formatting many timestamps from the same second
+    only costs the formatting of the fraction. The cache holds the most
+    recent maxsize seconds and is safe to share between threads.
+
+    Parameters
+    ----------
+    fmt : str, optional
+        :func:`time.strftime` format of the whole seconds
+
+    utc : bool, optional
+        Format in UTC rather than local time
+
+    maxsize : int, optional
+        Number of seconds to cache
+    """
+    def __init__(self, fmt="%Y-%m-%d %H:%M:%S", utc=False, maxsize=64):
+        self.fmt = fmt
+        self.utc = utc
+        self.maxsize = maxsize
+        self.__cache = {}
+
+    def seconds(self, secs):
+        """
+        Return the formatted whole seconds
+        """
+        text = self.__cache.get(secs)
+        if text is None:
+            if len(self.__cache) >= self.maxsize:
+                self.__cache.clear()
+            convert = time.gmtime if self.utc else time.localtime
+            text = time.strftime(self.fmt, convert(secs))
+            self.__cache[secs] = text
+        return text
+
+    def __call__(self, secs, nsec=0, digits=9):
+        """
+        Return the formatted timestamp
+
+        Parameters
+        ----------
+        secs : int
+            Seconds since the POSIX epoch
+
+        nsec : int, optional
+            Nanoseconds
+
+        digits : int, optional
+            Number of decimals of the fraction of a second, from 0 to 9
+        """
+        text = self.seconds(secs)
+        if digits <= 0:
+            return text
+        return '%s.%0*d' % (text, digits, nsec // 10 ** (9 - digits))
+
+
+timestamp_formatter = TimestampFormatter()
+
+def timestr(secs, nsec=0, digits=9):
+    """
+    Format a (secs, nsec) POSIX timestamp in local time, as
+    ``YYYY-MM-DD HH:MM:SS.nnnnnnnnn``
+
+    See Also
+    --------
+    :class:`.TimestampFormatter`
+    """
+    return timestamp_formatter(secs, nsec, digits)
+
+
+def to_datetime64(timestamps):
+    """
+    Convert (secs, nsec) POSIX timestamps to NumPy datetime64 in one go
+
+    Parameters
+    ----------
+    timestamps : array or sequence
+        A (secs, nsec) pair or a sequence of them, such as
+        :attr:`.Pv.timestamps`
+
+    Returns
+    -------
+    times : numpy.ndarray
+        1-D array of datetime64[ns], in UTC
+    """
+    stamps = np.asarray(timestamps, dtype=np.int64).reshape(-1, 2)
+    nsec = stamps[:, 0] * 1000000000 + stamps[:, 1]
+    return nsec.astype('datetime64[ns]')
+
+
+def to_isoformat(timestamps, local=False, unit='ns'):
+    """
+    Convert (secs, nsec) POSIX timestamps to ISO 8601 strings in one go
+
+    Parameters
+    ----------
+    timestamps : array or sequence
+        A (secs, nsec) pair or a sequence of them, such as
+        :attr:`.Pv.timestamps`
+
+    local : bool, optional
+        Use local time with its UTC offset rather than UTC
+
+    unit : str, optional
+        Smallest unit shown, for example 's', 'ms', 'us' or 'ns'
+
+    Returns
+    -------
+    strings : numpy.ndarray
+        1-D array of strings
+    """
+    return np.datetime_as_string(to_datetime64(timestamps), unit=unit,
+                                 timezone='local' if local else 'UTC')
 
 def set_numpy(use_numpy):
     """
@@ -63,10 +185,147 @@ def all_condition(condition):
     return check_condition(all,condition)
 
 
+def _has_native_timeout():
+    lock = threading.Lock()
+    try:
+        lock.acquire(True, 0.001)
+    except TypeError:
+        return False
+    lock.release()
+    return True
+
+_native_timeout = _has_native_timeout()
+
+def timed_acquire(sem, timeout):
+    """
+    Acquire a lock or semaphore, giving up after timeout seconds
+
+    Locks that accept a timeout are waited on directly. Otherwise the lock is
+    polled with a short, growing sleep, which is how Python 2 implements timed
+    waits. No threads are created in either case.
+
+    Returns
+    -------
+    acquired : bool
+        Whether the lock was acquired
+    """
+    if sem.acquire(False):
+        return True
+    if _native_timeout:
+        try:
+            return sem.acquire(True, timeout)
+        except TypeError:
+            pass
+    deadline = time.time() + timeout
+    delay = 0.00005
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+        if sem.acquire(False):
+            return True
+        delay = min(delay * 2, 0.005)
+
+
+class TimedLock(object):
+    """
+    A lock whose acquire accepts a timeout and that records contention
+
+    The uncontended path is a single non-blocking acquire of a plain lock.
+    Only callers that have to wait are timed, and the counters of acquires
+    that fail are updated under a separate lock.
+
+    Attributes
+    ----------
+    acquisitions : int
+        Number of successful acquires
+
+    contended : int
+        Number of blocking acquires that had to wait for another thread,
+        including those that timed out
+
+    misses : int
+        Number of non-blocking acquires, or with a timeout of 0, that found
+        the lock held
+
+    timeouts : int
+        Number of blocking acquires that gave up after their timeout
+
+    wait_time : float
+        Total time in seconds spent waiting by contended acquires
+
+    max_wait : float
+        Longest time in seconds spent waiting by a single acquire
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__stats_lock = threading.Lock()
+        self.acquisitions = 0
+        self.contended    = 0
+        self.misses       = 0
+        self.timeouts     = 0
+        self.wait_time    = 0.0
+        self.max_wait     = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        """
+        Acquire the lock. Timeout < 0 blocks indefinitely
+        """
+        if self.__lock.acquire(False):
+            self.acquisitions += 1
+            return True
+        if not blocking or timeout == 0:
+            with self.__stats_lock:
+                self.misses += 1
+            return False
+        start = time.time()
+        if timeout < 0:
+            acq = self.__lock.acquire(True)
+        else:
+            acq = timed_acquire(self.__lock, timeout)
+        waited = time.time() - start
+        with self.__stats_lock:
+            self.contended += 1
+            self.wait_time += waited
+            if waited > self.max_wait:
+                self.max_wait = waited
+            if acq:
+                self.acquisitions += 1
+            else:
+                self.timeouts += 1
+        return acq
+
+    def release(self):
+        self.__lock.release()
+
+    def locked(self):
+        return self.__lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+    def stats(self):
+        """
+        Return the contention counters as a dictionary
+        """
+        return {'acquisitions' : self.acquisitions,
+                'contended'    : self.contended,
+                'misses'       : self.misses,
+                'timeouts'     : self.timeouts,
+                'wait_time'    : self.wait_time,
+                'max_wait'     : self.max_wait}
+
+
 class TimeoutSem(object):
     """
     Context manager/wrapper for semaphores, with a timeout on the acquire call.
-    Timeout < 0 blocks indefinitely.
+    Timeout < 0 blocks indefinitely. If the acquire times out,
+    threading.ThreadError is raised in the calling thread.
 
     Usage:
     .. code::
@@ -83,11 +342,10 @@ class TimeoutSem(object):
             self.acq = self.sem.acquire(True)
         elif self.timeout == 0:
             self.acq = self.sem.acquire(False)
+        elif isinstance(self.sem, TimedLock):
+            self.acq = self.sem.acquire(True, self.timeout)
         else:
-            self.tmo = threading.Timer(self.timeout, self.raise_tmo)
-            self.tmo.start()
-            self.acq = self.sem.acquire(True)
-            self.tmo.cancel()
+            self.acq = timed_acquire(self.sem, self.timeout)
         if not self.acq:
             self.raise_tmo()
 
@@ -97,10 +355,83 @@ class TimeoutSem(object):
                 self.sem.release()
         except threading.ThreadError:
             pass
-        try:
-            self.tmo.cancel()
-        except AttributeError:
-            pass
 
     def raise_tmo(self):
         raise threading.ThreadError("semaphore acquire timed out")
+
+
+class Scheduler(object):
+    """
+    A single background thread running delayed calls in order
+
+    The thread is started on the first call to :meth:`schedule`. Calls should
+    be short, as a slow call delays every call scheduled after it.
+    """
+    def __init__(self, name='psp-scheduler'):
+        self.name = name
+        self.__cond = threading.Condition(threading.Lock())
+        self.__queue = []
+        self.__seq = 0
+        self.__thread = None
+        self.__running = True
+
+    def schedule(self, delay, fn, *args):
+        """
+        Run fn(*args) after delay seconds
+
+        Returns
+        -------
+        handle : list
+            Handle that can be given to :meth:`cancel`
+        """
+        with self.__cond:
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run,
+                                                 name=self.name)
+                self.__thread.daemon = True
+                self.__thread.start()
+            self.__seq += 1
+            entry = [time.time() + max(delay, 0), self.__seq, fn, args]
+            heapq.heappush(self.__queue, entry)
+            self.__cond.notify()
+        return entry
+
+    def cancel(self, handle):
+        """
+        Cancel a call that has not run yet
+        """
+        with self.__cond:
+            handle[2] = None
+
+    def stop(self):
+        """
+        Stop the thread, dropping the calls that have not run yet
+        """
+        with self.__cond:
+            self.__running = False
+            self.__cond.notify()
+        if (self.__thread is not None
+                and self.__thread is not threading.current_thread()):
+            self.__thread.join(1.0)
+
+    def __run(self):
+        while True:
+            with self.__cond:
+                while self.__running and (not self.__queue
+                                          or self.__queue[0][0] > time.time()):
+                    if self.__queue:
+                        self.__cond.wait(self.__queue[0][0] - time.time())
+                    else:
+                        self.__cond.wait()
+                if not self.__running:
+                    return
+                (_, _, fn, args) = heapq.heappop(self.__queue)
+            if fn is None:
+                continue
+            try:
+                fn(*args)
+            except Exception:
+                traceback.print_exc()
+
+scheduler = Scheduler()
+atexit.register(scheduler.stop)